@@ -1,4 +1,5 @@
-
+import inspect as _inspect
+import types as _types
 from .module import Module
 c = Block = Lego = M = Module  # alias c.Module as c.Block, c.Lego, c.M
 from .cli import cli
@@ -6,12 +7,38 @@ from .cli import cli
 # from .modules.subspace import subspace
 # from .model import Model
 
-# set the module functions as globals
-for k,v in Module.__dict__.items():
-    globals()[k] = v
-for f in Module.class_functions() + Module.static_functions():
-    globals()[f] = getattr(Module, f)
-for f in Module.self_functions():
-    globals()[f] = lambda *args, **kwargs: getattr(Module(), f)(*args, **kwargs)
-globals()['cli'] = cli
+# the module functions are resolved as globals on first access (PEP 562),
+# so import commune does not walk every function of the Module
+def __getattr__(name:str):
+    try:
+        v = _inspect.getattr_static(Module, name)
+    except AttributeError:
+        raise AttributeError(f"module 'commune' has no attribute '{name}'")
+    if isinstance(v, (staticmethod, classmethod)):
+        v = getattr(Module, name)
+    elif _inspect.isfunction(v):
+        # bound once to the instance shared by the functions that take self
+        v = getattr(_module(), name)
+    globals()[name] = v
+    return v
+
+_instance = None
+def _module() -> Module:
+    global _instance
+    if _instance is None:
+        _instance = Module()
+    return _instance
 
+def __dir__():
+    return sorted(set(globals()) | set(dir(Module)))
+
+# the submodules that Module imports on its own are imported first, as importing a submodule
+# for the first time sets it on commune (shadowing c.cache, c.store, c.kv, c.ports)
+from . import cache, store, kv, ports
+
+# the submodules imported so far are replaced by the functions of the same name (c.module, c.cache),
+# the ones imported later are removed by c.import_module (see Module.unshadow)
+for _k, _v in list(globals().items()):
+    if isinstance(_v, _types.ModuleType) and not _k.startswith('_') and hasattr(Module, _k):
+        del globals()[_k]
+globals()['cli'] = cli
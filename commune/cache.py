@@ -0,0 +1,328 @@
+import commune as c
+import json
+import copy
+import time
+import hashlib
+import inspect
+import asyncio
+import threading
+import functools
+import collections
+import weakref
+from typing import *
+
+class Cache(c.Module):
+    """
+    The function cache behind @c.cache.
+
+    The key of a call is the hash of its arguments bound to the signature (so f(1) and f(x=1)
+    are the same call), without self/cls, update and max_age. key can be a list of argument
+    names to hash, or a function of the arguments that returns the key.
+    Results are kept in an lru memory tier of maxsize entries, and with backend='disk' also
+    in the storage of this module, so they are shared between processes and restarts.
+    A disk result is only kept in memory while its file is unchanged (one stat per call),
+    so a refresh from another process is seen at once.
+    Concurrent misses of a key wait for the first call instead of running the function again.
+    A call with update=True refreshes the key, a max_age argument overrides the ttl, and
+    save=False keeps the result in memory only. A result that cannot be written to disk is
+    still kept in memory. None and error results ({'error': ...} or {'success': False}) are
+    not kept, and dict and list results are copied, so a caller changing its result does 
+    not change the result of the others.
+    """
+    backends = ['memory', 'disk']
+    caches = {} # the name of the function -> Cache
+    control_args = ['update', 'max_age', 'save']
+
+    def __init__(self,
+                 fn:Callable,
+                 ttl:float = None, # seconds a result is fresh, None never expires
+                 maxsize:int = 1024, # the max number of results in memory
+                 backend:str = 'memory', # memory or disk (memory + disk)
+                 key:Union[List[str], Callable] = None # the arguments in the key, or a function of the arguments
+                 ):
+        assert backend in self.backends, f'backend must be one of {self.backends}, not {backend}'
+        self.fn = fn
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.backend = backend
+        self.key_fn = key
+        self.name = f'{fn.__module__}.{fn.__qualname__}'
+        self.signature = inspect.signature(fn)
+        params = list(self.signature.parameters)
+        self.bound_arg = params[0] if len(params) > 0 and params[0] in ['self', 'cls'] else None
+        self.memory = collections.OrderedDict() # key -> (timestamp, value, stat of the disk file, ref of the instance)
+        self.inflight = {} # key -> [threading.Event, result, error] or asyncio.Task
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.waits = self.evictions = self.expirations = 0
+        self.caches[self.name] = self
+        self.wrapper = self.wrap_async() if inspect.iscoroutinefunction(fn) else self.wrap()
+
+    def resolve_call(self, args:tuple, kwargs:dict) -> tuple:
+        """
+        the memory key, the disk key, update, max age, save and the instance of the call
+        """
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        update = bool(arguments.get('update', False))
+        save = bool(arguments.get('save', True))
+        max_age = arguments.get('max_age', None)
+        max_age = self.ttl if max_age == None else max_age
+        owner = None
+        if self.bound_arg != None:
+            owner = arguments[self.bound_arg]
+        if callable(self.key_fn):
+            key = self.key_fn(*args, **kwargs)
+        else:
+            names = self.key_fn or [k for k in arguments if k != self.bound_arg and k not in self.control_args]
+            key = {k: arguments.get(k) for k in names}
+        if owner != None:
+            owner_class = owner if isinstance(owner, type) else type(owner)
+            key = [owner_class.__module__ + '.' + owner_class.__qualname__, key]
+        disk_key = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+        # the results of an instance stay with the instance in memory 
+        # (the id of a collected instance can be reused, so the entries also hold a ref to it)
+        instance = None if owner is None or isinstance(owner, type) else owner
+        memory_key = disk_key if instance == None else (id(instance), disk_key)
+        return memory_key, disk_key, update, max_age, save, instance
+
+    @staticmethod
+    def instance_ref(instance) -> Callable:
+        if instance is None:
+            return lambda: None
+        try:
+            return weakref.ref(instance)
+        except TypeError:
+            # no weakrefs (slots), the entry keeps the instance alive instead
+            return lambda: instance
+
+    def lookup(self, memory_key, disk_key:str, max_age:float, instance = None) -> tuple:
+        """
+        (True, value) if the key is fresh in memory or on disk, else (False, None)
+        """
+        now = time.time()
+        stat_key = None
+        if self.backend == 'disk':
+            path = self.disk_path(disk_key)
+            stat_key = self.disk_stat(path)
+        with self.lock:
+            entry = self.memory.get(memory_key)
+            if entry != None:
+                if entry[2] == stat_key and entry[3]() is instance and (max_age == None or now - entry[0] <= max_age):
+                    self.memory.move_to_end(memory_key)
+                    self.hits += 1
+                    return True, self.copy_value(entry[1])
+                self.expirations += 1
+        if stat_key != None:
+            entry = self.store().get(path)
+            if isinstance(entry, dict) and 'timestamp' in entry and (max_age == None or now - entry['timestamp'] <= max_age):
+                self.disk_hits += 1
+                self.remember(memory_key, entry['data'], timestamp=entry['timestamp'], stat_key=stat_key, instance=instance)
+                return True, self.copy_value(entry['data'])
+        return False, None
+
+    @staticmethod
+    def cacheable(value:Any) -> bool:
+        if value is None:
+            return False
+        if isinstance(value, dict) and ('error' in value or value.get('success') == False):
+            return False
+        return True
+
+    @staticmethod
+    def copy_value(value:Any) -> Any:
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def disk_stat(self, path:str) -> Optional[tuple]:
+        try:
+            return self.store().stat_key(path)
+        except FileNotFoundError:
+            return None
+
+    def remember(self, memory_key, value:Any, disk_key:str = None, timestamp:float = None, stat_key:tuple = None, 
+                 instance = None, save:bool = True):
+        """
+        keeps (a copy of) the value in memory, and on disk if save. the memory entry is valid 
+        while the disk file is unchanged. None and errors are not kept
+        """
+        if not self.cacheable(value):
+            return
+        if disk_key != None and self.backend == 'disk':
+            path = self.disk_path(disk_key)
+            if save:
+                try:
+                    self.put(path, value)
+                except Exception as e:
+                    # the value is kept in memory, and an older result on disk is not served in its place
+                    c.print(f'Could not cache {self.name} on disk {c.detailed_error(e)}', color='red')
+                    try:
+                        self.rm(path)
+                    except Exception:
+                        pass
+            stat_key = self.disk_stat(path)
+        with self.lock:
+            self.memory[memory_key] = (timestamp or time.time(), self.copy_value(value), stat_key, self.instance_ref(instance))
+            self.memory.move_to_end(memory_key)
+            while len(self.memory) > self.maxsize:
+                self.memory.popitem(last=False)
+                self.evictions += 1
+
+    def disk_path(self, disk_key:str) -> str:
+        return f'{self.tmp_dir()}/{self.name}/{disk_key}.json'
+
+    def wrap(self) -> Callable:
+        @functools.wraps(self.fn)
+        def wrapper(*args, **kwargs):
+            memory_key, disk_key, update, max_age, save, instance = self.resolve_call(args, kwargs)
+            if not update:
+                found, value = self.lookup(memory_key, disk_key, max_age, instance=instance)
+                if found:
+                    return value
+            with self.lock:
+                flight = self.inflight.get(memory_key)
+                leader = flight == None
+                if leader:
+                    flight = self.inflight[memory_key] = [threading.Event(), None, None]
+                    self.misses += 1
+                else:
+                    self.waits += 1
+            if not leader:
+                flight[0].wait()
+                if flight[2] != None:
+                    raise flight[2]
+                return self.copy_value(flight[1])
+            try:
+                flight[1] = self.fn(*args, **kwargs)
+                self.remember(memory_key, flight[1], disk_key=disk_key, instance=instance, save=save)
+            except Exception as e:
+                flight[2] = e
+                raise e
+            finally:
+                with self.lock:
+                    self.inflight.pop(memory_key, None)
+                flight[0].set()
+            return flight[1]
+        wrapper.cache = self
+        return wrapper
+
+    def wrap_async(self) -> Callable:
+        @functools.wraps(self.fn)
+        async def wrapper(*args, **kwargs):
+            memory_key, disk_key, update, max_age, save, instance = self.resolve_call(args, kwargs)
+            if not update:
+                found, value = self.lookup(memory_key, disk_key, max_age, instance=instance)
+                if found:
+                    return value
+            task = self.inflight.get(memory_key)
+            if task == None:
+                self.misses += 1
+                async def run():
+                    try:
+                        value = await self.fn(*args, **kwargs)
+                        self.remember(memory_key, value, disk_key=disk_key, instance=instance, save=save)
+                        return value
+                    finally:
+                        self.inflight.pop(memory_key, None)
+                task = self.inflight[memory_key] = asyncio.ensure_future(run())
+                return await asyncio.shield(task)
+            self.waits += 1
+            return self.copy_value(await asyncio.shield(task))
+        wrapper.cache = self
+        return wrapper
+
+    def clear(self) -> dict:
+        with self.lock:
+            self.memory = collections.OrderedDict()
+        if self.backend == 'disk':
+            self.rm(f'{self.tmp_dir()}/{self.name}')
+        return {'success': True, 'msg': f'cleared the cache of {self.name}'}
+
+    def stats(self) -> dict:
+        calls = self.hits + self.disk_hits + self.misses + self.waits
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self.memory),
+                'hit_rate': (calls - self.misses) / calls if calls > 0 else 0}
+
+    @classmethod
+    def all_stats(cls, search:str = None) -> Dict[str, dict]:
+        """
+        the stats of every cached function
+        """
+        return {name: cache.stats() for name, cache in cls.caches.items() if search == None or search in name}
+
+    @classmethod
+    def test(cls):
+        calls = []
+        @c.cache(ttl=60, maxsize=2)
+        def f(x, y=1):
+            calls.append(x)
+            time.sleep(0.05)
+            return x + y
+        assert f(1) == 2 and f(x=1) == 2 and f(1, y=1) == 2 and len(calls) == 1, calls
+        f(2), f(3), f(1)
+        stats = f.cache.stats()
+        assert stats['evictions'] == 2 and stats['size'] == 2, stats
+        # concurrent misses run the function once
+        calls.clear()
+        futures = [c.submit(f, args=[10]) for _ in range(8)]
+        assert [future.result() for future in futures] == [11] * 8
+        assert len(calls) == 1, f'{len(calls)} calls for one key'
+
+        class Model:
+            @c.cache(ttl=60, backend='disk', key=['x'])
+            def forward(self, x, verbose=False, max_age=None, update=False):
+                calls.append(x)
+                return {'x': x}
+        calls.clear()
+        model = Model()
+        model.forward.cache.clear()
+        assert model.forward(1) == model.forward(1, verbose=True) == {'x': 1} and len(calls) == 1
+        model.forward(1, update=True)
+        assert len(calls) == 2
+        # a new instance (or process) gets the result from the disk
+        assert Model().forward(1) == {'x': 1} and len(calls) == 2
+        model.forward(1, max_age=0)
+        assert len(calls) == 3
+        # a result that is not json is kept in memory
+        class Result:
+            pass
+        result = Result()
+        @c.cache(backend='disk')
+        def g(x):
+            calls.append(x)
+            return result
+        g.cache.clear()
+        assert g(1) is result and g(1) is result and calls[-1] == 1 and len(calls) == 4
+        g.cache.clear()
+        # the results of an instance are not served to a new instance with its id
+        @c.cache()
+        def h(self, x):
+            calls.append(x)
+            return x
+        owner = Model()
+        owner_id = id(owner)
+        h(owner, 5)
+        memory_key = next(iter(h.cache.memory))
+        del owner
+        assert memory_key == (owner_id, memory_key[1])
+        # a new instance that got the id of the collected one
+        assert h.cache.lookup(memory_key, memory_key[1], None, instance=Model())[0] == False
+        # a caller changing its result does not change the cached one
+        info = model.forward(1)
+        info['staleness'] = 1
+        assert model.forward(1) == {'x': 1}, 'the cached result was changed by a caller'
+        # None and errors are not cached
+        @c.cache()
+        def e(x):
+            calls.append(x)
+            return None if x == 0 else {'error': 'failed'}
+        n = len(calls)
+        e(0), e(0), e(1), e(1)
+        assert len(calls) == n + 4 and len(e.cache.memory) == 0
+        model.forward.cache.clear()
+        return {'success': True, 'msg': 'cache test passed', 'stats': stats}
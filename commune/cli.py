@@ -1,6 +1,5 @@
 
 import commune as c
-from munch import Munch
 
 class cli(c.Module):
     """
@@ -28,6 +27,7 @@ class cli(c.Module):
         
         output = self.get_output(args)
 
+        from munch import Munch
         if c.is_generator(output):
             for output_item in output:
                 if isinstance(c, Munch):
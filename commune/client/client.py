@@ -5,12 +5,13 @@ import asyncio
 import commune as c
 import aiohttp
 import json
-
-STREAM_PREFIX = 'data: '
-BYTES_PER_MB = 1e6
+import hashlib
 
 class Client(c.Module):
     count = 0
+    session_pool = {} # (loop id, address) -> aiohttp.ClientSession, shared by every client in the process
+    address_cache = {} # (network, module) -> (address, timestamp)
+
     def __init__( 
             self,
             address : str = '0.0.0.0:8000',
@@ -21,9 +22,21 @@ class Client(c.Module):
             loop: 'asyncio.EventLoop' = None, 
             debug: bool = False,
             serializer= 'serializer',
+            pool: bool = True, # reuse keep-alive connections from the session pool
+            limit_per_host: int = 32, # max open connections per address
+            keepalive_timeout: int = 60, # seconds an idle connection is kept open
+            ttl_dns_cache: int = 300, # seconds a resolved host is cached
+            max_address_age: int = 10, # seconds a resolved module name is cached
+            wire: str = 'json', # the wire format of the request, json or msgpack
             **kwargs
         ):
         self.loop = c.get_event_loop() if loop == None else loop
+        self.pool = pool
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.max_address_age = max_address_age
+        self.wire = wire
 
         self.set_client(address = address, network=network)
         self.serializer = c.module(serializer)()
@@ -31,24 +44,26 @@ class Client(c.Module):
         self.start_timestamp = c.timestamp()
         self.save_history = save_history
         self.history_path = history_path
+        if self.save_history:
+            self.history_module = c.module('history').get_sink(self.resolve_path(history_path + '/' + self.key.ss58_address))
         self.debug = debug
 
         
 
-    async def async_forward(self,
+    def get_request(self,
         fn: str,
         args: list = None,
         kwargs: dict = None,
         params: dict = None,
         address : str = None,
-        timeout: int = 10,
-        headers : dict ={'Content-Type': 'application/json'},
+        headers : dict = None,
         message_type = "v0",
         default_fn = 'info',
-        verbose = True,
-        debug = True,
         **extra_kwargs
         ):
+        """
+        builds the signed request for fn, returns the url, input, request and headers
+        """
         if isinstance(args, dict):
             kwargs = args
             args = None
@@ -73,10 +88,14 @@ class Client(c.Module):
                         "timestamp": c.timestamp(),
                         }
         self.count += 1
-        # serialize this into a json string
+        content_type = self.serializer.content_types[self.wire]
+        headers = headers or {'Content-Type': content_type, 'Accept': content_type}
+        # serialize this into a json string (or msgpack bytes, signed as is)
         if message_type == "v0":
-            request = self.serializer.serialize(input)
+            request = self.serializer.serialize(input, mode='msgpack' if self.wire == 'msgpack' else 'str')
             request = self.key.sign(request, return_json=True)
+            if self.wire == 'msgpack':
+                request = self.serializer.dict2msgpack(request)
             # key emoji 
             
         elif message_type == "v1":
@@ -88,6 +107,25 @@ class Client(c.Module):
         url = f"{address}/{fn}/"
         if not url.startswith('http'):
             url = 'http://' + url
+        return url, input, request, headers
+
+    async def async_forward(self,
+        fn: str,
+        args: list = None,
+        kwargs: dict = None,
+        params: dict = None,
+        address : str = None,
+        timeout: int = 10,
+        headers : dict = None,
+        message_type = "v0",
+        default_fn = 'info',
+        verbose = True,
+        debug = True,
+        **extra_kwargs
+        ):
+        url, input, request, headers = self.get_request(fn=fn, args=args, kwargs=kwargs, params=params, 
+                                                        address=address, headers=headers, message_type=message_type, 
+                                                        default_fn=default_fn, **extra_kwargs)
         result = await self.process_request(url, request, headers=headers, timeout=timeout)
 
         c.print(f"🛰️ Call {self.address}/{fn} 🛰️  (🔑{self.key.ss58_address})", color='green', verbose=verbose)
@@ -96,12 +134,85 @@ class Client(c.Module):
             input['fn'] = fn
             input['result'] = result
             input['module']  = self.address
+            input['address'] = self.key.ss58_address
             input['latency'] =  c.time() - input['timestamp']
-            path = self.history_path+ '/' + self.key.ss58_address + '/' + self.address+ '/'+  str(input['timestamp'])
-            self.put(path, input)
+            # buffered in memory, the history module flushes it in the background
+            self.history_module.add(input)
         return result
-    
-    
+
+    async def stream(self, 
+                     fn: str, 
+                     args: list = None, 
+                     kwargs: dict = None, 
+                     timeout: int = 10, 
+                     **extra_kwargs):
+        """
+        yields the items of a streaming function as they arrive
+
+        async for item in client.stream('generate', text='hey'):
+            print(item)
+
+        timeout is the max number of seconds between two items, not for the whole stream. 
+        if the function does not stream, its result is yielded once
+        """
+        url, input, request, headers = self.get_request(fn=fn, args=args, kwargs=kwargs, **extra_kwargs)
+        body = {'data': request} if isinstance(request, bytes) else {'json': request}
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_read=timeout)
+        session = self.get_session() if self.pool else aiohttp.ClientSession()
+        try:
+            async with session.post(url, headers=headers, timeout=client_timeout, **body) as response:
+                if response.content_type == 'text/event-stream':
+                    async for item in self.iter_stream(response):
+                        yield item
+                else:
+                    yield await self.process_response(response, timeout=timeout)
+        finally:
+            if not self.pool:
+                await session.close()
+
+    async def iter_stream(self, response: 'aiohttp.ClientResponse'):
+        """
+        parses the sse events of the server into items. 
+        every item is checked against its id, and the trailing event carries the 
+        signature of the sha256 of all the events, which is checked at the end
+        """
+        hasher = hashlib.sha256()
+        n = 0
+        event = {}
+        async for line in response.content:
+            line = line.decode('utf-8').rstrip('\r\n')
+            if self.debug:
+                c.print(line)
+            if line != '':
+                # a field of the current event, e.g. "data: {...}"
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'data' and 'data' in event:
+                    value = event['data'] + '\n' + value
+                event[field] = value
+                continue
+            # a blank line ends the event
+            if 'data' not in event:
+                event = {}
+                continue
+            event_type = event.get('event', 'data')
+            data = event['data']
+            if event_type == 'data':
+                assert int(event.get('id', n)) == n, f'Missing stream item, expected id {n} got {event.get("id")}'
+                hasher.update(data.encode('utf-8'))
+                yield self.serializer.deserialize(json.loads(data))['data']
+                n += 1
+            elif event_type == 'error':
+                yield json.loads(data)
+                return
+            elif event_type == 'end':
+                end = json.loads(data)
+                assert self.key.verify(end), f'Invalid stream signature'
+                end_data = json.loads(end['data'])
+                assert end_data['n'] == n and end_data['hash'] == hasher.hexdigest(), f'Stream does not match its signature'
+                return
+            event = {}
+
     def age(self):
         return  self.start_timestamp - c.timestamp()
 
@@ -115,11 +226,7 @@ class Client(c.Module):
         if not c.is_address(address):
             module = address # we assume its a module name
             assert module != None, 'module must be provided'
-            namespace = c.get_namespace(search=module, network=network)
-            if module in namespace:
-                address = namespace[module]
-            else:    
-                address = module
+            address = self.resolve_module_address(module, network=network)
         if '://' in address:
             mode = address.split('://')[0]
             assert mode in possible_modes, f'Invalid mode {mode}'
@@ -128,56 +235,83 @@ class Client(c.Module):
         self.address = address
         return {'address': self.address}
 
+    def resolve_module_address(self, module:str, network:str='local') -> str:
+        """
+        resolves the module name to an address, caching the result for max_address_age 
+        seconds so repeated connects do not reload the namespace
+        """
+        cache_key = (network, module)
+        if cache_key in self.address_cache:
+            address, timestamp = self.address_cache[cache_key]
+            if c.time() - timestamp < self.max_address_age:
+                return address
+        address = c.get_address(module, network=network)
+        if address != None:
+            self.address_cache[cache_key] = (address, c.time())
+        else:    
+            address = module
+        return address
+
+    def get_session(self, address:str = None) -> 'aiohttp.ClientSession':
+        """
+        returns the pooled session for the address on the running loop, 
+        creating one with a keep-alive connector if needed. 
+        sessions are bound to their loop, so the pool is keyed by both.
+        """
+        address = address or self.address
+        loop = asyncio.get_running_loop()
+        pool_key = (id(loop), address)
+        session = self.session_pool.get(pool_key, None)
+        if session == None or session.closed or session.loop.is_closed():
+            # drop the sessions of loops that no longer exist
+            for k in [k for k, v in self.session_pool.items() if v.closed or v.loop.is_closed()]:
+                self.session_pool.pop(k, None)
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, 
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.ttl_dns_cache, 
+                                             use_dns_cache=True)
+            session = aiohttp.ClientSession(connector=connector)
+            self.session_pool[pool_key] = session
+        return session
+
+    @classmethod
+    async def close_sessions(cls):
+        loop = asyncio.get_running_loop()
+        for k in [k for k in cls.session_pool if k[0] == id(loop)]:
+            await cls.session_pool.pop(k).close()
+        return {'success': True, 'msg': 'closed sessions', 'sessions': len(cls.session_pool)}
+
     async def process_request(self, url:str, request: dict, headers=None, timeout:int=10):
-        # start a client session and send the request
+        # send the request over a pooled keep-alive session, or a one off session if pool is False
+        if self.pool:
+            session = self.get_session()
+            return await self.post(session, url=url, request=request, headers=headers, timeout=timeout)
         async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=request, headers=headers) as response:
-                
-                if response.content_type == 'application/json':
-                    result = await asyncio.wait_for(response.json(), timeout=timeout)
+            return await self.post(session, url=url, request=request, headers=headers, timeout=timeout)
+
+    async def post(self, session: 'aiohttp.ClientSession', url:str, request: dict, headers=None, timeout:int=10):
+        body = {'data': request} if isinstance(request, bytes) else {'json': request}
+        async with session.post(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout), **body) as response:
+            return await self.process_response(response, timeout=timeout)
+
+    async def process_response(self, response: 'aiohttp.ClientResponse', timeout:int=10):
+        if response.content_type == 'application/json':
+            result = await asyncio.wait_for(response.json(), timeout=timeout)
+
+        elif response.content_type == self.serializer.content_types['msgpack']:
+            result = await asyncio.wait_for(response.read(), timeout=timeout)
+            result = self.serializer.msgpack2dict(result)
+            # the signed payload is the msgpack of the result, with raw bytes for arrays
+            return self.serializer.deserialize(result['data'])
+    
+        elif response.content_type == 'text/plain':
+            result = await asyncio.wait_for(response.text(), timeout=timeout)
         
-                elif response.content_type == 'text/plain':
-                    result = await asyncio.wait_for(response.text(), timeout=timeout)
-                
-                elif response.content_type == 'text/event-stream':
-                    if self.debug:
-                        progress_bar = c.tqdm(desc='MB per Second', position=0)
-                    result = {}
-                    async for line in response.content:
-
-                        event_data = line.decode('utf-8')
-                        event_bytes  = len(event_data)
-                        
-                        if self.debug :
-                            progress_bar.update(event_bytes/(BYTES_PER_MB))
-                        
-                        # remove the "data: " prefix
-                        if event_data.startswith(STREAM_PREFIX):
-                            event_data = event_data[len(STREAM_PREFIX):]
-
-                        event_data = event_data.strip()
-                        
-                        # skip empty lines
-                        if event_data == "":
-                            continue
-
-                        # if the data is formatted as a json string, load it {data: ...}
-                        if isinstance(event_data, bytes):
-                            event_data = event_data.decode('utf-8')
-
-                        # if the data is formatted as a json string, load it {data: ...}
-                        if isinstance(event_data, str):
-                            if event_data.startswith('{') and event_data.endswith('}') and 'data' in event_data:
-                                event_data = json.loads(event_data)['data']
-                            result += [event_data]
-                        
-                    # process the result if its a json string
-                    if result.startswith('{') and result.endswith('}') or \
-                        result.startswith('[') and result.endswith(']'):
-                        result = ''.join(result)
-                        result = json.loads(result)
-                else:
-                    raise ValueError(f"Invalid response content type: {response.content_type}")
+        elif response.content_type == 'text/event-stream':
+            # collect the stream, use client.stream to get the items as they arrive
+            return [item async for item in self.iter_stream(response)]
+        else:
+            raise ValueError(f"Invalid response content type: {response.content_type}")
         if type(result) in [str, dict]:
             result = self.serializer.deserialize(result)
         if isinstance(result, dict) and 'data' in result:
@@ -186,9 +320,12 @@ class Client(c.Module):
         return result
 
     @classmethod
-    def history(cls, key=None, history_path='history'):
+    def history(cls, key=None, history_path='history', **kwargs):
+        """
+        the calls made with the key, kwargs filter by fn, start, end and n
+        """
         key = c.get_key(key)
-        return cls.ls(history_path + '/' + key.ss58_address)
+        return c.module('history').get_sink(cls.resolve_path(history_path + '/' + key.ss58_address)).query(**kwargs)
     
     def process_output(self, result):
         ## handles 
@@ -201,7 +338,8 @@ class Client(c.Module):
             return result
         
     def forward(self,*args,return_future:bool=False, timeout:str=4, **kwargs):
-        forward_future = asyncio.wait_for(self.async_forward(*args, **kwargs), timeout=timeout)
+        # runs on the client's persistent loop so the pooled sessions stay alive between calls
+        forward_future = asyncio.wait_for(self.async_forward(*args, timeout=timeout, **kwargs), timeout=timeout)
         if return_future:
             return forward_future
         else:
@@ -246,6 +384,35 @@ class Client(c.Module):
         return result
             
 
+
+    @classmethod
+    def benchmark(cls, module:str = 'module', fn:str = 'info', n:int = 100, concurrency:int = 16, timeout:int = 10):
+        """
+        compares the throughput of pooled and unpooled clients against a local server
+        """
+        server_name = f'{module}::benchmark'
+        c.serve(module, tag='benchmark')
+        c.wait_for_server(server_name)
+        loop = c.get_event_loop()
+        stats = {}
+        for pool in [False, True]:
+            client = cls(address=server_name, pool=pool, save_history=False)
+            semaphore = asyncio.Semaphore(concurrency)
+            async def call():
+                async with semaphore:
+                    return await client.async_forward(fn=fn, timeout=timeout, verbose=False)
+            t1 = c.time()
+            results = loop.run_until_complete(asyncio.gather(*[call() for _ in range(n)]))
+            elapsed = c.time() - t1
+            mode = 'pooled' if pool else 'unpooled'
+            stats[mode] = {'calls_per_second': c.round(n / elapsed, 4), 
+                           'latency': c.round(elapsed / n, 4),
+                           'errors': sum([c.is_error(r) for r in results])}
+            c.print(mode, stats[mode])
+        loop.run_until_complete(cls.close_sessions())
+        c.kill(server_name)
+        stats['speedup'] = c.round(stats['pooled']['calls_per_second'] / stats['unpooled']['calls_per_second'], 4)
+        return stats
         
     __call__ = forward
 
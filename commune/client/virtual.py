@@ -12,15 +12,28 @@ class VirtualClient:
             self.success = self.module_client.success
         else:
             self.module_client = module
+            self.loop = module.loop
 
     def remote_call(self, *args, return_future= False, timeout:int=10, **kwargs):
         remote_fn = kwargs.pop('remote_fn')
         future =  asyncio.wait_for(self.module_client.async_forward(fn=remote_fn, args=args, kwargs=kwargs, timeout=timeout), timeout=timeout)
         if return_future:
             return future
+        elif self.in_other_thread(self.loop):
+            # the loop of the client runs in another thread (an async caller), so the call is sent to it
+            return asyncio.run_coroutine_threadsafe(future, self.loop).result()
         else:
             loop = asyncio.get_event_loop()
             return loop.run_until_complete(future)
+
+    @staticmethod
+    def in_other_thread(loop) -> bool:
+        if loop == None or not loop.is_running():
+            return False
+        try:
+            return asyncio.get_running_loop() is not loop
+        except RuntimeError:
+            return True
             
     def __str__(self):
         return f'<VirtualClient({self.module_client.address})>'
@@ -28,7 +41,7 @@ class VirtualClient:
     def __repr__(self):
         return self.__str__()
         
-    protected_attributes = [ 'module_client', 'remote_call']
+    protected_attributes = [ 'module_client', 'remote_call', 'loop', 'in_other_thread']
     def __getattr__(self, key):
 
         if key in self.protected_attributes :
@@ -1,53 +1,271 @@
 import commune as c
 import os
+import json
+import time
+import threading
+import collections
+import sqlite3
+import atexit
+from typing import *
 
 class History(c.Module):
-    def __init__(self, folder_path='history'):
-        self.folder_path = self.resolve_path(folder_path)
+    """
+    A request history sink. add() only appends to an in memory ring buffer, and a
+    background thread flushes the buffer into append only jsonl segments (or a sqlite table),
+    so the request path never waits on the disk.
+
+    jsonl segments are named <start_timestamp>_<pid>_<count>.jsonl, so processes sharing a folder
+    never write to the same file. A segment is rotated once it is larger than
+    max_segment_size bytes or older than max_segment_age seconds, and segments older
+    than max_age seconds are removed.
+    """
+    modes = ['jsonl', 'sqlite']
+    sinks = {} # (folder_path, mode) -> History, one flusher per folder in the process
 
+    def __init__(self,
+                 folder_path:str = 'history',
+                 mode:str = 'jsonl',
+                 max_buffer:int = 10000, # the max number of items waiting to be flushed
+                 flush_interval:float = 1.0, # seconds between flushes
+                 max_segment_size:int = 16_000_000, # bytes
+                 max_segment_age:int = 3600, # seconds
+                 max_age:int = None, # seconds a segment is kept, None keeps everything
+                 max_item_delay:int = 600, # seconds an item can be older than the segment it is written to
+                 ):
+        assert mode in self.modes, f'mode must be one of {self.modes}, not {mode}'
+        self.folder_path = self.resolve_path(folder_path)
+        os.makedirs(self.folder_path, exist_ok=True)
+        self.mode = mode
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.max_segment_size = max_segment_size
+        self.max_segment_age = max_segment_age
+        self.max_age = max_age
+        self.max_item_delay = max_item_delay
+        self.segment_count = 0
+        self.buffer = collections.deque(maxlen=max_buffer)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.segment_path = None
+        self.segment_size = 0
+        self.segment_start = 0
+        self.stop_event = threading.Event()
+        self.flusher = c.thread(self.run_flusher, daemon=True)
+        atexit.register(self.close)
 
+    @classmethod
+    def get_sink(cls, folder_path:str = 'history', mode:str = 'jsonl', **kwargs) -> 'History':
+        """
+        the shared sink of the folder, so every server and client writing to it
+        use the same buffer and flusher
+        """
+        sink_key = (cls.resolve_path(folder_path), mode)
+        if sink_key not in cls.sinks:
+            cls.sinks[sink_key] = cls(folder_path=folder_path, mode=mode, **kwargs)
+        return cls.sinks[sink_key]
 
     def set_folder_path(self, path):
         self.folder_path = self.resolve_path(path)
         assert os.path.isdir(self.folder_path), f"History path {self.folder_path} does not exist"
         c.print(f"History path: {self.folder_path}", color='green')
-        
+
     def add(self, item:dict, path=None):
+        """
+        adds the item to the buffer, the oldest items are dropped if the flusher falls behind
+        """
         if 'timestamp' not in item:
             item['timestamp'] = c.timestamp()
-        path = path or (self.folder_path + '/' + str(item['timestamp']))
-        return self.put(path, item)
-    
+        if path != None:
+            item['path'] = path
+        if len(self.buffer) == self.max_buffer:
+            self.dropped += 1
+        self.buffer.append(item)
+        return {'success': True, 'buffer': len(self.buffer)}
+
+    def run_flusher(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                c.print(f'History flush failed {c.detailed_error(e)}', color='red')
+
+    def flush(self) -> dict:
+        with self.lock:
+            items = []
+            while len(self.buffer) > 0:
+                items.append(self.buffer.popleft())
+            if len(items) > 0:
+                if self.mode == 'jsonl':
+                    self.write_segment(items)
+                elif self.mode == 'sqlite':
+                    self.write_sqlite(items)
+            if self.max_age != None:
+                self.rm_old_segments()
+        return {'success': True, 'flushed': len(items), 'dropped': self.dropped}
+
+    def close(self):
+        self.stop_event.set()
+        return self.flush()
+
+    # JSONL SEGMENTS
+
+    def segment_paths(self) -> List[str]:
+        paths = [os.path.join(self.folder_path, f) for f in os.listdir(self.folder_path) if f.endswith('.jsonl')]
+        return sorted(paths, key=self.get_file_timestamp)
+
+    def get_file_timestamp(self, file):
+        return int(file.split('/')[-1].split('.')[0].split('_')[0])
+
+    def write_segment(self, items:List[dict]):
+        now = time.time()
+        if self.segment_path == None or \
+            self.segment_size > self.max_segment_size or \
+            now - self.segment_start > self.max_segment_age:
+            self.segment_start = now
+            self.segment_size = 0
+            self.segment_path = f'{self.folder_path}/{int(now)}_{os.getpid()}_{self.segment_count}.jsonl'
+            self.segment_count += 1
+        lines = ''.join([json.dumps(item, default=str) + '\n' for item in items])
+        with open(self.segment_path, 'a') as f:
+            f.write(lines)
+        self.segment_size += len(lines)
+
+    def rm_old_segments(self):
+        now = time.time()
+        for path in self.segment_paths():
+            if path != self.segment_path and now - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+
+    # SQLITE
+
+    @property
+    def db_path(self):
+        return self.folder_path + '/history.db'
+
+    def get_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, timeout=10)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS history (timestamp REAL, address TEXT, fn TEXT, item TEXT)')
+        db.execute('CREATE INDEX IF NOT EXISTS history_address ON history (address, timestamp)')
+        db.execute('CREATE INDEX IF NOT EXISTS history_fn ON history (fn, timestamp)')
+        return db
+
+    def write_sqlite(self, items:List[dict]):
+        db = self.get_db()
+        rows = [(item['timestamp'], item.get('address'), item.get('fn'), json.dumps(item, default=str)) for item in items]
+        with db:
+            db.executemany('INSERT INTO history VALUES (?, ?, ?, ?)', rows)
+        if self.max_age != None:
+            with db:
+                db.execute('DELETE FROM history WHERE timestamp < ?', (c.timestamp() - self.max_age,))
+        db.close()
+
+    # QUERY
+
+    def query(self,
+              address:str = None,
+              fn:str = None,
+              start:float = None,
+              end:float = None,
+              search:str = None,
+              n:int = None) -> List[dict]:
+        """
+        the items (oldest first) matching the address, fn and time range [start, end].
+        only the segments that overlap the range are read, and lines are only parsed
+        if they contain the searched values. unflushed items are included.
+        """
+        def match(item):
+            return (address == None or item.get('address') == address) and \
+                   (fn == None or item.get('fn') == fn) and \
+                   (start == None or item['timestamp'] >= start) and \
+                   (end == None or item['timestamp'] <= end)
+        items = []
+        if self.mode == 'jsonl':
+            paths = self.segment_paths()
+            for path in paths:
+                # items are added once the request is done, so they can be a bit older than their segment
+                if end != None and self.get_file_timestamp(path) - self.max_item_delay > end:
+                    continue
+                if start != None and os.path.getmtime(path) < start:
+                    continue
+                with open(path) as f:
+                    for line in f:
+                        if (address != None and address not in line) or \
+                           (fn != None and fn not in line) or \
+                           (search != None and search not in line):
+                            continue
+                        item = json.loads(line)
+                        if match(item):
+                            items.append(item)
+        elif self.mode == 'sqlite' and os.path.exists(self.db_path):
+            conditions, values = [], []
+            for condition, value in [('address = ?', address), ('fn = ?', fn), ('timestamp >= ?', start), ('timestamp <= ?', end)]:
+                if value != None:
+                    conditions.append(condition)
+                    values.append(value)
+            if search != None:
+                conditions.append('item LIKE ?')
+                values.append(f'%{search}%')
+            sql = 'SELECT item FROM history'
+            if len(conditions) > 0:
+                sql += ' WHERE ' + ' AND '.join(conditions)
+            sql += ' ORDER BY timestamp'
+            db = self.get_db()
+            items = [json.loads(row[0]) for row in db.execute(sql, values)]
+            db.close()
+        items += [item for item in list(self.buffer) if match(item) and (search == None or search in json.dumps(item, default=str))]
+        if n != None:
+            items = items[-n:]
+        return items
+
     def paths(self, key=None, max_age=None):
         files = []
         current_timestamp = c.timestamp()
-        for file in c.ls(self.folder_path):
+        for file in self.segment_paths():
             timestamp = self.get_file_timestamp(file)
             if max_age and current_timestamp - timestamp > max_age:
                 continue
             files.append(file)
         return files
-    
-    def get_file_timestamp(self, file):
-        return int(file.split('/')[-1].split('.')[0])
 
     def history_paths(self, search=None, n=1000, reverse=False):
-        paths =  self.ls(self.folder_path)
+        paths = self.segment_paths()
         sorted_paths = sorted(paths, reverse=reverse)
         if search:
-            sorted_paths = [p for p in sorted_paths if search in p] 
+            sorted_paths = [p for p in sorted_paths if search in p]
         return sorted_paths[:n]
-    
-    def history(self, search=None, n=100, reverse=True, idx=None):
-        history_paths = self.history_paths(n=n, reverse=reverse, search=search)
-        history = [c.get(s) for s in history_paths]
+
+    def history(self, search=None, n=100, reverse=True, idx=None, **kwargs):
+        history = self.query(search=search, n=n, **kwargs)
+        if reverse:
+            history = history[::-1]
         if idx:
             return history[idx]
         return history
-    
+
     def last_n(self, n=1):
         return self.history(n=n)
-    
-
 
-    
+    @classmethod
+    def test(cls, n:int = 1000):
+        for mode in cls.modes:
+            folder_path = f'test/{mode}'
+            cls.rm(folder_path)
+            self = cls(folder_path=folder_path, mode=mode, max_segment_size=10_000, flush_interval=0.1)
+            t0 = c.time()
+            add_latency = 0
+            for i in range(n):
+                t = c.time()
+                self.add({'fn': 'fn' + str(i % 2), 'address': 'address' + str(i % 10), 'timestamp': t0 + i})
+                add_latency += c.time() - t
+                if i % 100 == 0:
+                    self.flush()
+            assert len(self.query(address='address1')) == n // 10
+            self.close()
+            assert len(self.query(fn='fn0', start=t0, end=t0 + n//2 - 1)) == n // 4
+            assert len(self.query()) == n
+            if mode == 'jsonl':
+                assert len(self.segment_paths()) > 1, 'segments should rotate'
+            cls.rm(folder_path)
+            c.print(f'{mode} add latency {add_latency / n}')
+        return {'success': True, 'msg': 'history test passed'}
@@ -0,0 +1,210 @@
+import commune as c
+import os
+import json
+import threading
+import contextlib
+import sqlite3
+from typing import *
+
+class KV(c.Module):
+    """
+    The kv mode of c.put, c.get, c.ls, c.rm and c.exists: one sqlite database per module
+    (~/.commune/<module>/kv.db) with a row per key, instead of a json file per key.
+    Keys are the paths relative to the module storage dir, so ls is a prefix scan
+    of the primary key instead of a directory walk.
+    """
+    kvs = {} # db path -> KV
+    max_key = '\U0010ffff' # sorts after every other character, the end of a prefix scan
+
+    def __init__(self, path:str = 'kv.db'):
+        self.path = self.resolve_path(path)
+        self.threads = threading.local()
+
+    @classmethod
+    def get_kv(cls, path:str) -> 'KV':
+        if path not in cls.kvs:
+            cls.kvs[path] = cls(path=path)
+        return cls.kvs[path]
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # one connection per thread (and process), as sqlite connections cannot be shared
+        local = self.threads
+        if getattr(local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+            local.db = db
+            local.pid = os.getpid()
+            local.depth = 0
+        return local.db
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        the puts and rms in the block are committed together (blocks can be nested)
+        """
+        db = self.db
+        local = self.threads
+        if local.depth == 0:
+            db.execute('BEGIN IMMEDIATE')
+        local.depth += 1
+        try:
+            yield self
+        except Exception as e:
+            local.depth -= 1
+            if local.depth == 0:
+                db.execute('ROLLBACK')
+            raise e
+        local.depth -= 1
+        if local.depth == 0:
+            db.execute('COMMIT')
+
+    def put(self, key:str, value:Any) -> str:
+        self.db.execute('INSERT OR REPLACE INTO kv VALUES (?, ?)', (key, json.dumps(value)))
+        return key
+
+    def put_many(self, items:Dict[str, Any]) -> int:
+        with self.transaction():
+            self.db.executemany('INSERT OR REPLACE INTO kv VALUES (?, ?)', [(k, json.dumps(v)) for k,v in items.items()])
+        return len(items)
+
+    def get(self, key:str, default:Any = None) -> Any:
+        row = self.db.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        return default if row == None else json.loads(row[0])
+
+    def get_many(self, keys:List[str], default:Any = None) -> Dict[str, Any]:
+        key2value = {}
+        # sqlite has a limit on the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            sql = f'SELECT key, value FROM kv WHERE key IN ({",".join(["?"]*len(chunk))})'
+            key2value.update({k: json.loads(v) for k,v in self.db.execute(sql, chunk)})
+        return {k: key2value.get(k, default) for k in keys}
+
+    def exists(self, key:str) -> bool:
+        return self.db.execute('SELECT 1 FROM kv WHERE key = ?', (key,)).fetchone() != None
+
+    def prefix_range(self, prefix:str) -> tuple:
+        return (prefix, prefix + self.max_key)
+
+    def keys(self, prefix:str = '') -> List[str]:
+        """
+        the keys starting with the prefix, in order
+        """
+        return [k for k, in self.db.execute('SELECT key FROM kv WHERE key >= ? AND key < ? ORDER BY key', self.prefix_range(prefix))]
+
+    def items(self, prefix:str = '') -> Dict[str, Any]:
+        rows = self.db.execute('SELECT key, value FROM kv WHERE key >= ? AND key < ? ORDER BY key', self.prefix_range(prefix))
+        return {k: json.loads(v) for k,v in rows}
+
+    def ls(self, path:str = '', recursive:bool = False) -> List[str]:
+        """
+        the keys (recursive) or the children (like a directory) of the path
+        """
+        prefix = path.rstrip('/') + '/' if path else ''
+        keys = self.keys(prefix)
+        if recursive:
+            return keys
+        return sorted(set(prefix + k[len(prefix):].split('/')[0] for k in keys))
+
+    def rm(self, key:str) -> int:
+        """
+        removes the key, or every key under it if it is a directory
+        """
+        prefix = key.rstrip('/') + '/' if key else ''
+        with self.transaction():
+            n = self.db.execute('DELETE FROM kv WHERE key = ?', (key,)).rowcount
+            n += self.db.execute('DELETE FROM kv WHERE key >= ? AND key < ?', self.prefix_range(prefix)).rowcount
+        return n
+
+    def count(self, prefix:str = '') -> int:
+        return self.db.execute('SELECT COUNT(*) FROM kv WHERE key >= ? AND key < ?', self.prefix_range(prefix)).fetchone()[0]
+
+    @classmethod
+    def migrate(cls, module:str = 'module', rm:bool = False, batch_size:int = 1000) -> dict:
+        """
+        copies the json files of the module storage into its kv database,
+        and removes the files if rm=True
+        """
+        module = c.module(module)
+        storage_dir = module.tmp_dir()
+        self = module.kv()
+        paths = [p for p in c.walk(storage_dir) if p.endswith('.json')]
+        items = {}
+        failed = []
+        for i, path in enumerate(paths):
+            try:
+                with open(path) as f:
+                    items[module.kv_key(path)] = json.loads(f.read())
+            except Exception as e:
+                failed.append(path)
+            if len(items) >= batch_size or i == len(paths) - 1:
+                self.put_many(items)
+                items = {}
+        if rm:
+            for path in paths:
+                if path not in failed:
+                    os.remove(path)
+        return {'success': True, 'migrated': len(paths) - len(failed), 'failed': failed, 'path': self.path}
+
+    @classmethod
+    def test(cls):
+        self = cls(path='test/kv.db')
+        self.rm('')
+        self.put('a/1', {'x': 1})
+        self.put_many({'a/2': [2], 'a/b/3': 3, 'b/4': 'four'})
+        assert self.get('a/1') == {'x': 1} and self.get('missing', 'default') == 'default'
+        assert self.get_many(['a/2', 'b/4', 'missing']) == {'a/2': [2], 'b/4': 'four', 'missing': None}
+        assert self.ls('a') == ['a/1', 'a/2', 'a/b'], self.ls('a')
+        assert self.ls('a', recursive=True) == ['a/1', 'a/2', 'a/b/3']
+        assert self.ls() == ['a', 'b']
+        try:
+            with self.transaction():
+                self.put('c/5', 5)
+                raise ValueError('rollback')
+        except ValueError:
+            pass
+        assert not self.exists('c/5'), 'the transaction was not rolled back'
+        assert self.rm('a') == 3 and self.ls() == ['b']
+        os.remove(self.path)
+        return {'success': True, 'msg': 'kv test passed'}
+
+    @classmethod
+    def benchmark(cls, n:int = 100_000, num_dirs:int = 100, size:int = 10) -> dict:
+        """
+        the put, get and ls of n keys, with the kv and json modes of c.put / c.get
+        """
+        results = {}
+        value = {'data': list(range(size))}
+        keys = [f'benchmark/kv/{i % num_dirs}/{i}' for i in range(n)]
+        for mode in ['json', 'kv']:
+            c.rm('benchmark/kv', mode=mode)
+            t = c.time()
+            for k in keys:
+                c.put(k, value, mode=mode)
+            put_time = c.time() - t
+            t = c.time()
+            for k in keys:
+                c.get(k, mode=mode)
+            get_time = c.time() - t
+            t = c.time()
+            for i in range(num_dirs):
+                c.ls(f'benchmark/kv/{i}', mode=mode)
+            ls_time = c.time() - t
+            results[mode] = {'puts_per_second': int(n / put_time),
+                             'gets_per_second': int(n / get_time),
+                             'ls_per_second': int(num_dirs / ls_time)}
+            c.rm('benchmark/kv', mode=mode)
+        t = c.time()
+        c.kv().put_many({k: value for k in keys})
+        results['kv']['put_many_per_second'] = int(n / (c.time() - t))
+        t = c.time()
+        c.kv().get_many(keys)
+        results['kv']['get_many_per_second'] = int(n / (c.time() - t))
+        c.rm('benchmark/kv', mode='kv')
+        results['speedup'] = {k: round(results['kv'][k] / results['json'][k], 1) for k in results['json']}
+        results['n'] = n
+        return results
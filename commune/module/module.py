@@ -2,10 +2,9 @@ import inspect
 import os
 import concurrent
 import threading
+import functools
 from copy import deepcopy
 from typing import Optional, Union, Dict, List, Any, Tuple, Callable
-from munch import Munch
-from rich.console import Console
 import json
 from glob import glob
 import sys
@@ -42,11 +41,10 @@ class c:
     datapath = os.path.join(libpath, 'data') # the path to the data folder
     modules_path = os.path.join(lib_path, 'modules') # the path to the modules folder
     repo_path  = os.path.dirname(root_path) # the path to the repo
-    console = Console() # the consolve
     blacklist = [] # blacklist of functions to not to access for outside use
     server_mode = 'http' # http, grpc, ws (websocket)
     default_network = 'local' # local, subnet
-    cache = {} # cache for module objects
+    local_cache = {} # cache for module objects
     home = os.path.expanduser('~') # the home directory
     __ss58_format__ = 42 # the ss58 format for the substrate address
 
@@ -83,7 +81,7 @@ class c:
                    kwargs:dict=None,
                    to_munch: bool = True,
                    add_attributes: bool = False,
-                   save_config:bool = False) -> Munch:
+                   save_config:bool = False) -> 'Munch':
         '''
         Set the config as well as its local params
         '''
@@ -161,11 +159,13 @@ class c:
         kwargs.update(extra_kwargs)
         
 
-        return  asyncio.run(module.async_forward(fn=fn, 
-                                                 args=args, 
-                                                 kwargs=kwargs, 
-                                                 params=params, 
-                                                 default_fn=default_fn))
+        # forward on the client's loop instead of asyncio.run, so the pooled sessions are reused
+        return module.forward(fn=fn, 
+                              args=args, 
+                              kwargs=kwargs, 
+                              params=params, 
+                              default_fn=default_fn, 
+                              timeout=timeout)
 
     @classmethod
     async def async_call(cls, *args,**kwargs):
@@ -309,10 +309,11 @@ class c:
         return cls.get_module_path(simple=False).replace('.py', '.yaml')
 
     @classmethod
-    def dict2munch(cls, x:dict, recursive:bool=True)-> Munch:
+    def dict2munch(cls, x:dict, recursive:bool=True)-> 'Munch':
         '''
         Turn dictionary into Munch
         '''
+        from munch import Munch
         if isinstance(x, dict):
             for k,v in x.items():
                 if isinstance(v, dict) and recursive:
@@ -321,10 +322,11 @@ class c:
         return x 
 
     @classmethod
-    def munch2dict(cls, x:Munch, recursive:bool=True)-> dict:
+    def munch2dict(cls, x:'Munch', recursive:bool=True)-> dict:
         '''
         Turn munch object  into dictionary
         '''
+        from munch import Munch
         if isinstance(x, Munch):
             x = dict(x)
             for k,v in x.items():
@@ -334,7 +336,7 @@ class c:
         return x 
 
     @classmethod
-    def munch(cls, x:Dict) -> Munch:
+    def munch(cls, x:Dict) -> 'Munch':
         '''
         Converts a dict to a munch
         '''
@@ -420,6 +422,7 @@ class c:
         path = cls.resolve_path(path)
             
         from commune.utils.dict import save_yaml
+        from munch import Munch
         if isinstance(data, Munch):
             data = cls.munch2dict(deepcopy(data))
             
@@ -431,6 +434,7 @@ class c:
         '''
         Merges the config with the current config
         '''
+        from munch import Munch
         if hasattr(config, 'to_dict'):
             config = config.to_dict()
         
@@ -455,7 +459,7 @@ class c:
     
     
     @classmethod
-    def load_config(cls, path:str=None, to_munch:bool = False) -> Union[Munch, Dict]:
+    def load_config(cls, path:str=None, to_munch:bool = False) -> Union['Munch', Dict]:
         '''
         Args:
             path: The path to the config file
@@ -526,14 +530,16 @@ class c:
     def put(cls, 
             k: str, 
             v: Any,  
-            mode: bool = 'json',
+            mode: str = None,
             encrypt: bool = False, 
             verbose: bool = False, 
-            password: str = None, **kwargs) -> Any:
+            password: str = None,
+            write_behind: bool = False, **kwargs) -> Any:
         '''
         Puts a value in the config
         '''
         encrypt = encrypt or password != None
+        mode = mode or cls.storage_mode
         
         if encrypt or password != None:
             v = c.encrypt(v, password=password)
@@ -544,12 +550,17 @@ class c:
         data = {'data': v, 'encrypted': encrypt, 'timestamp': c.timestamp()}            
         
         # default json 
-        getattr(cls,f'put_{mode}')(k, data)
+        if mode == 'json':
+            # serialized once, for the file and its size
+            data = json.dumps(data)
+            cls.put_json(k, data, write_behind=write_behind)
+            data_size = len(data)
+        else:
+            getattr(cls,f'put_{mode}')(k, data)
+            data_size = c.sizeof(v)
 
         if verbose:
             c.print(f'put {k} = {v}')
-
-        data_size = c.sizeof(v)
     
         return {'k': k, 'data_size': data_size, 'encrypted': encrypt, 'timestamp': c.timestamp()}
     
@@ -557,7 +568,7 @@ class c:
     def get(cls,
             k:str, 
             default: Any=None, 
-            mode:str = 'json',
+            mode:str = None,
             max_age:str = None,
             cache :bool = False,
             full :bool = False,
@@ -572,9 +583,10 @@ class c:
         Return the value
         '''
         if cache:
-            if k in cls.cache:
-                return cls.cache[k]
+            if k in cls.local_cache:
+                return cls.local_cache[k]
 
+        mode = mode or cls.storage_mode
         data = getattr(cls, f'get_{mode}')(k,default=default, **kwargs)
             
 
@@ -604,12 +616,12 @@ class c:
 
         # local cache
         if cache:
-            cls.cache[k] = data
+            cls.local_cache[k] = data
 
         return data
 
     @classmethod
-    def putc(cls, k, v, password=None) -> Munch:
+    def putc(cls, k, v, password=None) -> 'Munch':
         '''
         Saves the config to a yaml file
         '''
@@ -623,7 +635,7 @@ class c:
         return {'success': True, 'msg': f'config({k} = {v})'}
     setc = putc
     @classmethod
-    def rmc(cls, k, password=None) -> Munch:
+    def rmc(cls, k, password=None) -> 'Munch':
         '''
         Saves the config to a yaml file
         '''
@@ -663,7 +675,7 @@ class c:
 
     
     @classmethod
-    def save_config(cls, config:Union[Munch, Dict]= None, path:str=None) -> Munch:
+    def save_config(cls, config:Union['Munch', Dict]= None, path:str=None) -> 'Munch':
 
         '''
         Saves the config to a yaml file
@@ -673,6 +685,7 @@ class c:
         
         path = path if path else cls.config_path()
         
+        from munch import Munch
         if isinstance(config, Munch):
             config = cls.munch2dict(deepcopy(config))
         elif isinstance(config, dict):
@@ -698,7 +711,7 @@ class c:
     def config(cls, 
                    config:dict = None,
                    kwargs:dict=None, 
-                   to_munch:bool = True) -> Munch:
+                   to_munch:bool = True) -> 'Munch':
         '''
         Set the config as well as its local params
         '''
@@ -919,7 +932,22 @@ class c:
     @classmethod
     def import_module(cls, import_path:str) -> 'Object':
         from importlib import import_module
-        return import_module(import_path)
+        module = import_module(import_path)
+        cls.unshadow(import_path)
+        return module
+
+    @staticmethod
+    def unshadow(import_path:str):
+        '''
+        importing commune.{name} for the first time sets the submodule on commune, which 
+        shadows the function c.{name}, so the submodule is removed from commune 
+        (c.{name} is then resolved by commune.__getattr__, the submodule stays in sys.modules)
+        '''
+        names = import_path.split('.')
+        package = sys.modules.get('commune')
+        if len(names) > 1 and names[0] == 'commune' and package != None:
+            if isinstance(package.__dict__.get(names[1]), type(sys)) and hasattr(c, names[1]):
+                delattr(package, names[1])
 
     @classmethod
     def import_object(cls, key:str, verbose: bool = False)-> Any:
@@ -936,6 +964,7 @@ class c:
         if verbose:
             c.print(f'Importing {object_name} from {module}')
         obj =  getattr(import_module(module), object_name)
+        cls.unshadow(module)
         return obj
     
     imp = get_object = importobj = import_object
@@ -1017,32 +1046,26 @@ class c:
     @classmethod
     def used_ports(cls, ports:List[int] = None, ip:str = '0.0.0.0', port_range:Tuple[int, int] = None):
         '''
-        Get availabel ports out of port range
-        
+        Get the used ports out of port range (all of them are checked at once)
+
         Args:
             ports: list of ports
             ip: ip address
-        
+
         '''
         port_range = cls.resolve_port_range(port_range=port_range)
         if ports == None:
             ports = list(range(*port_range))
-        
-        async def check_port(port, ip):
-            return cls.port_used(port=port, ip=ip)
-        
-        used_ports = []
-        jobs = []
-        for port in ports: 
-            jobs += [check_port(port=port, ip=ip)]
-                
-        results = cls.gather(jobs)
-        for port, result in zip(ports, results):
-            if isinstance(result, bool) and result:
-                used_ports += [port]
-            
-        return used_ports
-    
+        return cls.port_allocator().scan(ports, ip=ip)
+
+    @classmethod
+    def port_allocator(cls) -> 'Ports':
+        '''
+        the port allocator of the process (concurrent scans, leased ports)
+        '''
+        from commune.ports import Ports
+        return Ports.get_ports()
+
 
     get_used_ports = used_ports
     
@@ -1131,15 +1154,7 @@ class c:
     def get_available_ports(cls, port_range: List[int] = None , ip:str =None) -> int:
         port_range = cls.resolve_port_range(port_range)
         ip = ip if ip else c.default_ip
-        
-        available_ports = []
-        # return only when the port is available
-        for port in range(*port_range): 
-            if not cls.port_used(port=port, ip=ip):
-                available_ports.append(port)
-                
-                
-        return available_ports
+        return cls.port_allocator().free(list(range(*port_range)), ip=ip)
     available_ports = get_available_ports
     
     
@@ -1147,15 +1162,7 @@ class c:
     def scan_ports(host=None, start_port=1, end_port=50000):
         if host == None:
             host = c.external_ip()
-        import socket
-        open_ports = []
-        for port in range(start_port, end_port + 1):  # ports from start_port to end_port
-            if c.port_used(port=port, ip=host):
-                c.print(f'Port {port} is open', color='green')
-                open_ports.append(port)
-            else:
-                c.print(f'Port {port} is closed', color='red')
-        return open_ports
+        return c.port_allocator().scan(range(start_port, end_port + 1), ip=host)
 
     @classmethod
     def resolve_port(cls, port:int=None, **kwargs):
@@ -1165,10 +1172,10 @@ class c:
         Resolves the port and finds one that is available
         '''
         if port == None or port == 0:
-            port = c.free_port(port, **kwargs)
+            port = c.free_port(**kwargs)
             
         if c.port_used(port):
-            port = c.free_port(port, **kwargs)
+            port = c.free_port(**kwargs)
             
         return int(port)
 
@@ -1179,20 +1186,14 @@ class c:
     
     @classmethod
     def free_ports(cls, n=10, reserve:bool = False, random_selection:bool = False, **kwargs ) -> List[int]:
-        free_ports = []
-        avoid_ports = kwargs.pop('avoid_ports', [])
-        for i in range(n):
-            try:
-                free_ports += [cls.free_port(reserve=reserve, 
-                                            random_selection=random_selection, 
-                                            avoid_ports=avoid_ports, **kwargs)]
-            except Exception as e:
-                c.print(f'Error: {e}', color='red')
-                break
-            avoid_ports += [free_ports[-1]]
-        
-              
-        return free_ports
+        '''
+        up to n free ports, leased together so no other c.serve gets them
+        '''
+        try:
+            return cls.port_allocator().allocate(n=n, reserve=reserve, random_selection=random_selection, strict=False, **kwargs)
+        except Exception as e:
+            c.print(f'Error: {e}', color='red')
+            return []
     
     @classmethod
     def random_port(cls, *args, **kwargs):
@@ -1222,15 +1223,6 @@ class c:
                 
         return ports
     
-    @classmethod
-    def used_ports(cls, ip='0.0.0.0') -> List[int]:
-        used_ports = []
-        for port in range(*cls.port_range()): 
-            if not cls.port_available(port=port, ip=ip):
-                used_ports += [port]
-                
-        return used_ports
-    
     @classmethod
     def free_address(cls, **kwargs):
         return f'{c.ip()}:{c.free_port(**kwargs)}'
@@ -1246,40 +1238,16 @@ class c:
         
         '''
         
-        Get an availabldefe port within the {port_range} [start_port, end_poort] and {ip}
+        Get an available port within the {port_range} [start_port, end_poort] and {ip}.
+        The port is leased for a while (reserved with reserve=True), so concurrent calls get different ports
         '''
-        avoid_ports = avoid_ports if avoid_ports else []
-        
-        if ports == None:
-            port_range = cls.resolve_port_range(port_range)
-            ports = list(range(*port_range))
-            
-            
-            
-        ip = ip if ip else c.default_ip
-
-        if random_selection:
-            ports = c.shuffle(ports)
-            
-        reserved_ports = cls.reserved_ports()
-        # return only when the port is available
-        
-        port = None
-        for port in ports: 
-            if port in reserved_ports:
-                continue
-            if port in avoid_ports:
-                continue
-            
-            if cls.port_available(port=port, ip=ip):
-                if reserve:
-                    cls.reserve_port(port)
-                return port
-        
-    
-    
-
-        raise Exception(f'ports {port_range[0]} to {port_range[1]} are occupied, change the port_range to encompase more ports')
+        return cls.port_allocator().allocate(n=1,
+                                             ports=ports,
+                                             port_range=port_range,
+                                             ip=ip,
+                                             avoid_ports=avoid_ports,
+                                             reserve=reserve,
+                                             random_selection=random_selection)[0]
 
     get_available_port = free_port
 
@@ -1487,7 +1455,7 @@ class c:
         if path.endswith('module/module.py'):
             return 'commune.Module'
         
-        python_classes = cls.find_python_classes(path)
+        python_classes = c.module('tree').path2classes(path, tree=tree)
         if len(python_classes) == 0:
             return None
         
@@ -1647,6 +1615,9 @@ class c:
     @classmethod
     def simple2path(cls, path:str, **kwargs) -> str:
         tree = c.tree(**kwargs)
+        if path not in tree:
+            # the module may be new, update the index (only changed files are read)
+            tree = c.tree(update=True, **kwargs)
         if path not in tree:
             shortcuts = c.shortcuts()
             if path in shortcuts:
@@ -1850,7 +1821,69 @@ class c:
                 return fn(self, *args, **kwargs)
         
         return remotewrap
-    
+
+    @staticmethod
+    def batchable(max_batch_size:int = 32, max_wait:float = 0.01):
+        '''
+        marks a function for dynamic batching when it is served. 
+        the function takes a list of inputs and returns a list of outputs, 
+        while callers still send one input each
+
+        @c.batchable(max_batch_size=16, max_wait=0.01)
+        def generate(self, text:List[str], max_tokens:int=10) -> List[str]:
+            pass
+        '''
+        def decorator(fn):
+            fn.__batch__ = {'max_batch_size': max_batch_size, 'max_wait': max_wait}
+            return fn
+        return decorator
+
+    @staticmethod
+    def cache(ttl:float = None, maxsize:int = 1024, backend:str = 'memory', key = None):
+        '''
+        caches the results of the function by its arguments, in memory (lru of maxsize)
+        or in memory and on disk (backend='disk'), for ttl seconds.
+        see commune/cache.py for the key, update and max_age
+
+        @c.cache(ttl=60, backend='disk', key=['network'])
+        def modules(self, network:str='main', max_age:int=None, update:bool=False):
+            pass
+        '''
+        def decorator(fn):
+            method_type = type(fn) if isinstance(fn, (staticmethod, classmethod)) else None
+            fn = fn.__func__ if method_type != None else fn
+            cache_kwargs = dict(ttl=ttl, maxsize=maxsize, backend=backend, key=key)
+            try:
+                from commune.cache import Cache
+                wrapper = Cache(fn, **cache_kwargs).wrapper
+            except (ImportError, AttributeError):
+                # the functions of Module are decorated before commune.Module exists (Cache is a Module), 
+                # so their Cache is built on the first call (wrapper.cache is set then)
+                lock = threading.Lock()
+                def cached_fn():
+                    with lock:
+                        if not hasattr(wrapper, 'cache'):
+                            from commune.cache import Cache
+                            wrapper.cache = Cache(fn, **cache_kwargs)
+                    return wrapper.cache.wrapper
+                if inspect.iscoroutinefunction(fn):
+                    async def wrapper(*args, **kwargs):
+                        return await cached_fn()(*args, **kwargs)
+                else:
+                    def wrapper(*args, **kwargs):
+                        return cached_fn()(*args, **kwargs)
+                wrapper = functools.wraps(fn)(wrapper)
+            return method_type(wrapper) if method_type != None else wrapper
+        return decorator
+
+    @classmethod
+    def cache_stats(cls, search:str = None) -> Dict[str, dict]:
+        '''
+        the hit rate, misses and evictions of the cached functions
+        '''
+        from commune.cache import Cache
+        return Cache.all_stats(search=search)
+
     # def local
     @classmethod
     def local_node_urls(cls):
@@ -1894,9 +1927,13 @@ class c:
 
         return list(obj.__mro__[1:-1])
 
+    tmp_dirs = {} # class -> tmp dir, as the module path is resolved through the tree
     @classmethod
     def tmp_dir(cls):
-        return f'{c.cache_path()}/{cls.module_path()}'
+        tmp_dir = c.tmp_dirs.get(cls)
+        if tmp_dir == None:
+            tmp_dir = c.tmp_dirs[cls] = f'{c.cache_path()}/{cls.module_path()}'
+        return tmp_dir
     storage_dir = tmp_dir
     
     @classmethod
@@ -1925,16 +1962,18 @@ class c:
                 path:str,
                 default:Any=None,
                 verbose: bool = False,**kwargs):
-        from commune.utils.dict import async_get_json
         path = cls.resolve_path(path=path, extension='json')
 
         c.print(f'Loading json from {path}', color='green', verbose=verbose)
 
-        try:
-            data = cls.get_text(path, **kwargs)
-        except Exception as e:
-            return default
-        if isinstance(data, str):
+        if len(kwargs) == 0:
+            # the whole file, through the read cache of the store
+            data = cls.store().get(path, default=default)
+        else:
+            try:
+                data = cls.get_text(path, **kwargs)
+            except Exception as e:
+                return default
             try:
                 data = json.loads(data)
             except Exception as e:
@@ -1973,26 +2012,110 @@ class c:
                  data:Dict, 
                  meta = None,
                  verbose: bool = False,
-
+                 write_behind: bool = False,
                  **kwargs) -> str:
         if meta != None:
             data = {'data':data, 'meta':meta}
         path = cls.resolve_path(path=path, extension='json')
-        # cls.lock_file(path)
         c.print(f'Putting json from {path}', color='green', verbose=verbose)
-        if isinstance(data, dict):
-            data = json.dumps(data)
-        c.put_text(path, data)
+        if not isinstance(data, dict):
+            data = c.python2str(data)
+        # atomic write (temporary file + rename), or a write behind with write_behind=True
+        cls.store().put(path, data, write_behind=write_behind)
+        return path
+
+    @classmethod
+    def store(cls, **kwargs) -> 'Store':
+        '''
+        the shared json store of the process (read cache, atomic writes, write behind)
+        '''
+        from commune.store import Store
+        return Store.get_store(**kwargs)
+
+    @classmethod
+    def flush(cls) -> dict:
+        '''
+        writes the pending write behind puts
+        '''
+        return cls.store().flush()
+
+    storage_mode = 'json' # the default mode of put, get, ls, rm and exists (json or kv)
+
+    @classmethod
+    def kv(cls) -> 'KV':
+        '''
+        the sqlite key value store of the module (mode='kv')
+        '''
+        from commune.kv import KV
+        return KV.get_kv(cls.tmp_dir() + '/kv.db')
+
+    @classmethod
+    def kv_key(cls, path:str) -> Optional[str]:
+        '''
+        the key of a path in the storage dir, None if the path is outside of it
+        '''
+        tmp_dir = cls.tmp_dir()
+        if path == tmp_dir:
+            return ''
+        if path.startswith(tmp_dir + '/'):
+            path = path[len(tmp_dir)+1:]
+        elif path.startswith('/') or path.startswith('~') or path.startswith('./'):
+            return None
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
         return path
+
+    @classmethod
+    def put_kv(cls, k:str, data:Any, **kwargs) -> str:
+        key = cls.kv_key(k)
+        if key == None:
+            return cls.put_json(k, data)
+        return cls.kv().put(key, data)
+
+    @classmethod
+    def get_kv(cls, k:str, default:Any = None, **kwargs) -> Any:
+        key = cls.kv_key(k)
+        if key == None:
+            return cls.get_json(k, default=default, **kwargs)
+        return cls.kv().get(key, default)
+
+    @classmethod
+    def put_many(cls, k2v:Dict[str, Any], mode:str = None) -> dict:
+        '''
+        puts many values, in one transaction with mode='kv'
+        '''
+        mode = mode or cls.storage_mode
+        if mode != 'kv':
+            return {k: cls.put(k, v, mode=mode) for k,v in k2v.items()}
+        timestamp = c.timestamp()
+        items = {cls.kv_key(k): {'data': v, 'encrypted': False, 'timestamp': timestamp} for k,v in k2v.items()}
+        assert None not in items, 'the keys must be in the storage dir of the module'
+        return {'success': True, 'n': cls.kv().put_many(items), 'timestamp': timestamp}
+
+    @classmethod
+    def get_many(cls, keys:List[str], default:Any = None, mode:str = None) -> Dict[str, Any]:
+        '''
+        gets many values, in one query with mode='kv'
+        '''
+        mode = mode or cls.storage_mode
+        if mode != 'kv':
+            return {k: cls.get(k, default, mode=mode) for k in keys}
+        key2value = cls.kv().get_many([cls.kv_key(k) for k in keys])
+        values = [key2value[cls.kv_key(k)] for k in keys]
+        return {k: v['data'] if isinstance(v, dict) and 'data' in v else default for k,v in zip(keys, values)}
     
     save_json = put_json
     
     @classmethod
-    def file_exists(cls, path:str)-> bool:
+    def file_exists(cls, path:str, mode:str = None)-> bool:
+        mode = mode or cls.storage_mode
+        if mode == 'kv' and cls.kv_key(path) != None:
+            return cls.kv().exists(cls.kv_key(path))
         path = cls.resolve_path(path=path)
-        exists =  os.path.exists(path)
+        store = cls.store()
+        exists =  store.exists(path)
         if not exists and not path.endswith('.json'):
-            exists = os.path.exists(path + '.json')
+            exists = store.exists(path + '.json')
         return exists
 
     exists = exists_json = file_exists 
@@ -2052,15 +2175,23 @@ class c:
         
 
     @classmethod
-    def rm(cls, path, extension=None, mode = 'json'):
+    def rm(cls, path, extension=None, mode = None):
         
         assert isinstance(path, str), f'path must be a string, got {type(path)}'
+        mode = mode or cls.storage_mode
+        if mode == 'kv' and cls.kv_key(path) != None:
+            n = cls.kv().rm(cls.kv_key(path))
+            return {'success': n > 0, 'message':f'{path} removed {n} keys'}
+        mode = 'json' if mode == 'kv' else mode
         path = cls.resolve_path(path=path, extension=extension)
 
         # incase we want to remove the json file
         mode_suffix = f'.{mode}'
-        if not os.path.exists(path) and os.path.exists(path+mode_suffix):
+        store = cls.store()
+        if not store.exists(path) and store.exists(path+mode_suffix):
             path += mode_suffix
+        if store.rm(path):
+            return {'success':True, 'message':f'{path} removed'}
 
         if not os.path.exists(path):
             return {'success':False, 'message':f'{path} does not exist'}
@@ -2104,13 +2235,22 @@ class c:
     @classmethod
     def ls(cls, path:str = '', 
            recursive:bool = False,
-           return_full_path:bool = True):
+           return_full_path:bool = True,
+           mode:str = None):
         """
         provides a list of files in the path 
 
         this path is relative to the module path if you dont specifcy ./ or ~/ or /
         which means its based on the module path
         """
+        mode = mode or cls.storage_mode
+        if mode == 'kv' and cls.kv_key(path) != None:
+            # a prefix scan of the keys, with the keys as the paths in the storage dir
+            key = cls.kv_key(path)
+            keys = cls.kv().ls(key, recursive=recursive)
+            if return_full_path:
+                return [cls.tmp_dir() + '/' + k for k in keys]
+            return [k[len(key):].lstrip('/') for k in keys]
         path = cls.resolve_path(path, extension=None)
         try:
             ls_files = cls.lsdir(path) if not recursive else cls.walk(path)
@@ -2414,6 +2554,7 @@ class c:
 
     @property
     def server_name(self):
+        from munch import Munch
         if not hasattr(self, 'config') or not (isinstance(self.config, Munch)):
             self.config =  Munch({})
 
@@ -2509,8 +2650,8 @@ class c:
 
         return c.module("namespace").server_exists(name=name, network=network,  prefix_match=prefix_match, **kwargs)
     @classmethod
-    def register_server(cls, name: str, address:str, network='local')-> dict:
-        return c.module("namespace").register_server(name=name, address=address, network=network)
+    def register_server(cls, name: str, address:str, network='local', **kwargs)-> dict:
+        return c.module("namespace").register_server(name=name, address=address, network=network, **kwargs)
 
     @classmethod
     def deregister_server(cls, name: str, network:str = 'local')-> dict:
@@ -2664,6 +2805,8 @@ class c:
               mnemonic = None, # mnemonic for the server
               key = None,
               config_keys = ['network'],
+              workers:int = 1, # the number of processes sharing the port, each with its own module
+              worker_id:int = 0, # the id of the worker (0 forks and supervises the others)
               **extra_kwargs
               ):
         if c.is_module(module):
@@ -2698,6 +2841,15 @@ class c:
                     }        
         module_class = c.module(module)
 
+        stop_workers = None
+        if workers > 1 and worker_id == 0:
+            # fork the other workers before the module is created, so every worker initializes its own
+            stop_workers = cls.start_workers(workers=workers, 
+                                             serve_kwargs={'module': module, 'kwargs': dict(kwargs), 'name': name, 
+                                                           'server_network': server_network, 'port': port, 'remote': False, 
+                                                           'max_workers': max_workers, 'free': free, 'key': key, 
+                                                           'workers': workers})
+
         kwargs.update(extra_kwargs)
         if mnemonic != None:
             c.add_key(server_name, mnemonic)
@@ -2715,14 +2867,23 @@ class c:
             port = address.split(':')[-1]   
 
         if c.server_exists(server_name, network=server_network) and not refresh: 
+            if stop_workers != None:
+                stop_workers()
             return {'success':True, 'message':f'Server {server_name} already exists'}
-        c.module(f'server')(module=self, 
+        try:
+            c.module(f'server')(module=self, 
                                           name=name, 
                                           port=port, 
                                           network=server_network, 
                                           max_workers=max_workers, 
                                           free=free, 
-                                          key=key)
+                                          key=key,
+                                          workers=workers,
+                                          worker_id=worker_id)
+        finally:
+            # the workers go down with the server of worker 0
+            if stop_workers != None:
+                stop_workers()
 
         return  {'success':True, 
                      'address':  f'{c.default_ip}:{port}' , 
@@ -2731,6 +2892,63 @@ class c:
                      'module':module}
 
     serve_module = serve
+
+    @classmethod
+    def start_workers(cls, workers:int, serve_kwargs:dict, interval:float = 1.0, timeout:float = 10) -> Callable:
+        """
+        forks the workers 1 to workers-1 of a server and restarts the ones that exit, 
+        returning the function that stops them. the workers are not daemons, so their 
+        modules can start processes of their own
+        """
+        import multiprocessing
+        context = multiprocessing.get_context('fork')
+        parent_pid = os.getpid()
+        lock = threading.Lock()
+        stopped = threading.Event()
+
+        def start(worker_id:int):
+            process = context.Process(target=cls.serve_worker, 
+                                      kwargs={'parent_pid': parent_pid, 'worker_id': worker_id, **serve_kwargs}, 
+                                      daemon=False)
+            process.start()
+            return process
+
+        id2process = {i: start(i) for i in range(1, workers)}
+
+        def supervise():
+            while not stopped.wait(interval):
+                with lock:
+                    for i, process in id2process.items():
+                        if not process.is_alive() and not stopped.is_set():
+                            c.print(f'Worker {i} exited with {process.exitcode}, restarting it', color='red')
+                            process.join()
+                            id2process[i] = start(i)
+
+        def stop():
+            with lock:
+                stopped.set()
+                for process in id2process.values():
+                    process.terminate()
+                for process in id2process.values():
+                    process.join(timeout)
+                    if process.is_alive():
+                        process.kill()
+                        process.join()
+
+        threading.Thread(target=supervise, daemon=True).start()
+        return stop
+
+    @classmethod
+    def serve_worker(cls, parent_pid:int, interval:float = 1.0, **kwargs):
+        """
+        serves a worker of start_workers, exiting if the parent (worker 0) is gone
+        """
+        def watch_parent():
+            while os.getppid() == parent_pid:
+                c.sleep(interval)
+            os._exit(0)
+        threading.Thread(target=watch_parent, daemon=True).start()
+        return cls.serve(**kwargs)
     
     @classmethod
     def functions(cls, search: str=None , include_parents:bool = False, module=None):
@@ -2833,10 +3051,6 @@ class c:
                 module = c.module(module)()
             self = module  
 
-        if c.exists('info'):
-            info = c.get('info', default=None, max_age=max_age)
-            if info != None:
-                return info
         fns = [fn for fn in self.whitelist]
         attributes =[ attr for attr in self.attributes()]
 
@@ -2866,14 +3080,12 @@ class c:
         if commit_hash:
             info['commit_hash'] = c.commit_hash()
 
-        if update:
-            c.set('info', info)
-
         if cost:
             if hasattr(self, 'cost'):
                 info['cost'] = self.cost
         return info
-        
+    # cached for max_age seconds (see c.cache)
+    info = cache.__func__()(info)
     help = info
 
     
@@ -4003,13 +4215,8 @@ class c:
     def resolve_console(cls, console = None, **kwargs):
         if hasattr(cls,'console'):
             return cls.console
-    
-        
-        import logging
-        from rich.logging import RichHandler
+        # rich is imported on the first print, not on import commune
         from rich.console import Console
-        logging.basicConfig(level=logging.DEBUG, handlers=[RichHandler()])   
-            # print the line number
         console = Console()
         cls.console = console
         return console
@@ -4036,7 +4243,7 @@ class c:
     def print(cls, *text:str, 
               color:str=None, 
               verbose:bool = True,
-              console: Console = None,
+              console: 'Console' = None,
               flush:bool = False,
               **kwargs):
               
@@ -4079,11 +4286,11 @@ class c:
     @classmethod
     def status(cls, *args, **kwargs):
         console = cls.resolve_console()
-        return cls.console.status(*args, **kwargs)
+        return console.status(*args, **kwargs)
     @classmethod
     def log(cls, *args, **kwargs):
         console = cls.resolve_console()
-        return cls.console.log(*args, **kwargs)
+        return console.log(*args, **kwargs)
     
     @classmethod
     def test_fns(cls, *args, **kwargs):
@@ -4113,8 +4320,36 @@ class c:
 
         return fn2result
 
-        
-    
+    @classmethod
+    def benchmark_import(cls, n:int = 5, target:float = 0.15, top:int = 10, save:bool = True) -> dict:
+        """
+        the time of import commune in a fresh interpreter (python -X importtime),
+        with the slowest imports. the results are kept in import_time to track regressions
+        """
+        import subprocess
+        import_times = []
+        for i in range(n):
+            output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {cls.libname}'],
+                                    capture_output=True, text=True, cwd=cls.libpath).stderr
+            name2time = {}
+            for line in output.split('\n'):
+                if not line.startswith('import time:') or 'cumulative' in line:
+                    continue
+                self_time, cumulative, name = line.split(':', 1)[1].split('|')
+                name2time[name.strip()] = int(self_time) / 1e6
+                if name.strip() == cls.libname:
+                    import_times.append(int(cumulative) / 1e6)
+        import_time = min(import_times)
+        result = {'import_time': import_time,
+                  'target': target,
+                  'success': import_time < target,
+                  'slowest': dict(sorted(name2time.items(), key=lambda x: -x[1])[:top]),
+                  'timestamp': c.timestamp()}
+        if save:
+            history = cls.get('import_time', [])
+            history.append({k: result[k] for k in ['import_time', 'timestamp']})
+            cls.put('import_time', history)
+        return result
 
     ### TIME LAND ###
     
@@ -4513,11 +4748,11 @@ class c:
     
     @classmethod
     def put_cache(cls,k,v ):
-        cls.cache[k] = v
+        cls.local_cache[k] = v
     
     @classmethod
     def get_cache(cls,k, default=None, **kwargs):
-        v = cls.cache.get(k, default)
+        v = cls.local_cache.get(k, default)
         return v
 
     def auth(self,*args,  key=None, **kwargs):
@@ -4678,10 +4913,9 @@ class c:
     @classmethod
     def reserve_port(cls,port:int = None, var_path='reserved_ports'):
         if port == None:
-            port = cls.free_port()
-        reserved_ports =  cls.get(var_path, {})
-        reserved_ports[str(port)] = {'time': cls.time()}
-        c.put(var_path, reserved_ports)
+            port = cls.free_port(reserve=True)
+        else:
+            cls.port_allocator().reserve([port])
         c.print(f'reserving {port}')
         return {'success':f'reserved port {port}', 'reserved': cls.reserved_ports()}
     
@@ -4690,22 +4924,18 @@ class c:
     
     @classmethod
     def reserved_ports(cls,  var_path='reserved_ports'):
-        return list(map(int, c.get(var_path, {}).keys()))
+        '''
+        the reserved ports and the ports leased to servers that are starting
+        '''
+        return cls.port_allocator().reserved()
     resports = reserved_ports
 
     
     @classmethod
     def unreserve_port(cls,port:int, 
                        var_path='reserved_ports'):
-        reserved_ports =  c.get(var_path, {})
-        
-        port_info = reserved_ports.pop(port,None)
-        if port_info == None:
-            port_info = reserved_ports.pop(str(port),None)
-        
         output = {}
-        if port_info != None:
-            c.put(var_path, reserved_ports)
+        if len(cls.port_allocator().release([port])) > 0:
             output['msg'] = 'port removed'
         else:
             output['msg'] =  f'port {port} doesnt exist, so your good'
@@ -4718,15 +4948,12 @@ class c:
     @classmethod
     def unreserve_ports(cls,*ports, 
                        var_path='reserved_ports' ):
-        reserved_ports =  cls.get(var_path, {})
         if len(ports) == 0:
             # if zero then do all fam, tehe
-            ports = list(reserved_ports.keys())
+            ports = None
         elif len(ports) == 1 and isinstance(ports[0],list):
             ports = ports[0]
-        ports = list(map(str, ports))
-        reserved_ports = {rp:v for rp,v in reserved_ports.items() if not any([p in ports for p in [str(rp), int(rp)]] )}
-        c.put(var_path, reserved_ports)
+        cls.port_allocator().release(ports)
         return cls.reserved_ports()
     
     
@@ -4736,43 +4963,27 @@ class c:
             module = None, 
             n=2, 
             tag=None, 
-            max_workers=10, 
-            parallel=True, 
-            timeout=20, 
-            remote=False,  
+            max_workers=16, # the max number of servers starting at once
+            timeout=60, 
+            zygote=True, # fork the servers from a warm process instead of starting new ones
+            network='local',
             **kwargs):
-
+        """
+        launches n servers of the module in parallel, and waits until they are registered
+        (see server.fleet for the timings of every stage)
+        """
         if module == None:
             module = cls.module_path()
-
-        if tag == None:
-            tag = ''
-
-        futures = []
-        for i in range(n):
-            f = c.submit(c.serve,  
-                            kwargs={'module': module, 'tag':tag + str(i), **kwargs}, 
-                            timeout=timeout)
-            futures += [f]
-        results = []
-        for future in  c.as_completed(futures, timeout=timeout):
-            result = future.result()
-            c.print(result)
-            results += [result]
-
-        return results
-        
+        fleet = c.module('server.fleet')(max_concurrency=max_workers, timeout=timeout, zygote=zygote)
+        try:
+            return fleet.launch(module=module, n=n, tag=tag or '', network=network, kwargs=kwargs)
+        finally:
+            fleet.close()
 
     @classmethod
     def kill_fleet(cls, tag=None, network='local', **kwargs):
-
         path = cls.resolve_server_name(tag=tag)
-        servers = c.servers(path, network=network)
-        executor = c.module('executor')(mode='process')
-        for server in servers:
-            futures += [executor.submit(fn=cls.kill_server, kwargs={'server_name':p, 'network':network})]
-
-        return c.wait(futures)
+        return c.module('server.fleet').kill(search=path, network=network)
 
     executor_cache = {}
     @classmethod
@@ -4992,22 +5203,17 @@ class c:
         return module.dirpath() == c.pwd()
 
     @classmethod
-    def server_many(cls, *modules, n=2, **kwargs):
-
+    def server_many(cls, *modules, max_workers=16, timeout=60, zygote=True, network='local', **kwargs):
+        """
+        launches one server per module in parallel, and waits until they are registered
+        """
         if isinstance(modules[0], list):
             modules = modules[0]
-        
-        futures = []
-        for module in modules:
-            future = c.submit(c.serve, kwargs={'module': module, **kwargs})
-            futures.append(future)
-            
-        results = []
-        for future in c.as_completed(futures):
-            result = future.result()
-            c.print(result)
-            results.append(result)
-        return results
+        fleet = c.module('server.fleet')(max_concurrency=max_workers, timeout=timeout, zygote=zygote)
+        try:
+            return fleet.launch(module=list(modules), network=network, kwargs=kwargs)
+        finally:
+            fleet.close()
     
     
     @classmethod
@@ -7559,27 +7765,8 @@ class c:
         return {'success': True, 'msg': 'cancelled futures'}
        
     @classmethod
-    def cachefn(cls, func, max_age=60, update=False, cache=True, cache_folder='cachefn'):
-        import functools
-        path_name = cache_folder+'/'+func.__name__
-        def wrapper(*args, **kwargs):
-            fn_name = func.__name__
-            cache_params = {'max_age': max_age, 'cache': cache}
-            for k, v in cache_params.items():
-                cache_params[k] = kwargs.pop(k, v)
-
-            
-            if not update:
-                result = cls.get(fn_name, default=None, **cache_params)
-                if result != None:
-                    return result
-
-            result = func(*args, **kwargs)
-            
-            if cache:
-                cls.put(fn_name, result, cache=cache)
-            return result
-        return wrapper
+    def cachefn(cls, func, max_age=60, **kwargs):
+        return c.cache(ttl=max_age, backend='disk')(func)
 
     @classmethod
     def ss58_encode(cls, data:Union[str, bytes], ss58_format=42, **kwargs):
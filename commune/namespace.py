@@ -1,5 +1,9 @@
 import commune as c
 from typing import *
+import os
+import threading
+import sqlite3
+import psutil
 
 # THIS IS WHAT THE INTERNET IS, A BUNCH OF NAMESPACES, AND A BUNCH OF SERVERS, AND A BUNCH OF MODULES.
 # THIS IS THE INTERNET OF INTERNETS.
@@ -13,6 +17,77 @@ class Namespace(c.Module):
 
 
 
+    lease_ttl : int = 60 # seconds a server lease lasts without a heartbeat
+    ip_ttl : int = 600 # seconds the external ip is cached in the process
+
+    @classmethod
+    def registry_path(cls) -> str:
+        return cls.resolve_path('registry.db')
+
+    @classmethod
+    def registry(cls) -> sqlite3.Connection:
+        """
+        the sqlite registry of the local networks. sqlite locks the file, so 
+        servers registering at the same time never overwrite each other.
+        one connection (and cache) per thread and process.
+        """
+        local = cls.registry_local()
+        if not hasattr(local, 'db'):
+            db = sqlite3.connect(cls.registry_path(), timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS servers (network TEXT, name TEXT, address TEXT, pid INTEGER, expires REAL, PRIMARY KEY (network, name))')
+            local.db = db
+            local.network2registry = {}
+            local.migration_checked = set() # the networks checked for a json namespace to migrate
+        return local.db
+
+    @classmethod
+    def registry_local(cls) -> threading.local:
+        local = cls.__dict__.get('registry_threads')
+        if local == None or local.pid != os.getpid():
+            local = threading.local()
+            local.pid = os.getpid()
+            cls.registry_threads = local
+        return local
+
+    @classmethod
+    def get_registry(cls, network:str) -> dict:
+        """
+        the {name: (address, pid, expires)} of the network, cached in memory until 
+        another connection writes to the registry (sqlite's data_version changes).
+        a network missing from the registry gets the servers of its json namespace 
+        (checked once per network, see migrate_namespace)
+        """
+        db = cls.registry()
+        network2registry = cls.registry_local().network2registry
+        data_version = db.execute('PRAGMA data_version').fetchone()[0]
+        version, registry = network2registry.get(network, (None, None))
+        if version != data_version:
+            rows = db.execute('SELECT name, address, pid, expires FROM servers WHERE network = ?', (network,))
+            registry = {name: (address, pid, expires) for name, address, pid, expires in rows}
+            network2registry[network] = (data_version, registry)
+        migration_checked = cls.registry_local().migration_checked
+        if len(registry) == 0 and network not in migration_checked:
+            migration_checked.add(network)
+            if cls.migrate_namespace(network)['migrated'] > 0:
+                return cls.get_registry(network)
+        return registry
+
+    @classmethod
+    def write_registry(cls, sql:str, params:tuple = ()) -> None:
+        db = cls.registry()
+        db.execute(sql, params)
+        # the writes of this connection do not change its data_version, so drop its cache
+        cls.registry_local().network2registry = {}
+
+    @classmethod
+    def get_ip(cls) -> str:
+        if c.time() - cls.__dict__.get('ip_time', 0) > cls.ip_ttl:
+            cls.ip_cache = c.ip()
+            cls.ip_time = c.time()
+        return cls.ip_cache
+
     @classmethod
     def namespace(cls, search=None,
                    network:str = 'local',
@@ -22,9 +97,6 @@ class Namespace(c.Module):
                      max_age:int = None, **kwargs) -> dict:
         
         network = network or 'local'
-        path = network 
-        
-        namespace = cls.get(path, None, max_age=max_age)
 
         if 'subspace' in network:
             if '.' in network:
@@ -40,9 +112,12 @@ class Namespace(c.Module):
                                                  update=update, 
                                                  netuid=netuid,
                                                  **kwargs)
-        elif network == 'local':
-            if update or namespace == None:
-                namespace = cls.build_namespace(network=network)     
+        else:
+            if update:
+                cls.prune_namespace(network=network)
+            now = c.time()
+            namespace = {name: address for name, (address, pid, expires) in cls.get_registry(network).items() 
+                         if expires == None or expires > now}
         namespace = {} if namespace == None else namespace
         
         if search != None:
@@ -51,7 +126,8 @@ class Namespace(c.Module):
         namespace = {k:v for k,v in namespace.items() if 'Error' not in k} 
 
         if public:
-            namespace = {k:v.replace(c.default_ip, c.ip()) for k,v in namespace.items()}
+            ip = cls.get_ip()
+            namespace = {k:v.replace(c.default_ip, ip) for k,v in namespace.items()}
         
         namespace = {k:v for k,v in sorted(namespace.items(), key=lambda x: x[0])}
         return namespace
@@ -59,27 +135,53 @@ class Namespace(c.Module):
     namespace = namespace
 
     @classmethod
-    def register_server(cls, name:str, address:str, network=network) -> None:
-        namespace = cls.namespace(network=network)
-        namespace[name] = address
-        cls.put_namespace(network, namespace)
+    def register_server(cls, name:str, address:str, network=network, ttl:int = None, pid:int = None) -> None:
+        """
+        registers the server, with a lease of ttl seconds that has to be renewed 
+        with heartbeat (ttl=None never expires)
+        """
+        expires = None if ttl == None else c.time() + ttl
+        # the json namespace is migrated before the first server of the network is registered
+        cls.get_registry(network)
+        # an address belongs to one name
+        cls.write_registry('DELETE FROM servers WHERE network = ? AND address = ? AND name != ?', (network, address, name))
+        cls.write_registry('INSERT OR REPLACE INTO servers VALUES (?, ?, ?, ?, ?)', (network, name, address, pid, expires))
         return {'success': True, 'msg': f'Block {name} registered to {network}.'}
-    
+
+    @classmethod
+    def heartbeat(cls, name:str, address:str, network=network, ttl:int = lease_ttl, pid:int = None) -> dict:
+        """
+        renews the lease of the server, registering it again if it expired or was removed
+        """
+        return cls.register_server(name=name, address=address, network=network, ttl=ttl, pid=pid)
     
     @classmethod
     def deregister_server(cls, name:str, network=network) -> Dict:
-
-        namespace = cls.namespace(network=network)
-        address2name = {v: k for k, v in namespace.items()}
-        if name in address2name:
-            name = address2name[name]
+        # the name can also be the address of the server
+        registry = cls.get_registry(network)
+        if name not in registry:
+            address2name = {v[0]: k for k, v in registry.items()}
+            name = address2name.get(name, name)
         
-        if name in namespace:
-            del namespace[name]
-            cls.put_namespace(network, namespace)
+        if name in registry:
+            cls.write_registry('DELETE FROM servers WHERE network = ? AND name = ?', (network, name))
             return {'status': 'success', 'msg': f'Block {name} deregistered.'}
         else:
             return {'success': False, 'msg': f'Block {name} not found.'}
+
+    @classmethod
+    def prune_namespace(cls, network:str = network) -> dict:
+        """
+        removes the expired leases, and the servers whose process is gone
+        """
+        now = c.time()
+        removed = []
+        for name, (address, pid, expires) in cls.get_registry(network).items():
+            expired = expires != None and expires < now
+            if expired or (pid != None and not psutil.pid_exists(pid)):
+                cls.write_registry('DELETE FROM servers WHERE network = ? AND name = ?', (network, name))
+                removed.append(name)
+        return {'success': True, 'removed': removed}
     
     @classmethod
     def rm_server(self,  name:str, network=network):
@@ -87,10 +189,14 @@ class Namespace(c.Module):
     
     @classmethod
     def get_address(cls, name:str, network:str=network, external:bool = True) -> dict:
-        namespace = cls.namespace(network=network)
-        address = namespace.get(name, None)
+        if 'subspace' in (network or 'local'):
+            address = cls.namespace(network=network).get(name, None)
+        else:
+            address, pid, expires = cls.get_registry(network or 'local').get(name, (None, None, None))
+            if expires != None and expires < c.time():
+                address = None
         if external and address != None:
-            address = address.replace(c.default_ip, c.ip()) 
+            address = address.replace(c.default_ip, cls.get_ip()) 
         return address
 
     
@@ -99,15 +205,27 @@ class Namespace(c.Module):
         address2name = {v: k for k, v in namespace.items()}
         namespace = {v:k for k,v in address2name.items()}
         assert isinstance(namespace, dict), 'Namespace must be a dict.'
-        return cls.put(network, namespace)        
+        db = cls.registry()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('DELETE FROM servers WHERE network = ?', (network,))
+            db.executemany('INSERT INTO servers VALUES (?, ?, ?, NULL, NULL)', [(network, k, v) for k,v in namespace.items()])
+            db.execute('COMMIT')
+        except Exception as e:
+            db.execute('ROLLBACK')
+            raise e
+        cls.registry_local().network2registry = {}
+        return {'success': True, 'msg': f'Namespace {network} updated.', 'servers': len(namespace)}
     
     add_namespace = put_namespace
     
 
     @classmethod
     def rm_namespace(cls,network:str) -> None:
-        if cls.exists(network):
-            cls.rm(network)
+        if cls.namespace_exists(network):
+            cls.write_registry('DELETE FROM servers WHERE network = ?', (network,))
+            if cls.exists(network):
+                cls.rm(network)
             return {'success': True, 'msg': f'Namespace {network} removed.'}
         else:
             return {'success': False, 'msg': f'Namespace {network} not found.'}
@@ -129,11 +247,11 @@ class Namespace(c.Module):
     
     @classmethod
     def networks(cls) -> dict:
-        return [p.split('/')[-1].split('.')[0] for p in cls.ls()]
+        return [row[0] for row in cls.registry().execute('SELECT DISTINCT network FROM servers')]
     
     @classmethod
     def namespace_exists(cls, network:str) -> bool:
-        return cls.exists(network)
+        return len(cls.get_registry(network)) > 0 or cls.exists(network)
 
 
     @classmethod
@@ -202,9 +320,38 @@ class Namespace(c.Module):
     update_namespace = build_namespace
     
     @classmethod
-    def migrate_namespace(cls, network:str='local'):
-        namespace = cls.get_json('local_namespace', {})
-        cls.put_namespace(network, namespace)
+    def migrate_namespace(cls, network:str='local', ttl:int = lease_ttl):
+        """
+        adds the servers of the old json namespace of the network to the registry, 
+        keeping the names and addresses already registered, and retires the json 
+        (moved to migrated/<network>) so it is migrated once. the servers get a lease 
+        of ttl seconds, so the ones that do not heartbeat are pruned like any other
+        """
+        if not cls.exists(network):
+            return {'success': True, 'msg': f'The {network} namespace has no json', 'migrated': 0}
+        db = cls.registry()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # another process can have migrated it while this one waited for the lock
+            namespace = cls.get(network, {}) if cls.exists(network) else {}
+            namespace = namespace if isinstance(namespace, dict) else {}
+            addresses = {row[0] for row in db.execute('SELECT address FROM servers WHERE network = ?', (network,))}
+            expires = c.time() + ttl
+            migrated = 0
+            for name, address in namespace.items():
+                if address in addresses:
+                    continue
+                migrated += db.execute('INSERT OR IGNORE INTO servers VALUES (?, ?, ?, NULL, ?)', (network, name, address, expires)).rowcount
+                addresses.add(address)
+            if cls.exists(network):
+                cls.put(f'migrated/{network}', namespace)
+                cls.rm(network)
+            db.execute('COMMIT')
+        except Exception as e:
+            db.execute('ROLLBACK')
+            raise e
+        cls.registry_local().network2registry = {}
+        return {'success': True, 'msg': f'Migrated {migrated} servers to the {network} registry', 'migrated': migrated}
 
     @classmethod
     def merge_namespace(cls, from_network:str, to_network:str, module = None):
@@ -364,6 +511,23 @@ class Namespace(c.Module):
         assert cls.namespace_exists(network) == False
         cls.rm_namespace(network2)
         assert cls.namespace_exists(network2) == False
+
+        # the json namespace of a network missing from the registry is migrated once, with a lease
+        network = f'test_json_{int(c.time())}'
+        cls.put(network, {'json': '0.0.0.0:1'})
+        assert cls.namespace(network=network, public=False) == {'json': '0.0.0.0:1'}
+        assert not cls.exists(network), 'the json is retired once migrated'
+        assert cls.get_registry(network)['json'][2] != None, 'the migrated servers have a lease'
+        cls.deregister_server('json', network=network)
+        assert cls.namespace(network=network, update=True) == {}, 'a killed server does not come back'
+        # a migrated server that never heartbeats is pruned once its lease expires
+        cls.put(network, {'json': '0.0.0.0:1'})
+        assert cls.migrate_namespace(network, ttl=-1)['migrated'] == 1
+        cls.prune_namespace(network=network)
+        assert 'json' not in cls.get_registry(network)
+        assert cls.namespace(network=network, update=True) == {}
+        cls.rm(f'migrated/{network}')
+        assert cls.namespace_exists(network) == False
         
         return {'success': True, 'msg': 'Namespace tests passed.'}
     
@@ -439,6 +603,26 @@ class Namespace(c.Module):
         return namespace
             
 
+    @classmethod
+    def benchmark(cls, n:int = 5000, network:str = 'benchmark', lookups:int = 10000) -> dict:
+        """
+        the lookup latency of a registry with n servers
+        """
+        cls.rm_namespace(network)
+        t = c.time()
+        cls.put_namespace(network, {f'module{i}': f'0.0.0.0:{10000 + i}' for i in range(n)})
+        stats = {'put_seconds': c.time() - t}
+        t = c.time()
+        for i in range(lookups):
+            cls.get_address(f'module{i % n}', network=network)
+        stats['get_address_us'] = (c.time() - t) / lookups * 1e6
+        t = c.time()
+        for i in range(10):
+            cls.namespace(network=network)
+        stats['namespace_ms'] = (c.time() - t) / 10 * 1e3
+        cls.rm_namespace(network)
+        return {k: c.round(v, 3) for k,v in stats.items()}
+
     @classmethod
     def dashboard(cls):
         return cls.namespace()
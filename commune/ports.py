@@ -0,0 +1,269 @@
+import commune as c
+import os
+import time
+import errno
+import socket
+import random
+import selectors
+import collections
+from typing import *
+
+class Ports(c.Module):
+    """
+    The port allocator behind c.free_port, c.free_ports and c.used_ports.
+
+    A scan opens a non-blocking connect to every port of the range at once and waits
+    for all of them together (with a timeout), instead of one blocking connect per port.
+    The free ports of a scan are kept in a pool, so a port is handed out in O(1) with
+    one connect to check that it is still free, and the range is only scanned again
+    when the pool is empty.
+    Every port that is handed out gets a lease in the reservation table (reserved_ports),
+    which is changed under a file lock, so concurrent c.serve calls (threads or processes)
+    never get the same port. A lease expires after lease_ttl seconds, when the server
+    is expected to be bound to the port, while c.reserve_port reservations stay until
+    c.unreserve_port.
+    """
+    allocators = {} # pid -> Ports, one allocator per process
+    in_progress = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+    def __init__(self,
+                 lease_ttl:float = 60, # seconds a port is held for the server that got it
+                 timeout:float = 0.5, # seconds to wait for the connects of a scan
+                 max_sockets:int = 512 # the max number of sockets open at once in a scan
+                 ):
+        self.lease_ttl = lease_ttl
+        self.timeout = timeout
+        self.max_sockets = max_sockets
+        self.pools = {} # (ip, start_port, end_port) -> deque of ports that were free
+        self.scans = self.allocations = 0
+
+    @classmethod
+    def get_ports(cls) -> 'Ports':
+        pid = os.getpid()
+        if pid not in cls.allocators:
+            cls.allocators[pid] = cls()
+        return cls.allocators[pid]
+
+    @property
+    def table_path(self) -> str:
+        return c.resolve_path('reserved_ports', extension='json')
+
+    def scan(self, ports:List[int], ip:str = None, timeout:float = None) -> List[int]:
+        """
+        the used ports, with concurrent non-blocking connects
+        """
+        ip = ip or c.default_ip
+        timeout = self.timeout if timeout == None else timeout
+        ports = list(map(int, ports))
+        used = []
+        for i in range(0, len(ports), self.max_sockets):
+            selector = selectors.DefaultSelector()
+            sockets = []
+            try:
+                for port in ports[i:i+self.max_sockets]:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    sockets.append(sock)
+                    sock.setblocking(False)
+                    err = sock.connect_ex((ip, port))
+                    if err == 0:
+                        used.append(port)
+                    elif err in self.in_progress:
+                        selector.register(sock, selectors.EVENT_WRITE, port)
+                deadline = time.time() + timeout
+                while len(selector.get_map()) > 0:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break # the ports that did not answer are free, like c.port_used
+                    for key, _ in selector.select(remaining):
+                        selector.unregister(key.fileobj)
+                        if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                            used.append(key.data)
+            finally:
+                selector.close()
+                for sock in sockets:
+                    sock.close()
+        self.scans += 1
+        return sorted(used)
+
+    def free(self, ports:List[int], ip:str = None, timeout:float = None) -> List[int]:
+        used = set(self.scan(ports, ip=ip, timeout=timeout))
+        return [p for p in ports if p not in used]
+
+    def prune(self, table:dict) -> dict:
+        """
+        the table without the expired leases
+        """
+        now = time.time()
+        return {p: v for p, v in table.items() if not isinstance(v, dict) or v.get('ttl') == None or now - v.get('time', 0) <= v['ttl']}
+
+    def reserved(self) -> List[int]:
+        return list(map(int, self.prune(c.get('reserved_ports', {}) or {})))
+
+    def update_table(self, fn:Callable) -> dict:
+        """
+        sets the reservation table to fn(table) under the file lock of the table
+        """
+        def update(data):
+            table = data.get('data') if isinstance(data, dict) else None
+            table = fn(self.prune(dict(table or {})))
+            # the same layout as c.put, so c.get('reserved_ports') reads the table
+            return {'data': table, 'encrypted': False, 'timestamp': c.timestamp()}
+        return self.store().update(self.table_path, update)['data']
+
+    def pool(self, ip:str, port_range:List[int]) -> collections.deque:
+        pool_key = (ip, *port_range)
+        if pool_key not in self.pools:
+            self.pools[pool_key] = collections.deque()
+        return self.pools[pool_key]
+
+    def allocate(self,
+                 n:int = 1,
+                 ports:List[int] = None,
+                 port_range:List[int] = None,
+                 ip:str = None,
+                 avoid_ports:List[int] = None,
+                 reserve:bool = False,
+                 random_selection:bool = True,
+                 strict:bool = True) -> List[int]:
+        """
+        n free ports of the range (or of ports), leased (or reserved with reserve=True) in one lock.
+        with strict=False the free ports are returned when there are less than n
+        """
+        ip = ip or c.default_ip
+        port_range = c.resolve_port_range(port_range)
+        avoid_ports = set(map(int, avoid_ports or []))
+        allocated = []
+
+        def allocate_ports(table:dict) -> dict:
+            taken = avoid_ports | set(map(int, table))
+            if ports != None:
+                candidates = [p for p in map(int, ports) if p not in taken]
+                if random_selection:
+                    random.shuffle(candidates)
+                pool, scanned = collections.deque(self.free(candidates, ip=ip)), True
+            else:
+                pool, scanned = self.pool(ip, port_range), False
+            while len(allocated) < n:
+                if len(pool) == 0:
+                    if scanned:
+                        break
+                    candidates = [p for p in range(*port_range) if p not in taken]
+                    if random_selection:
+                        random.shuffle(candidates)
+                    pool.extend(self.free(candidates, ip=ip))
+                    scanned = True
+                    continue
+                port = pool.popleft()
+                if port in taken:
+                    continue
+                # the pool can be old, so the port is checked once more before it is handed out
+                if not scanned and len(self.scan([port], ip=ip)) > 0:
+                    continue
+                allocated.append(port)
+                taken.add(port)
+            lease = {'time': time.time(), 'pid': os.getpid()}
+            if not reserve:
+                lease['ttl'] = self.lease_ttl
+            for port in allocated:
+                table[str(port)] = lease
+            return table
+
+        self.update_table(allocate_ports)
+        self.allocations += len(allocated)
+        if len(allocated) < n and strict:
+            self.release(allocated)
+            raise Exception(f'only {len(allocated)} of {n} ports are free in {ports or port_range}, change the port_range to encompase more ports')
+        return allocated
+
+    def reserve(self, ports:List[int]) -> List[int]:
+        """
+        reserves the ports until they are released, free or not
+        """
+        def reserve_ports(table:dict) -> dict:
+            for port in ports:
+                table[str(port)] = {'time': time.time(), 'pid': os.getpid()}
+            return table
+        self.update_table(reserve_ports)
+        return list(ports)
+
+    def release(self, ports:List[int] = None) -> List[int]:
+        """
+        removes the leases and reservations of the ports (all of them if ports is None)
+        """
+        released = []
+        def release_ports(table:dict) -> dict:
+            for port in (list(table) if ports == None else map(str, ports)):
+                if table.pop(port, None) != None:
+                    released.append(int(port))
+            return table
+        self.update_table(release_ports)
+        return released
+
+    def stats(self) -> dict:
+        return {'scans': self.scans,
+                'allocations': self.allocations,
+                'pooled': {f'{k[0]}:{k[1]}-{k[2]}': len(v) for k,v in self.pools.items()}}
+
+    @classmethod
+    def test(cls, n:int = 4, threads:int = 8):
+        self = cls(lease_ttl=10)
+        port_range = c.resolve_port_range()
+        # a listening port is found by the scan and never handed out
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('0.0.0.0', port_range[0]))
+        listener.listen()
+        try:
+            assert port_range[0] in self.scan(range(*port_range))
+            assert c.port_used(port_range[0])
+            futures = [c.submit(self.allocate, kwargs={'n': n}) for _ in range(threads)]
+            ports = sum([f.result() for f in futures], [])
+            assert len(set(ports)) == len(ports) == n * threads, f'{len(ports) - len(set(ports))} ports were handed out twice'
+            assert port_range[0] not in ports
+            reserved = self.reserved()
+            assert all(p in reserved for p in ports)
+            assert sorted(self.release(ports)) == sorted(ports)
+            assert not any(p in self.reserved() for p in ports)
+        finally:
+            listener.close()
+        return {'success': True, 'msg': 'ports test passed', 'stats': self.stats()}
+
+    @classmethod
+    def benchmark(cls, n:int = 50, used:int = 40):
+        """
+        the scan of the port range and the allocation of n ports (a fleet of n servers),
+        with used ports listening at the start of the range
+        """
+        self = cls()
+        port_range = c.resolve_port_range()
+        ports = list(range(*port_range))
+        listeners = []
+        for port in ports[:used]:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(('0.0.0.0', port))
+            listener.listen()
+            listeners.append(listener)
+        results = {}
+        try:
+            t = c.time()
+            serial = [p for p in ports if c.port_used(p)]
+            results['serial_scan_seconds'] = c.time() - t
+            t = c.time()
+            concurrent = self.scan(ports)
+            results['concurrent_scan_seconds'] = c.time() - t
+            assert serial == concurrent, f'{serial} != {concurrent}'
+            # one port per server, like c.serve
+            t = c.time()
+            allocated = [self.allocate(random_selection=False)[0] for _ in range(n)]
+            results['ports_per_second'] = n / (c.time() - t)
+            self.release(allocated)
+            t = c.time()
+            allocated = self.allocate(n=n)
+            results['bulk_ports_per_second'] = n / (c.time() - t)
+            self.release(allocated)
+        finally:
+            for listener in listeners:
+                listener.close()
+        results['scan_speedup'] = results['serial_scan_seconds'] / results['concurrent_scan_seconds']
+        return {k: round(v, 4) for k,v in results.items()}
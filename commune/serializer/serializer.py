@@ -7,6 +7,7 @@ import numpy as np
 
 from typing import *
 from copy import deepcopy
+import warnings
 
 import commune as c
 import json
@@ -14,19 +15,34 @@ import json
 
 class Serializer(c.Module):
 
-
+    # modes that carry raw bytes on the wire instead of hex strings
+    binary_modes = ['msgpack']
+    content_types = {'json': 'application/json', 'msgpack': 'application/msgpack'}
     
     def serialize(self,x:dict, mode = 'str', copy_value = True):
         if copy_value:
-            x = c.copy(x)
-        x = self.resolve_value(x)
+            x = self.copy_structure(x)
+        x = self.resolve_value(x, binary=mode in self.binary_modes)
         x = self.resolve_serialized_output(x, mode=mode)
         return x
     
+    def copy_structure(self, x):
+        """
+        copies the containers but not the leaves, as resolve_value only rewrites containers.
+        this avoids a deep copy of every tensor and array before it is serialized.
+        """
+        if type(x) is dict:
+            return {k: self.copy_structure(v) for k,v in x.items()}
+        elif type(x) in [list, tuple, set]:
+            return [self.copy_structure(v) for v in x]
+        return x
+
     def resolve_serialized_output(self, x, mode='str'):
         if mode == 'str':
             if isinstance(x, dict):
                 x = self.dict2str(x)
+        elif mode == 'msgpack':
+            x = self.dict2msgpack(x)
         elif mode == 'bytes':
             if isinstance(x, dict):
                 x = self.dict2bytes(x)
@@ -38,24 +54,22 @@ class Serializer(c.Module):
             raise Exception(f'{mode} not supported')
         return x 
 
-    def resolve_value(self, x):
+    def resolve_value(self, x, binary:bool = False):
 
         if type(x) in [dict, list, set, tuple]:
             k_list = []
             if isinstance(x, dict):
                 k_list = list(x.keys())
             elif type(x) in [list, set, tuple]:
-                k_list = list(range(len(x)))
                 if type(x) in [set, tuple]:
                     x = list(x) 
+                k_list = list(range(len(x)))
             for k in k_list:
-                x[k] = self.resolve_value(x[k])
+                x[k] = self.resolve_value(x[k], binary=binary)
             return x
         new_value = None
         v_type = type(x)
-        if v_type in [dict, list, tuple, set]:
-            new_value = self.serialize(x, mode=None)
-        elif v_type in [int, float, str, bool]:
+        if v_type in [int, float, str, bool] or x is None:
             new_value = x
         else:
             # GET THE TYPE OF THE VALUE
@@ -63,7 +77,7 @@ class Serializer(c.Module):
 
             if hasattr(self, f'serialize_{str_v_type}'):
                 # SERIALIZE MODE ON
-                new_value = {'data':  getattr(self, f'serialize_{str_v_type}')(data=x), 
+                new_value = {'data':  getattr(self, f'serialize_{str_v_type}')(data=x, binary=binary), 
                              'data_type': str_v_type,  
                              'serialized': True}
             else:
@@ -71,7 +85,18 @@ class Serializer(c.Module):
 
         return new_value
     
-    def serialize_pandas(self, data: 'pd.DataFrame') -> 'DataBlock':
+    def serialize_pandas(self, data: 'pd.DataFrame', binary:bool = False) -> 'DataBlock':
+        if binary:
+            # numeric columns travel as raw numpy buffers, the rest as lists
+            columns = [str(col) for col in data.columns]
+            values = []
+            for col in data.columns:
+                col_values = data[col].to_numpy()
+                if col_values.dtype.kind in 'biufcmM':
+                    values += [self.serialize_numpy(col_values, binary=True)]
+                else:
+                    values += [col_values.tolist()]
+            return self.dict2msgpack({'columns': columns, 'values': values, 'index': data.index.tolist()})
         data = data.to_json()
         if isinstance(data, bytes):
             data = data.decode('utf-8')
@@ -104,6 +129,8 @@ class Serializer(c.Module):
     def deserialize(self, x) -> object:
         """Serializes a torch object to DataBlock wire format.
         """
+        if type(x) in [bytes, bytearray, memoryview]:
+            x = self.msgpack2dict(x)
         if isinstance(x, dict) and isinstance(x.get('data', None), str):
             x = x['data']
         if isinstance(x, str):
@@ -150,10 +177,16 @@ class Serializer(c.Module):
     
     def deserialize_pandas(self, data: bytes) -> 'pd.DataFrame':
         import pandas as pd
+        if isinstance(data, bytes):
+            data = self.msgpack2dict(data)
+            columns = {}
+            for col, values in zip(data['columns'], data['values']):
+                columns[col] = self.deserialize_numpy(values) if isinstance(values, dict) else values
+            return pd.DataFrame(columns, index=data['index'])
         data = pd.DataFrame.from_dict(json.loads(data))
         return data
     
-    def serialize_dict(self, data: dict) -> str :
+    def serialize_dict(self, data: dict, binary:bool = False) -> str :
         data = self.dict2bytes(data=data)
         return  data
 
@@ -161,7 +194,9 @@ class Serializer(c.Module):
         data = self.bytes2dict(data=data)
         return data
 
-    def serialize_bytes(self, data: dict) -> bytes:
+    def serialize_bytes(self, data: dict, binary:bool = False) -> bytes:
+        if binary:
+            return data
         return self.bytes2str(data)
         
     def deserialize_bytes(self, data: bytes) -> 'DataBlock':
@@ -169,7 +204,7 @@ class Serializer(c.Module):
             data = self.str2bytes(data)
         return data
 
-    def serialize_munch(self, data: dict) -> str:
+    def serialize_munch(self, data: dict, binary:bool = False) -> str:
         data=self.munch2dict(data)
         data = self.dict2str(data=data)
         return  data
@@ -217,6 +252,14 @@ class Serializer(c.Module):
         json_object_bytes = msgpack.unpackb(data)
         return json.loads(json_object_bytes)
 
+    def dict2msgpack(self, data:dict) -> bytes:
+        import msgpack
+        return msgpack.packb(data, use_bin_type=True)
+
+    def msgpack2dict(self, data:bytes) -> dict:
+        import msgpack
+        return msgpack.unpackb(data, raw=False)
+
     """
     ################ BIG TORCH LAND ############################
     """
@@ -238,13 +281,7 @@ class Serializer(c.Module):
     def bytes2torch(self, data:bytes, ) -> 'torch.Tensor':
         import torch
         numpy_object = self.bytes2numpy(data)
-        int64_workaround = bool(numpy_object.dtype == np.int64)
-        if int64_workaround:
-            numpy_object = numpy_object.astype(np.float64)
-        torch_object = torch.tensor(numpy_object)
-        if int64_workaround:
-            dtype = torch.int64
-        return torch_object
+        return torch.tensor(numpy_object)
     
     def bytes2numpy(self, data:bytes) -> np.ndarray:
         import msgpack_numpy
@@ -254,22 +291,63 @@ class Serializer(c.Module):
 
     
     def deserialize_torch(self, data: dict) -> 'torch.Tensor':
+        import torch
+        if isinstance(data, dict):
+            # the tensor shares the (writable) buffer of the array
+            tensor = torch.from_numpy(self.deserialize_numpy(data))
+            dtype = getattr(torch, data['torch_dtype'].split('.')[-1])
+            if tensor.dtype != dtype:
+                tensor = tensor.view(dtype)
+            return tensor
+        # legacy safetensors payloads
         from safetensors.torch import load
         if isinstance(data, str):
             data = self.str2bytes(data)
         data = load(data)
         return data['data']
 
-    def serialize_torch(self, data: 'torch.Tensor') -> 'DataBlock':     
-        from safetensors.torch import save
-        output = save({'data':data})  
-        return self.bytes2str(output)
-
-    def serialize_numpy(self, data: 'np.ndarray') -> 'np.ndarray':     
-        data =  self.numpy2bytes(data)
-        return self.bytes2str(data)
+    def serialize_torch(self, data: 'torch.Tensor', binary:bool = False) -> 'DataBlock':     
+        import torch
+        data = data.detach().cpu()
+        torch_dtype = str(data.dtype)
+        if data.dtype == torch.bfloat16:
+            # numpy has no bfloat16, so ship the bits as int16 and view them back
+            data = data.view(torch.int16)
+        output = self.serialize_numpy(data.numpy(), binary=binary)
+        output['torch_dtype'] = torch_dtype
+        return output
 
-    def deserialize_numpy(self, data: bytes) -> 'np.ndarray':     
+    def serialize_numpy(self, data: 'np.ndarray', binary:bool = False) -> dict:     
+        """
+        a small header (dtype, shape, strides) plus the raw buffer. 
+        the buffer is a memoryview in binary mode and hex for json.
+        """
+        if not (data.flags['C_CONTIGUOUS'] or data.flags['F_CONTIGUOUS']):
+            data = np.ascontiguousarray(data)
+        if data.size == 0:
+            buffer = memoryview(b'')
+        else:
+            # a fortran array is the c buffer of its transpose
+            buffer = memoryview(data if data.flags['C_CONTIGUOUS'] else data.T).cast('B')
+        return {'dtype': data.dtype.str, 
+                'shape': list(data.shape), 
+                'strides': list(data.strides), 
+                'buffer': buffer if binary else buffer.hex()}
+
+    def deserialize_numpy(self, data: dict) -> 'np.ndarray':     
+        if isinstance(data, dict):
+            buffer = data['buffer']
+            if isinstance(buffer, str):
+                buffer = bytearray.fromhex(buffer)
+            elif not isinstance(buffer, bytearray):
+                # msgpack unpacks bin as immutable bytes, an array over them would be read-only
+                buffer = bytearray(buffer)
+            # a view over the buffer, no further copy
+            return np.ndarray(shape=data['shape'], 
+                              dtype=np.dtype(data['dtype']), 
+                              buffer=buffer, 
+                              strides=data['strides'])
+        # legacy msgpack_numpy payloads
         if isinstance(data, str):
             data = self.str2bytes(data)
         return self.bytes2numpy(data)
@@ -387,4 +465,82 @@ class Serializer(c.Module):
         stats['compression_ratio'] = stats['size_bytes'] / stats['size_bytes_compressed']
         stats['mb_per_second'] = c.round((stats['size_bytes'] / stats['elapsed_time']) / 1e6, 3)
 
-        return stats
\ No newline at end of file
+        return stats
+    @classmethod
+    def benchmark_wire(cls, 
+                       sizes:List[int] = [1e3, 1e4, 1e5, 1e6, 1e7, 1e8], 
+                       modes:List[str] = ['str', 'msgpack'],
+                       key:str = None):
+        """
+        compares the json (hex) and msgpack (raw bytes) wire formats over payload sizes,
+        timing serialize + sign + deserialize like a server response
+        """
+        self = cls()
+        key = c.get_key(key)
+        stats = []
+        for size in sizes:
+            data = {'data': np.random.randn(int(size) // 8)}
+            size_mb = data['data'].nbytes / 1e6
+            for mode in modes:
+                t = c.time()
+                serialized_data = self.serialize(data, mode=mode)
+                signed_data = key.sign(serialized_data, return_json=True)
+                deserialized_data = self.deserialize(signed_data['data'])
+                elapsed = c.time() - t
+                assert deserialized_data['data'].shape == data['data'].shape
+                stats += [{
+                    'mode': mode,
+                    'size_mb': size_mb,
+                    'wire_mb': len(serialized_data) / 1e6,
+                    'elapsed_time': c.round(elapsed, 4),
+                    'mb_per_second': c.round(size_mb / elapsed, 4),
+                }]
+                c.print(stats[-1])
+        return c.df(stats)
+
+    @classmethod
+    def test_zero_copy(cls):
+        import torch
+        self = cls()
+        arrays = [np.arange(10, dtype=np.int64), 
+                  np.ones((3, 4), order='F'), 
+                  np.arange(24.).reshape(4, 6)[:, ::2], 
+                  np.zeros((0, 3), dtype=np.float32)]
+        tensors = [torch.arange(10), 
+                   torch.randn(3, 4).t(), 
+                   torch.randn(2, 3, dtype=torch.bfloat16)]
+        for mode in ['str', 'msgpack']:
+            for x in arrays:
+                y = self.deserialize(self.serialize({'x': x}, mode=mode))['x']
+                assert y.dtype == x.dtype and y.shape == x.shape and np.array_equal(x, y), f'{x} != {y}'
+                assert y.flags['WRITEABLE'], f'{mode} arrays must be writable'
+            for x in tensors:
+                y = self.deserialize(self.serialize({'x': x}, mode=mode))['x']
+                assert y.dtype == x.dtype and y.shape == x.shape and torch.equal(x, y), f'{x} != {y}'
+                y.add_(1) # in place ops need a writable buffer
+        return {'success': True, 'msg': 'zero copy serialization test passed'}
+
+    @classmethod
+    def benchmark(cls, sizes:List[int] = [1e4, 1e6, 1e8], dtype:str = 'float32'):
+        """
+        the MB/s of the header + buffer array path in json and msgpack mode,
+        against the previous msgpack_numpy + hex path that Serializer.test measures
+        """
+        self = cls()
+        stats = []
+        for size in sizes:
+            data = np.random.randn(int(size) // np.dtype(dtype).itemsize).astype(dtype)
+            size_mb = data.nbytes / 1e6
+            paths = {
+                'legacy': lambda x: self.bytes2numpy(self.str2bytes(self.str2dict(self.dict2str({'data': self.bytes2str(self.numpy2bytes(x))}))['data'])),
+                'str': lambda x: self.deserialize(self.serialize(x, mode='str')),
+                'msgpack': lambda x: self.deserialize(self.serialize(x, mode='msgpack')),
+            }
+            for path, fn in paths.items():
+                t = c.time()
+                output = fn(data)
+                elapsed = c.time() - t
+                assert output.dtype == data.dtype and output.shape == data.shape
+                stats += [{'path': path, 'size_mb': size_mb, 'mb_per_second': c.round(size_mb / elapsed, 4)}]
+                c.print(stats[-1])
+        return c.df(stats)
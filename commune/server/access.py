@@ -1,5 +1,9 @@
 import commune as c
 from typing import *
+import os
+import threading
+import sqlite3
+import contextlib
 
 
 class Access(c.Module):
@@ -7,33 +11,43 @@ class Access(c.Module):
     sync_time = 0
     timescale_map  = {'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400, 'minute': 60, 'second': 1}
 
-    def __init__(self, 
+    def __init__(self,
                 module : Union[c.Module, str] = None, # the module or any python object
                 network: str =  'main', # mainnet
                 netuid: int = 0, # subnet id
                 timescale:str =  'min', # 'sec', 'min', 'hour', 'day'
                 stake2rate: int =  100.0,  # 1 call per every N tokens staked per timescale
                 max_rate: int =  1000.0, # 1 call per every N tokens staked per timescale
-                role2rate: dict =  {}, # role to rate map, this overrides the default rate,
+                role2rate: dict =  {}, # role to rate map, the users (and 'public') with a role in it are limited to its rate,
                 state_path = f'state_path', # the path to the state
                 refresh: bool = False,
                 max_age = 600, # max age of the state in seconds
                 sync_interval: int =  60, #  1000 seconds per sync with the network
-
+                num_locks: int = 64, # the buckets are split over this many locks
+                shared: bool = False, # share the buckets with the other processes through sqlite
+                max_buckets: int = 100000, # the buckets kept in memory before the full and then the oldest ones are dropped
                 **kwargs):
-        
+
         self.set_config(locals())
         self.user_module = c.module("user")()
-        self.address2key = c.address2key()
         self.set_module(module)
         self.state_path = state_path
         if refresh:
             self.rm_state()
         self.last_time_synced = c.time()
-        self.state = {'sync_time': 0, 
-                      'stake_from': {}, 
-                      'role2rate': role2rate, 
+        self.state = {'sync_time': 0,
+                      'stakes': {},
+                      'role2rate': role2rate,
                       'fn_info': {}}
+        self.period = self.timescale_map[timescale]
+        self.locks = [threading.Lock() for _ in range(num_locks)]
+        self.buckets = {} # (address, fn) -> [tokens, timestamp]
+        self.max_buckets = max_buckets
+        self.prune_lock = threading.Lock()
+        self.shared = shared
+        # the local tables are loaded now, the network is synced by run_loop
+        self.sync_local()
+        self.state.update(self.get(self.state_path, {}))
 
         c.thread(self.run_loop)
 
@@ -44,45 +58,177 @@ class Access(c.Module):
             module = c.module(module)()
         self.module = module
 
-        self.whitelist =  list(set(self.module.whitelist + c.whitelist))
-        self.blacklist =  list(set(self.module.blacklist + c.blacklist))
+        self.whitelist =  set(self.module.whitelist + c.whitelist)
+        self.blacklist =  set(self.module.blacklist + c.blacklist)
 
         return {'success': True, 'msg': f'set module to {module}'}
-    
+
     def run_loop(self):
         while True:
             try:
+                self.sync_local()
+                self.prune_buckets()
                 r = self.sync_network()
             except Exception as e:
                 r = c.detailed_error(e)
             c.print(r)
             c.sleep(self.config.sync_interval)
 
+    def sync_local(self):
+        """
+        the local keys and the user roles, so verify only stats the users file
+        """
+        self.address2key = c.address2key()
+        self.sync_roles(force=True)
+        return {'success': True, 'msg': 'synced local keys and users'}
+
+    def sync_roles(self, force:bool = False) -> bool:
+        """
+        reads the user roles again if the users file changed, so a role written by any 
+        process (like a revoked admin) applies from the next call. returns if they were read
+        """
+        path = self.user_module.resolve_path(path='users', extension='json')
+        try:
+            st = os.stat(path)
+            users_stat = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            users_stat = None
+        if not force and users_stat == getattr(self, 'users_stat', None):
+            return False
+        # the stat is taken before the read, so a write during the read is read on the next call
+        self.users_stat = users_stat
+        self.address2role = {k: v.get('role') for k,v in self.user_module.users().items()}
+        return True
+
     def sync_network(self):
         state = self.get(self.state_path, {}, max_age=self.config.sync_interval)
         time_since_sync = c.time() - state.get('sync_time', 0)
-        self.key2address = c.key2address()
-        self.address2key = c.address2key()
         if time_since_sync > self.config.sync_interval:
             self.subspace = c.module('subspace')(network=self.config.network)
             state['stakes'] = self.subspace.stakes(fmt='j', netuid='all', update=False, max_age=self.config.max_age)
             state['sync_time'] = c.time()
-            self.state = state
-            self.put(self.state_path, self.state)
+            self.put(self.state_path, state)
             c.print(f'🔄 Synced {self.state_path} at {state["sync_time"]}... 🔄\033', color='yellow')
+        # swap the whole state, so verify sees the old or the new tables but never a mix
+        self.state = {**self.state, **state}
 
-        response = {'success': True, 
-                    'msg': f'synced {self.state_path}', 
+        response = {'success': True,
+                    'msg': f'synced {self.state_path}',
                     'until_sync': int(self.config.sync_interval - time_since_sync),
                     'time_since_sync': int(time_since_sync)}
         return response
 
-    def verify(self, 
-               address='5FNBuR2yVf4A1v5nt3w5oi4ScorraGRjiSVzkXBVEsPHaGq1', 
+    def get_rate_limit(self, address:str, fn:str, role:str = None) -> float:
+        """
+        the calls per period of the address, from its role or its stake
+        """
+        role2rate = self.state.get('role2rate', {})
+        if role in role2rate:
+            return role2rate[role]
+        fn2info = self.state.get('fn_info', {}).get(fn, {})
+        stake = self.state.get('stakes', {}).get(address, 0)
+        # convert the stake to a rate and cap it at the max rate
+        rate_limit = stake / fn2info.get('stake2rate', self.config.stake2rate)
+        return min(rate_limit, fn2info.get('max_rate', self.config.max_rate))
+
+    def consume(self, address:str, fn:str, rate_limit:float) -> float:
+        """
+        takes a token from the bucket of (address, fn), returning the tokens left, or -1 if it is empty.
+        the bucket holds rate_limit tokens and refills at rate_limit per period
+        """
+        if rate_limit <= 0:
+            # the bucket would never hold a token, so there is nothing to keep
+            return -1
+        if self.shared:
+            return self.consume_shared(address=address, fn=fn, rate_limit=rate_limit)
+        bucket_key = (address, fn)
+        now = c.time()
+        if bucket_key not in self.buckets and len(self.buckets) >= self.max_buckets:
+            self.prune_buckets(now=now)
+        with self.locks[hash(bucket_key) % len(self.locks)]:
+            bucket = self.buckets.get(bucket_key)
+            if bucket == None:
+                bucket = self.buckets[bucket_key] = [rate_limit, now]
+            tokens = min(rate_limit, bucket[0] + (now - bucket[1]) * rate_limit / self.period)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return -1
+            bucket[0] = tokens - 1
+            return bucket[0]
+
+    def prune_buckets(self, now:float = None) -> dict:
+        """
+        drops the buckets that refilled (a full bucket is the same as no bucket), and 
+        the oldest ones while there are more than max_buckets/2 in memory.
+        the rows of the shared buckets that refilled are deleted as well.
+        the buckets are dropped in place with every lock held, so no token taken by 
+        consume is lost
+        """
+        now = c.time() if now == None else now
+        with self.prune_lock, contextlib.ExitStack() as stack:
+            for lock in self.locks:
+                stack.enter_context(lock)
+            n = len(self.buckets)
+            for k in [k for k, v in self.buckets.items() if now - v[1] >= self.period]:
+                del self.buckets[k]
+            if len(self.buckets) > self.max_buckets // 2:
+                oldest = sorted(self.buckets.items(), key=lambda item: item[1][1])[:-(self.max_buckets // 2) or None]
+                for k, _ in oldest:
+                    del self.buckets[k]
+            removed = n - len(self.buckets)
+        if self.shared:
+            self.get_db().execute('DELETE FROM buckets WHERE timestamp < ?', (now - self.period,))
+        return {'success': True, 'removed': removed, 'n': len(self.buckets)}
+
+    @property
+    def db_path(self):
+        # one database per server, shared by its replicas only
+        name = getattr(self.module, 'server_name', None) or self.module.__class__.__name__
+        return self.resolve_path(f'buckets/{name}.db')
+
+    def get_db(self) -> sqlite3.Connection:
+        # one connection per thread, as sqlite connections cannot be shared between threads
+        local = self.__dict__.setdefault('db_local', threading.local())
+        if not hasattr(local, 'db'):
+            db = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, timestamp REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS buckets_timestamp ON buckets (timestamp)')
+            local.db = db
+        return local.db
+
+    def consume_shared(self, address:str, fn:str, rate_limit:float) -> float:
+        """
+        consume, with the buckets in a sqlite file so every replica enforces one limit
+        """
+        db = self.get_db()
+        bucket_key = f'{address}/{fn}'
+        now = c.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT tokens, timestamp FROM buckets WHERE key = ?', (bucket_key,)).fetchone()
+            tokens, timestamp = row if row != None else (rate_limit, now)
+            tokens = min(rate_limit, tokens + (now - timestamp) * rate_limit / self.period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            db.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (bucket_key, tokens, now))
+            db.execute('COMMIT')
+        except Exception as e:
+            # a failed COMMIT can end the transaction, so only an open one is rolled back
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise e
+        return tokens if allowed else -1
+
+    def verify(self,
+               address='5FNBuR2yVf4A1v5nt3w5oi4ScorraGRjiSVzkXBVEsPHaGq1',
                fn: str = 'info' ,
               input:dict = None) -> dict:
         """
-        input : dict 
+        input : dict
             fn : str
             address : str
 
@@ -92,91 +238,41 @@ class Access(c.Module):
             address = input.get('address', address)
             fn = input.get('fn', fn)
 
+        self.sync_roles()
+        role = self.address2role.get(address)
+
         # ONLY THE ADMIN CAN CALL ANY FUNCTION, THIS IS A SECURITY FEATURE
         # THE ADMIN KEYS ARE STORED IN THE CONFIG
-        if c.is_admin(address):
+        if role == 'admin':
             return {'success': True, 'msg': f'is verified admin'}
 
-        
+
         assert fn in self.whitelist , f"Function {fn} not in whitelist={self.whitelist}"
-        assert fn not in self.blacklist, f"Function {fn} is blacklisted={self.blacklist}" 
-        
+        assert fn not in self.blacklist, f"Function {fn} is blacklisted={self.blacklist}"
+
         if address in self.address2key:
             return {'success': True, 'msg': f'address {address} is a local key'}
         if fn.startswith('__') or fn.startswith('_'):
             return {'success': False, 'msg': f'Function {fn} is private'}
-        if address in self.address2key:
-            return {'success': True, 'msg': f'address {address} is in the whitelist'}
 
-        if c.is_user(address):
+        # users are not rate limited, unless their role has a rate in role2rate
+        if role != None and role not in self.state.get('role2rate', {}):
             return {'success': True, 'msg': f'is verified user'}
 
-
-        current_time = c.time()
-
-        # sync of the state is not up to date 
-        self.sync_network()
-
-        # get the rate limit for the user
-        role2rate = self.state.get('role2rate', {})
-
-        # get the role of the user
-        role = self.user_module.get_role(address) or 'public'
-        rate_limit = role2rate.get(role, 0)
-
-        # stake rate limit
-        stake = self.state.get('stake_from', {}).get(address, 0)
-        # we want to also know if the user has been staked from
-        stake_from = self.state.get('stake_from', {}).get(address, 0)
-        # STEP 1:  FIRST CHECK THE WHITELIST AND BLACKLIST
-
-        total_stake_score = stake 
-
-        # STEP 2: CHECK THE STAKE AND CONVERT TO A RATE LIMIT
-        default_fn_info = {'stake2rate': self.config.stake2rate, 'max_rate': self.config.max_rate}
-        self.state['fn_info'] = self.state.get('fn_info', {})
-        fn2info = self.state['fn_info'].get(fn,default_fn_info)
-        stake2rate = fn2info.get('stake2rate', self.config.stake2rate)
-        
-        rate_limit = (total_stake_score / stake2rate) # convert the stake to a rate
-
-
-        # STEP 3: CHECK THE MAX RATE
-        max_rate = fn2info.get('max_rate', self.config.max_rate)
-        rate_limit = min(rate_limit, max_rate) # cap the rate limit at the max rate
-        
-        # NOW LETS CHECK THE RATE LIMIT
-        self.state['user_info'] = self.state.get('user_info', {})
-        user_info = self.state['user_info'].get(address, {})
-
-        # check if the user has exceeded the rate limit
-        time_since_called = current_time - user_info.get('timestamp', 0)
-        period = self.timescale_map[self.config.timescale]
-        # if the time since the last call is greater than the seconds in the period, reset the requests
-        if time_since_called > period:
-            user_info['rate'] = 0
-        try:
-            assert user_info['rate'] <= rate_limit
-            user_info['success'] = True
-        except Exception as e:
-            user_info['error'] = c.detailed_error(e)
-            user_info['success'] = False
-
-       
-        # update the user info
-        user_info['rate_limit'] = rate_limit
-        user_info['period'] = period
-        user_info['role'] = role
-        user_info['fn2requests'] = user_info.get('fn2requests', {})
-        user_info['fn2requests'][fn] = user_info['fn2requests'].get(fn, 0) + 1
-        user_info['timestamp'] = current_time
-        user_info['stake'] = stake
-        user_info['stake_from'] = stake_from
-        user_info['rate'] = user_info.get('rate', 0) + 1
-        user_info['timescale'] = self.config.timescale
-        # store the user info into the state
-        self.state['user_info'][address] = user_info
-        # check the rate limit
+        role = role or 'public'
+        rate_limit = self.get_rate_limit(address=address, fn=fn, role=role)
+        tokens = self.consume(address=address, fn=fn, rate_limit=rate_limit)
+        user_info = {
+            'success': tokens >= 0,
+            'rate_limit': rate_limit,
+            'tokens': tokens,
+            'period': self.period,
+            'role': role,
+            'stake': self.state.get('stakes', {}).get(address, 0),
+            'timescale': self.config.timescale,
+        }
+        if not user_info['success']:
+            user_info['error'] = f'Rate limit of {rate_limit} calls per {self.config.timescale} exceeded for {fn}'
         return user_info
 
     @classmethod
@@ -189,22 +285,83 @@ class Access(c.Module):
         module = cls(module=c.module('module')(),  base_rate=base_rate)
         key = c.get_key(key)
 
-        for i in range(base_rate*3):    
+        for i in range(base_rate*3):
             t1 = c.time()
             result = module.verify(**{'address': key.ss58_address, 'fn': 'info'})
             t2 = c.time()
             c.print(f'🚨 {t2-t1} seconds... 🚨\033', color='yellow')
-    
 
-    
+    @classmethod
+    def test_rate_limit(cls, stake:float = 1000, stake2rate:float = 100):
+        self = cls(module=c.module('module')(), stake2rate=stake2rate, timescale='min')
+        address = c.new_key().ss58_address
+        self.state = {**self.state, 'stakes': {address: stake}}
+        rate_limit = stake / stake2rate
+        results = [self.verify(address=address, fn='info')['success'] for _ in range(int(rate_limit) + 2)]
+        assert sum(results) == rate_limit, f'{sum(results)} calls passed, the limit is {rate_limit}'
+        # unstaked addresses are rejected without a bucket
+        n = len(self.buckets)
+        assert not self.verify(address=c.new_key().ss58_address, fn='info')['success'] and len(self.buckets) == n
+        # the buckets are bounded, the ones that refilled go first
+        self.max_buckets = 4
+        addresses = [c.new_key().ss58_address for _ in range(8)]
+        self.state = {**self.state, 'stakes': {a: stake for a in addresses}}
+        for a in addresses:
+            self.verify(address=a, fn='info')
+        assert len(self.buckets) <= self.max_buckets, len(self.buckets)
+        # a role in role2rate sets the rate of its users
+        user = c.new_key().ss58_address
+        self.address2role = {**self.address2role, user: 'friend'}
+        self.state = {**self.state, 'role2rate': {'friend': 2}}
+        results = [self.verify(address=user, fn='info')['success'] for _ in range(4)]
+        assert sum(results) == 2, results
+        # no token is lost while the buckets are pruned
+        from concurrent.futures import ThreadPoolExecutor
+        address = c.new_key().ss58_address
+        self.max_buckets, self.period = 100000, 86400
+        self.state = {**self.state, 'role2rate': {}, 'stakes': {address: 50 * stake2rate}}
+        def prune():
+            for _ in range(200):
+                self.prune_buckets()
+        with ThreadPoolExecutor(max_workers=9) as executor:
+            pruning = executor.submit(prune)
+            results = list(executor.map(lambda i: self.verify(address=address, fn='info')['success'], range(100)))
+            pruning.result()
+        assert sum(results) == 50, f'{sum(results)} calls passed, the limit is 50'
+        # a role written to the users file applies to the next call
+        admin = c.new_key().ss58_address
+        self.user_module.add_admin(admin)
+        assert self.verify(address=admin, fn='not_a_function')['success']
+        self.user_module.rm_admin(admin)
+        try:
+            self.verify(address=admin, fn='not_a_function')
+            assert False, 'the revoked admin can still call any function'
+        except AssertionError as e:
+            assert 'not in whitelist' in str(e), e
+        return {'success': True, 'msg': 'rate limit test passed', 'rate_limit': rate_limit}
+
+    @classmethod
+    def benchmark(cls, n:int = 100000, num_addresses:int = 1000, shared:bool = False):
+        """
+        the verify calls per second for public addresses (the rate limited path)
+        """
+        self = cls(module=c.module('module')(), shared=shared)
+        addresses = [c.new_key().ss58_address for _ in range(num_addresses)]
+        self.state = {**self.state, 'stakes': {a: 1e9 for a in addresses}}
+        t = c.time()
+        for i in range(n):
+            self.verify(address=addresses[i % num_addresses], fn='info')
+        seconds = c.time() - t
+        return {'calls_per_second': int(n / seconds), 'n': n, 'shared': shared}
+
+
+
     def rm_state(self):
         self.put(self.state_path, {})
         return {'success': True, 'msg': f'removed {self.state_path}'}
 
-    
+
 
 
 if __name__ == '__main__':
     Access.run()
-
-            
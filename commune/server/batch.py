@@ -0,0 +1,202 @@
+import commune as c
+from typing import *
+import asyncio
+import inspect
+import functools
+import json
+
+
+class Batch(c.Module):
+    """
+    Gathers concurrent calls to a batchable function (see c.batchable) and runs them
+    as one call. Calls are grouped by their non batched arguments, and a batch is run
+    when it is full (max_batch_size) or when the first call has waited max_wait seconds.
+    The worker of a group exits once it has been idle for idle_timeout seconds, and past 
+    max_keys groups the calls of a new group are run on their own (as a batch of one).
+    """
+
+    def __init__(self, 
+                 module: Union[c.Module, str] = None, 
+                 executor = None, 
+                 idle_timeout: float = 10, # seconds a worker waits for a call before it exits
+                 max_keys: int = 1000, # the max number of groups with a worker
+                 ):
+        self.set_module(module)
+        self.executor = executor
+        self.idle_timeout = idle_timeout
+        self.max_keys = max_keys
+        self.queues = {} # (fn, key) -> asyncio.Queue
+        self.workers = {} # (fn, key) -> asyncio.Task
+        self.fn2stats = {}
+
+    def set_module(self, module: c.Module):
+        module = module or c.module('module')()
+        if isinstance(module, str):
+            module = c.module(module)()
+        self.module = module
+        return {'success': True, 'msg': f'set module to {module}'}
+
+    def batch_fns(self) -> List[str]:
+        module_class = type(self.module)
+        return [fn for fn in dir(module_class) if hasattr(getattr(module_class, fn, None), '__batch__')]
+
+    def is_batchable(self, fn:str) -> bool:
+        fn_obj = getattr(self.module, fn, None)
+        return callable(fn_obj) and hasattr(fn_obj, '__batch__')
+
+    def resolve_input(self, fn_obj:Callable, args:list, kwargs:dict):
+        """
+        splits the call into the batched (first) argument and the other arguments
+        """
+        arguments = inspect.signature(fn_obj).bind_partial(*args, **kwargs).arguments
+        batch_arg = list(inspect.signature(fn_obj).parameters.keys())[0]
+        assert batch_arg in arguments, f'{batch_arg} is required for batching'
+        item = arguments.pop(batch_arg)
+        key = json.dumps(arguments, sort_keys=True, default=str)
+        return item, arguments, key
+
+    async def forward(self, fn:str, args:list = None, kwargs:dict = None):
+        fn_obj = getattr(self.module, fn)
+        item, fn_kwargs, key = self.resolve_input(fn_obj, args or [], kwargs or {})
+        loop = asyncio.get_running_loop()
+        queue_key = (fn, key)
+        if queue_key not in self.queues:
+            if len(self.queues) >= self.max_keys:
+                # a client varying the other arguments cannot add workers without bound
+                return await self.forward_unbatched(fn_obj, item, fn_kwargs)
+            self.queues[queue_key] = asyncio.Queue()
+        if queue_key not in self.workers or self.workers[queue_key].done():
+            self.workers[queue_key] = loop.create_task(self.run_worker(fn, key=key, kwargs=fn_kwargs))
+        future = loop.create_future()
+        # put_nowait does not yield, so the idle worker cannot exit before it gets the call
+        self.queues[queue_key].put_nowait((item, future, loop.time()))
+        return await future
+
+    async def forward_unbatched(self, fn_obj:Callable, item:Any, kwargs:dict):
+        if inspect.iscoroutinefunction(fn_obj):
+            results = await fn_obj([item], **kwargs)
+        else:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, functools.partial(fn_obj, [item], **kwargs))
+        return results[0]
+
+    def forward_one(self, fn:str, args:list = None, kwargs:dict = None):
+        """
+        runs a single call as a batch of one (for the blocking forward path)
+        """
+        fn_obj = getattr(self.module, fn)
+        item, fn_kwargs, _ = self.resolve_input(fn_obj, args or [], kwargs or {})
+        result = fn_obj([item], **fn_kwargs)
+        if c.is_coroutine(result):
+            result = c.gather(result)
+        return result[0]
+
+    async def run_worker(self, fn:str, key:str, kwargs:dict):
+        fn_obj = getattr(self.module, fn)
+        max_batch_size = fn_obj.__batch__['max_batch_size']
+        max_wait = fn_obj.__batch__['max_wait']
+        queue = self.queues[(fn, key)]
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                batch = [await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)]
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # no await from the check to the pop, so no call is put in between
+                    self.queues.pop((fn, key), None)
+                    self.workers.pop((fn, key), None)
+                    return
+                continue
+            deadline = batch[0][-1] + max_wait
+            while len(batch) < max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch += [await asyncio.wait_for(queue.get(), timeout=timeout)]
+                except asyncio.TimeoutError:
+                    break
+            start_time = loop.time()
+            items = [item for item, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+            try:
+                if inspect.iscoroutinefunction(fn_obj):
+                    results = await fn_obj(items, **kwargs)
+                else:
+                    results = await loop.run_in_executor(self.executor, functools.partial(fn_obj, items, **kwargs))
+                assert len(results) == len(items), f'{fn} returned {len(results)} results for a batch of {len(items)}'
+                for future, result in zip(futures, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            self.add_stats(fn,
+                           batch_size=len(batch),
+                           max_batch_size=max_batch_size,
+                           queue_delays=[start_time - t for _, _, t in batch],
+                           latency=loop.time() - start_time)
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        self.workers = {}
+        return {'success': True, 'msg': 'stopped batch workers'}
+
+    def add_stats(self, fn:str, batch_size:int, max_batch_size:int, queue_delays:List[float], latency:float):
+        stats = self.fn2stats.get(fn, {'batches': 0, 'calls': 0, 'fill': 0, 'queue_delay': 0, 'max_queue_delay': 0, 'latency': 0})
+        stats['batches'] += 1
+        stats['calls'] += batch_size
+        stats['fill'] += batch_size / max_batch_size
+        stats['queue_delay'] += sum(queue_delays)
+        stats['max_queue_delay'] = max(stats['max_queue_delay'], max(queue_delays))
+        stats['latency'] += latency
+        self.fn2stats[fn] = stats
+
+    def stats(self) -> dict:
+        """
+        the fill ratio and queueing delay per batched function
+        """
+        fn2stats = {}
+        for fn, stats in self.fn2stats.items():
+            fn2stats[fn] = {
+                'batches': stats['batches'],
+                'calls': stats['calls'],
+                'avg_batch_size': stats['calls'] / stats['batches'],
+                'fill_ratio': stats['fill'] / stats['batches'],
+                'avg_queue_delay': stats['queue_delay'] / stats['calls'],
+                'max_queue_delay': stats['max_queue_delay'],
+                'avg_batch_latency': stats['latency'] / stats['batches'],
+            }
+        return fn2stats
+
+    @classmethod
+    def test(cls, n:int = 20, max_batch_size:int = 8):
+        class Model:
+            @c.batchable(max_batch_size=max_batch_size, max_wait=0.05)
+            def forward(self, x:List[int], scale:int = 1):
+                return [i * scale for i in x]
+        self = cls(module=Model())
+
+        async def run():
+            results = await asyncio.gather(*[self.forward('forward', args=[i], kwargs={'scale': 2}) for i in range(n)])
+            self.stop()
+            return results
+
+        results = c.get_event_loop().run_until_complete(run())
+        assert results == [i * 2 for i in range(n)], f'{results}'
+        stats = self.stats()['forward']
+        assert stats['calls'] == n and stats['batches'] < n, f'{stats}'
+
+        # the idle workers exit, and past max_keys the calls are not batched
+        self = cls(module=Model(), idle_timeout=0.1, max_keys=2)
+        async def run_keys():
+            results = await asyncio.gather(*[self.forward('forward', args=[i], kwargs={'scale': i}) for i in range(n)])
+            assert len(self.queues) == len(self.workers) == 2, f'{len(self.queues)} groups'
+            await asyncio.sleep(0.3)
+            return results
+        results = c.get_event_loop().run_until_complete(run_keys())
+        assert results == [i * i for i in range(n)], f'{results}'
+        assert self.queues == {} and self.workers == {}, 'the idle workers exited'
+        return {'success': True, 'msg': 'batch test passed', 'stats': stats}
@@ -0,0 +1,236 @@
+import commune as c
+from typing import *
+import inspect
+import numbers
+import types
+
+
+class Dispatch(c.Module):
+    """
+    The functions served by a module, compiled when the module is set. Every function of
+    the whitelist gets a route: the callable, an argument check compiled from its signature
+    and annotations (the ones fn_schema reports), and whether it is a coroutine, a generator
+    or batchable. A request is checked against its route before any code of the module runs,
+    and the route is called directly, without looking the function up again.
+    """
+
+    def __init__(self,
+                 module: Union[c.Module, str] = None,
+                 whitelist: List[str] = None, # the functions to compile (defaults to module.whitelist)
+                 ):
+        self.set_module(module, whitelist=whitelist)
+
+    def set_module(self, module: c.Module, whitelist: List[str] = None):
+        module = module or c.module('module')()
+        if isinstance(module, str):
+            module = c.module(module)()
+        self.module = module
+        whitelist = whitelist if whitelist != None else list(module.whitelist) + c.whitelist
+        self.fn2route = {}
+        for fn in set(whitelist):
+            if hasattr(module, fn):
+                self.fn2route[fn] = self.compile_route(fn)
+        return {'success': True, 'msg': f'compiled {len(self.fn2route)} routes of {module}'}
+
+    def compile_route(self, fn:str) -> dict:
+        fn_obj = getattr(self.module, fn)
+        route = {'fn': fn,
+                 'callable': callable(fn_obj),
+                 'is_coroutine': inspect.iscoroutinefunction(fn_obj),
+                 'is_generator': inspect.isgeneratorfunction(fn_obj) or inspect.isasyncgenfunction(fn_obj),
+                 'is_batchable': callable(fn_obj) and hasattr(fn_obj, '__batch__')}
+        if route['callable']:
+            route['obj'] = fn_obj
+            # a batchable function gets one item of its batch argument per call, so its type is not checked
+            route['check'] = self.compile_check(fn_obj, fn=fn, batch=route['is_batchable'])
+        return route
+
+    def route(self, fn:str) -> dict:
+        """
+        the route of fn, compiled on demand for the functions outside of the whitelist
+        (the admin can call any function, see Access.verify)
+        """
+        route = self.fn2route.get(fn)
+        if route == None:
+            assert hasattr(self.module, fn), f'Function {fn} not found'
+            route = self.fn2route[fn] = self.compile_route(fn)
+        return route
+
+    def check(self, fn:str, args:list, kwargs:dict) -> dict:
+        """
+        the route of fn, if args and kwargs fit its signature (or an AssertionError)
+        """
+        route = self.route(fn)
+        if route['callable']:
+            assert isinstance(args, list), f'args must be a list, not {type(args).__name__}'
+            assert isinstance(kwargs, dict), f'kwargs must be a dict, not {type(kwargs).__name__}'
+            if route['check'] != None:
+                route['check'](args, kwargs)
+        return route
+
+    def call(self, route:dict, args:list, kwargs:dict):
+        if route['callable']:
+            return route['obj'](*args, **kwargs)
+        # attributes are read on every call, as they can change
+        return getattr(self.module, route['fn'])
+
+    def compile_check(self, fn_obj:Callable, fn:str = None, batch:bool = False) -> Optional[Callable]:
+        """
+        a function (args, kwargs) -> None that asserts that the call binds to the signature
+        of fn_obj and that every argument fits its annotation (except the first one if batch)
+        """
+        try:
+            signature = inspect.signature(fn_obj)
+        except (TypeError, ValueError):
+            return None # builtins without a signature are checked by python
+        fn = fn or fn_obj.__name__
+        P = inspect.Parameter
+        params = list(signature.parameters.values())
+        positional = [p.name for p in params if p.kind in (P.POSITIONAL_ONLY, P.POSITIONAL_OR_KEYWORD)]
+        keywords = {p.name for p in params if p.kind in (P.POSITIONAL_OR_KEYWORD, P.KEYWORD_ONLY)}
+        name2index = {name: i for i, name in enumerate(positional)}
+        required = [p.name for p in params if p.default is P.empty and p.kind not in (P.VAR_POSITIONAL, P.VAR_KEYWORD)]
+        var_args = any(p.kind == P.VAR_POSITIONAL for p in params)
+        var_kwargs = any(p.kind == P.VAR_KEYWORD for p in params)
+        name2validator = {}
+        for p in params[1:] if batch else params:
+            if p.kind in (P.VAR_POSITIONAL, P.VAR_KEYWORD):
+                continue
+            validator = self.compile_type(p.annotation, none_ok=p.default is None)
+            if validator != None:
+                name2validator[p.name] = (validator, self.type_name(p.annotation))
+        n_positional = len(positional)
+
+        def check(args:list, kwargs:dict):
+            n_args = len(args)
+            assert n_args <= n_positional or var_args, f'{fn} takes {n_positional} positional arguments but {n_args} were given'
+            for name in kwargs:
+                assert name2index.get(name, n_args) >= n_args, f'{fn} got multiple values for {name}'
+                assert name in keywords or var_kwargs, f'{fn} got an unexpected argument {name}'
+            for name in required:
+                assert name in kwargs or name2index.get(name, n_args) < n_args, f'{fn} is missing the argument {name}'
+            for name, value in zip(positional, args):
+                if name in name2validator:
+                    validator, type_name = name2validator[name]
+                    assert validator(value), f'{fn}: {name} must be {type_name}, not {type(value).__name__}'
+            for name, value in kwargs.items():
+                if name in name2validator:
+                    validator, type_name = name2validator[name]
+                    assert validator(value), f'{fn}: {name} must be {type_name}, not {type(value).__name__}'
+        return check
+
+    def compile_type(self, annotation, none_ok:bool = False) -> Optional[Callable]:
+        """
+        a predicate for the values of the annotation, or None if any value fits it.
+        containers are checked on their type only, not on their items
+        """
+        validator = self.compile_annotation(annotation)
+        if validator == None or not none_ok:
+            return validator
+        return lambda x: x is None or validator(x)
+
+    def compile_annotation(self, annotation) -> Optional[Callable]:
+        if annotation in (inspect.Parameter.empty, Any) or isinstance(annotation, str):
+            return None
+        if annotation is None or annotation is type(None):
+            return lambda x: x is None
+        origin = get_origin(annotation)
+        if origin is Union or (hasattr(types, 'UnionType') and origin is types.UnionType):
+            validators = [self.compile_annotation(a) for a in get_args(annotation)]
+            if any(v == None for v in validators):
+                return None
+            return lambda x: any(v(x) for v in validators)
+        if origin is Literal:
+            values = get_args(annotation)
+            return lambda x: x in values
+        if origin != None:
+            annotation = origin
+        if annotation in (int, float, complex):
+            # json and msgpack do not keep 1.0 and 1 apart
+            return lambda x: isinstance(x, numbers.Number)
+        if annotation is bool:
+            return lambda x: isinstance(x, (bool, int))
+        if annotation in (list, tuple, set):
+            # tuples and sets arrive as lists
+            return lambda x: isinstance(x, (list, tuple, set))
+        if isinstance(annotation, type) and annotation.__module__ not in ['typing', 'collections.abc']:
+            return lambda x: isinstance(x, annotation)
+        return None
+
+    @staticmethod
+    def type_name(annotation) -> str:
+        return annotation.__name__ if isinstance(annotation, type) else str(annotation).replace('typing.', '')
+
+    def routes(self) -> Dict[str, dict]:
+        return {fn: {k: v for k, v in route.items() if k not in ['obj', 'check']} for fn, route in self.fn2route.items()}
+
+    @classmethod
+    def test(cls):
+        class Model:
+            whitelist = ['add', 'greet', 'stream']
+            def add(self, a:int, b:float = 1.0, scale:Optional[int] = None) -> float:
+                return (a + b) * (scale or 1)
+            async def greet(self, name:str, *, punctuation:str = '!'):
+                return f'hello {name}{punctuation}'
+            def stream(self, n:int = 3):
+                for i in range(n):
+                    yield i
+        # the classes defined in functions are not the module of the file
+        assert c.module('server.dispatch') is cls, f"server.dispatch resolves to {c.module('server.dispatch')}"
+        self = cls(module=Model())
+        assert set(self.fn2route) >= {'add', 'greet', 'stream'}, self.fn2route.keys()
+        assert self.fn2route['greet']['is_coroutine']
+        assert self.fn2route['stream']['is_generator']
+        route = self.check('add', args=[1], kwargs={'b': 2})
+        assert self.call(route, args=[1], kwargs={'b': 2}) == 3
+        invalid = [('add', [], {}), # missing a
+                   ('add', ['1'], {}), # a is not a number
+                   ('add', [1, 2, 3, 4], {}), # too many arguments
+                   ('add', [1], {'a': 1}), # a given twice
+                   ('add', [1], {'c': 1}), # unexpected argument
+                   ('greet', ['c', '?'], {}), # punctuation is keyword only
+                   ('greet', [], {'name': 1})] # name is not a string
+        for fn, args, kwargs in invalid:
+            try:
+                self.check(fn, args=args, kwargs=kwargs)
+            except AssertionError:
+                continue
+            raise Exception(f'{fn}({args}, {kwargs}) was not rejected')
+        self.check('add', args=[1], kwargs={'scale': None})
+        self.check('greet', args=[], kwargs={'name': 'c', 'punctuation': '?'})
+        # a served module checks its calls through the dispatch module
+        server_name = 'module::dispatch'
+        c.serve('module', tag='dispatch')
+        c.wait_for_server(server_name)
+        client = c.connect(server_name, virtual=False)
+        assert client.forward(fn='put', args=['dispatch', 1])['success']
+        result = client.forward(fn='get', args=[], kwargs={})
+        c.kill(server_name)
+        assert c.is_error(result) and 'missing the argument k' in str(result), result
+        return {'success': True, 'msg': 'dispatch test passed'}
+
+    @classmethod
+    def benchmark(cls, n:int = 100000):
+        """
+        checks and calls per second, through the route and through getattr and inspect.signature.bind
+        """
+        class Model:
+            whitelist = ['add']
+            def add(self, a:int, b:float = 1.0, scale:Optional[int] = None) -> float:
+                return (a + b) * (scale or 1)
+        module = Model()
+        self = cls(module=module)
+        args, kwargs = [1], {'b': 2.0}
+        results = {}
+        t = c.time()
+        for i in range(n):
+            fn_obj = getattr(module, 'add')
+            inspect.signature(fn_obj).bind(*args, **kwargs)
+            fn_obj(*args, **kwargs)
+        results['bind'] = n / (c.time() - t)
+        t = c.time()
+        for i in range(n):
+            self.call(self.check('add', args=args, kwargs=kwargs), args=args, kwargs=kwargs)
+        results['route'] = n / (c.time() - t)
+        results['speedup'] = results['route'] / results['bind']
+        return {k: round(v, 2) if k == 'speedup' else int(v) for k, v in results.items()}
@@ -0,0 +1,334 @@
+import commune as c
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import subprocess
+import collections
+import multiprocessing
+from typing import *
+
+
+class Fleet(c.Module):
+    """
+    Launches many servers at once (c.fleet, c.server_many).
+
+    The servers are forked from a zygote, a process that imported commune, the tree,
+    the server and the module classes once, so a server starts without importing anything.
+    The ports of the fleet are leased in one go, at most max_concurrency servers are starting
+    at a time, and every server sends its stages (spawn, import, bind, register) to the
+    launcher over a unix datagram socket, so the launcher waits for events instead of
+    polling the namespace. With zygote=False every server is a new python process, which
+    is the baseline of the timings.
+    """
+    stages = ['spawn', 'import', 'bind', 'register']
+    # the modules every server uses, imported in the zygote
+    zygote_imports = ['server', 'server.info', 'server.access', 'server.batch', 'serializer', 'key', 'namespace']
+
+    def __init__(self,
+                 max_concurrency:int = 16, # the max number of servers starting at once
+                 timeout:float = 60, # seconds the fleet has to start
+                 zygote:bool = True, # fork the servers from a warm process
+                 ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.use_zygote = zygote
+        self.zygote = None
+        self.zygote_modules = []
+
+    def start_zygote(self, modules:List[str]) -> float:
+        """
+        starts the zygote with the modules imported, and returns the seconds it took
+        """
+        t = time.time()
+        if self.zygote != None and self.zygote.is_alive() and all(m in self.zygote_modules for m in modules):
+            return 0
+        self.close()
+        conn, zygote_conn = multiprocessing.Pipe()
+        self.zygote = multiprocessing.get_context('fork').Process(target=self.run_zygote,
+                                                                  args=(zygote_conn, modules),
+                                                                  daemon=True)
+        self.zygote.start()
+        zygote_conn.close()
+        self.conn = conn
+        self.zygote_modules = list(modules)
+        assert self.conn.recv() == 'ready', 'the zygote failed to start'
+        return time.time() - t
+
+    @classmethod
+    def run_zygote(cls, conn, modules:List[str]):
+        # the imports the servers share, done once
+        for module in cls.zygote_imports:
+            c.module(module)
+        for module in modules:
+            c.module(module)
+        # the servers are not waited for, so they must not become zombies
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        conn.send('ready')
+        while True:
+            spec = conn.recv()
+            if spec == None:
+                break
+            if os.fork() == 0:
+                conn.close()
+                os.setsid() # the server outlives the zygote and the launcher
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                try:
+                    cls.redirect_output(spec['log_path'])
+                    cls.run_server(spec)
+                finally:
+                    os._exit(0)
+
+    @staticmethod
+    def redirect_output(path:str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+
+    @classmethod
+    def run_server(cls, spec:dict):
+        """
+        serves the module of the spec, sending the stages to the launcher
+        """
+        events = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        def emit(stage:str, **extra):
+            event = {'name': spec['name'], 'stage': stage, 'time': time.time(), 'pid': os.getpid(), **extra}
+            try:
+                events.sendto(json.dumps(event).encode(), spec['events_path'])
+            except OSError:
+                pass # the launcher is gone, the server keeps going
+        emit('spawn')
+        try:
+            module_class = c.module(spec['module'])
+            kwargs = dict(spec.get('kwargs') or {})
+            if module_class.is_arg_key_valid('tag', fn='__init__'):
+                kwargs['tag'] = spec['tag']
+            if module_class.is_arg_key_valid('server_name', fn='__init__'):
+                kwargs['server_name'] = spec['name']
+            module = module_class(**kwargs)
+            module.server_name = spec['name']
+            module.tag = spec['tag']
+            emit('import')
+            c.module('server')(module=module,
+                               name=spec['name'],
+                               port=spec['port'],
+                               network=spec['network'],
+                               key=spec.get('key'),
+                               ready_fn=emit,
+                               **spec.get('server_kwargs', {}))
+        except Exception as e:
+            emit('error', error=str(e))
+
+    def spawn(self, spec:dict):
+        if self.use_zygote:
+            self.conn.send(spec)
+        else:
+            cmd = 'import sys, json, commune as c; c.module("server.fleet").run_server(json.loads(sys.argv[1]))'
+            os.makedirs(os.path.dirname(spec['log_path']), exist_ok=True)
+            with open(spec['log_path'], 'a') as log:
+                subprocess.Popen([sys.executable, '-c', cmd, json.dumps(spec)],
+                                 stdout=log, stderr=log, cwd=c.pwd(), start_new_session=True)
+
+    def specs(self,
+              module:Union[str, List[str]] = None,
+              n:int = 1,
+              tag:str = None,
+              names:List[str] = None,
+              kwargs:dict = None,
+              network:str = 'local',
+              key:str = None,
+              server_kwargs:dict = None) -> List[dict]:
+        """
+        the spec of every server, with the ports leased together
+        """
+        if isinstance(module, list):
+            modules = [(m, tag) for m in module]
+        else:
+            module = module or 'module'
+            modules = [(module, None if tag == None and n == 1 else f'{tag or ""}{i}') for i in range(n)]
+        names = names or [c.resolve_server_name(module=m, tag=t) for m, t in modules]
+        assert len(names) == len(modules), f'{len(names)} names for {len(modules)} servers'
+        ports = c.port_allocator().allocate(n=len(modules))
+        return [{'module': m,
+                 'tag': t,
+                 'name': name,
+                 'port': port,
+                 'network': network,
+                 'key': key,
+                 'kwargs': kwargs or {},
+                 'server_kwargs': server_kwargs or {},
+                 'log_path': self.resolve_path(f'logs/{name}.log')} for (m, t), name, port in zip(modules, names, ports)]
+
+    def launch(self,
+               module:Union[str, List[str]] = None,
+               n:int = 1,
+               tag:str = None,
+               names:List[str] = None,
+               kwargs:dict = None,
+               network:str = 'local',
+               key:str = None,
+               refresh:bool = True,
+               server_kwargs:dict = None,
+               **extra_kwargs) -> dict:
+        """
+        launches n servers of the module (or one server per module if module is a list)
+        and waits until they are registered, with the timings of every stage
+        """
+        t0 = time.time()
+        kwargs = {**(kwargs or {}), **extra_kwargs}
+        specs = self.specs(module=module, n=n, tag=tag, names=names, kwargs=kwargs,
+                           network=network, key=key, server_kwargs=server_kwargs)
+        if refresh:
+            self.kill([spec['name'] for spec in specs], network=network)
+        zygote_seconds = self.start_zygote(sorted(set(s['module'] for s in specs))) if self.use_zygote else 0
+        events_path = self.resolve_path(f'events/{os.getpid()}.{id(self)}.sock')
+        if os.path.exists(events_path):
+            os.remove(events_path)
+        events = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        events.bind(events_path)
+        pending = collections.deque(specs)
+        starting = {}
+        name2server = {}
+        deadline = t0 + self.timeout
+        try:
+            while len(pending) > 0 or len(starting) > 0:
+                while len(pending) > 0 and len(starting) < self.max_concurrency:
+                    spec = pending.popleft()
+                    spec['events_path'] = events_path
+                    name2server[spec['name']] = {'name': spec['name'], 'address': f'{c.ip()}:{spec["port"]}',
+                                                 'module': spec['module'], 'stages': {'request': time.time()}}
+                    self.spawn(spec)
+                    starting[spec['name']] = spec
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                events.settimeout(remaining)
+                try:
+                    event = json.loads(events.recv(65536))
+                except socket.timeout:
+                    break
+                server = name2server.get(event['name'])
+                if server == None:
+                    continue
+                server['stages'][event['stage']] = event['time']
+                server['pid'] = event['pid']
+                if event['stage'] == 'error':
+                    server['error'] = event.get('error')
+                if event['stage'] in ['register', 'error']:
+                    starting.pop(event['name'], None)
+        finally:
+            events.close()
+            os.remove(events_path)
+        for name in list(starting) + [s['name'] for s in pending]:
+            name2server.setdefault(name, {'name': name, 'stages': {}})['error'] = f'not registered within {self.timeout}s'
+        for server in name2server.values():
+            server['timings'] = self.stage_timings(server['stages'])
+            server['success'] = 'error' not in server
+        servers = list(name2server.values())
+        seconds = time.time() - t0
+        return {'success': all(s['success'] for s in servers),
+                'n': len(specs),
+                'failed': [s['name'] for s in servers if not s['success']],
+                'seconds': seconds,
+                'zygote_seconds': zygote_seconds,
+                'servers_per_second': len(specs) / seconds,
+                'timings': self.mean_timings(servers),
+                'servers': {s['name']: s for s in servers}}
+
+    def stage_timings(self, stages:dict) -> dict:
+        """
+        the seconds of every stage, from the end of the previous one
+        """
+        timings = {}
+        previous = stages.get('request')
+        for stage in self.stages:
+            if stage in stages and previous != None:
+                timings[stage] = stages[stage] - previous
+                previous = stages[stage]
+        if 'register' in stages and 'request' in stages:
+            timings['total'] = stages['register'] - stages['request']
+        return timings
+
+    def mean_timings(self, servers:List[dict]) -> dict:
+        stage2timings = collections.defaultdict(list)
+        for server in servers:
+            for stage, seconds in server.get('timings', {}).items():
+                stage2timings[stage].append(seconds)
+        return {stage: {'mean': sum(t) / len(t), 'max': max(t)} for stage, t in stage2timings.items()}
+
+    @classmethod
+    def kill(cls, names:List[str] = None, search:str = None, network:str = 'local') -> List[str]:
+        """
+        stops the servers (by the pid in the namespace) and removes them from the namespace
+        """
+        namespace = c.module('namespace')
+        registry = namespace.get_registry(network)
+        names = [n for n in registry if (names == None or n in names) and (search == None or search in n)]
+        killed = []
+        for name in names:
+            address, pid, expires = registry[name]
+            if pid != None and pid != os.getpid():
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    killed.append(name)
+                except ProcessLookupError:
+                    pass
+            namespace.deregister_server(name, network=network)
+        return killed
+
+    def close(self):
+        if self.zygote != None:
+            try:
+                self.conn.send(None)
+                self.conn.close()
+            except (OSError, ValueError):
+                pass
+            self.zygote.join(timeout=1)
+            if self.zygote.is_alive():
+                self.zygote.terminate()
+            self.zygote = None
+        return {'success': True, 'msg': 'closed the zygote'}
+
+    @classmethod
+    def test(cls, n:int = 3):
+        self = cls(timeout=60)
+        try:
+            result = self.launch(module='module', n=n, tag='fleet_test')
+        finally:
+            self.close()
+        try:
+            assert result['success'], result['failed']
+            for name, server in result['servers'].items():
+                assert all(stage in server['stages'] for stage in cls.stages), server['stages']
+                assert c.server_exists(name), f'{name} is not in the namespace'
+            assert c.connect(name).info()['name'] == name
+        finally:
+            cls.kill(search='module::fleet_test')
+        return {'success': True, 'msg': 'fleet test passed', 'timings': result['timings']}
+
+    @classmethod
+    def benchmark(cls, n:int = 20, module:str = 'module', max_concurrency:int = 16):
+        """
+        the launch of n servers, forked from the zygote and as new processes
+        """
+        results = {}
+        for zygote in [True, False]:
+            self = cls(max_concurrency=max_concurrency, zygote=zygote, timeout=300)
+            mode = 'zygote' if zygote else 'process'
+            tag = f'fleet_benchmark_{mode}_'
+            try:
+                result = self.launch(module=module, n=n, tag=tag)
+            finally:
+                self.close()
+                cls.kill(search=f'{module}::{tag}')
+            results[mode] = {'success': result['success'],
+                             'seconds': round(result['seconds'], 3),
+                             'zygote_seconds': round(result['zygote_seconds'], 3),
+                             'servers_per_second': round(result['servers_per_second'], 2),
+                             'timings': {k: round(v['mean'], 4) for k, v in result['timings'].items()}}
+        results['speedup'] = round(results['process']['seconds'] / results['zygote']['seconds'], 2)
+        return results
@@ -0,0 +1,168 @@
+import commune as c
+from typing import *
+import os
+import threading
+
+
+class Info(c.Module):
+    """
+    The info of a served module, computed when the module is set and kept in memory.
+    The schema, code hash and commit hash are only computed again when the file of the
+    module changes (checked every code_interval seconds), and the info is signed once
+    per refresh. The hardware is sampled every hardware_interval seconds in the background
+    (it is empty until the first sample).
+    """
+
+    def __init__(self,
+                 module: Union[c.Module, str] = None,
+                 key = None,
+                 hardware_interval: float = 10, # seconds between hardware samples
+                 code_interval: float = 5, # seconds between checks of the module file
+                 ):
+        self.set_module(module)
+        self.key = key or self.module.key
+        self.hardware_interval = hardware_interval
+        self.code_interval = code_interval
+        self.lock = threading.Lock()
+        self.code_stat = None
+        self.hardware = {}
+        self.refreshes = 0
+        self.refresh()
+        c.thread(self.run_loop)
+
+    def set_module(self, module: c.Module):
+        module = module or c.module('module')()
+        if isinstance(module, str):
+            module = c.module(module)()
+        self.module = module
+        self.module_file = os.path.abspath(type(module).filepath())
+        return {'success': True, 'msg': f'set module to {module}'}
+
+    def get_code_stat(self) -> tuple:
+        st = os.stat(self.module_file)
+        return (st.st_mtime_ns, st.st_size)
+
+    def refresh(self) -> dict:
+        """
+        computes and signs the info of the module
+        """
+        module = self.module
+        code_stat = self.get_code_stat()
+        fns = list(module.whitelist)
+        info = dict(
+            address = module.address.replace(c.default_ip, c.ip(update=False)),
+            functions = fns,
+            attributes = [attr for attr in module.attributes() if attr != 'info'],
+            name = module.server_name() if callable(module.server_name) else module.server_name,
+            path = module.module_path(),
+            chash = module.chash(),
+        )
+        info['hash'] = c.hash(info)
+        if self.key != None:
+            auth = self.key.sign(info, return_json=True)
+            info['signature'] = auth['signature']
+            info['ss58_address'] = auth['address']
+        schema = module.schema(defaults=True, include_parents=True)
+        for fn in fns:
+            # the functions set on the instance (like batch_stats) are not in the schema of the class
+            if fn not in schema and callable(getattr(module, fn, None)):
+                schema[fn] = module.fn_schema(getattr(module, fn), defaults=True)
+        info['schema'] = {fn: schema[fn] for fn in fns if fn in schema}
+        info['commit_hash'] = c.commit_hash()
+        # swap the whole info, so a call sees the old or the new info but never a mix
+        with self.lock:
+            self.base_info = info
+            self.code_stat = code_stat
+            self.refreshes += 1
+        return {'success': True, 'msg': f'refreshed the info of {info["name"]}', 'refreshes': self.refreshes}
+
+    def sample_hardware(self) -> dict:
+        self.hardware = self.module.hardware()
+        return self.hardware
+
+    def run_loop(self):
+        # the first hardware sample is taken after the first sleep, so it does not slow down
+        # the start of the server (the gpu probe imports torch)
+        last_hardware, last_code = 0, c.time()
+        while True:
+            c.sleep(min(self.hardware_interval, self.code_interval))
+            try:
+                if c.time() - last_hardware >= self.hardware_interval:
+                    self.sample_hardware()
+                    last_hardware = c.time()
+                if c.time() - last_code >= self.code_interval:
+                    if self.get_code_stat() != self.code_stat:
+                        c.print(self.refresh(), color='yellow')
+                    last_code = c.time()
+            except Exception as e:
+                c.print(f'Info loop failed {c.detailed_error(e)}', color='red')
+
+    def info(self,
+             schema: bool = True,
+             namespace: bool = False,
+             commit_hash: bool = True,
+             hardware: bool = True,
+             cost: bool = False,
+             **kwargs) -> Dict[str, Any]:
+        """
+        the info of the module, from memory (served as module.info)
+        """
+        info = dict(self.base_info)
+        if not schema:
+            info.pop('schema', None)
+        if not commit_hash:
+            info.pop('commit_hash', None)
+        if hardware:
+            info['hardware'] = self.hardware
+        if namespace:
+            info['namespace'] = c.namespace(network='local')
+        if cost and hasattr(self.module, 'cost'):
+            info['cost'] = self.module.cost
+        return info
+
+    @classmethod
+    def benchmark(cls, n:int = 1000, module:str = 'module'):
+        """
+        info calls per second, computed on every call (module.info) and served from memory
+        """
+        module = c.module(module)()
+        module.address = c.default_ip
+        self = cls(module=module, key=module.key)
+        results = {}
+        t = c.time()
+        for i in range(max(n // 100, 1)):
+            module.info(update=True)
+        results['computed'] = max(n // 100, 1) / (c.time() - t)
+        t = c.time()
+        for i in range(n):
+            self.info()
+        results['in_memory'] = n / (c.time() - t)
+        results['speedup'] = results['in_memory'] / results['computed']
+        return {k: int(v) for k,v in results.items()}
+
+    @classmethod
+    def test(cls, timeout:float = 10):
+        module = c.module('module')()
+        module.address = c.default_ip
+        def batch_stats() -> dict:
+            return {}
+        # a function set on the instance, like the batch_stats of the server
+        module.batch_stats = batch_stats
+        module.whitelist = list(module.whitelist) + ['batch_stats']
+        self = cls(module=module, key=module.key, hardware_interval=0.1)
+        info = self.info()
+        for k in ['name', 'schema', 'chash', 'signature', 'hardware', 'commit_hash']:
+            assert k in info, f'{k} not in info'
+        assert 'batch_stats' in info['functions'] and 'batch_stats' in info['schema'], info['functions']
+        assert info['chash'] == module.chash() and info['ss58_address'] == module.key.ss58_address
+        assert 'schema' not in self.info(schema=False)
+        assert self.info() is not self.info(), 'every call gets its own dict'
+        # the hardware is sampled in the background
+        t = c.time()
+        while len(self.info()['hardware']) == 0:
+            assert c.time() - t < timeout, 'the hardware was not sampled'
+            c.sleep(0.1)
+        hardware = self.info()['hardware']
+        assert hardware['cpu']['cpu_count'] > 0, hardware['cpu']
+        assert hardware['memory']['total'] > 0 and hardware['disk'], hardware
+        return {'success': True, 'msg': 'info test passed'}
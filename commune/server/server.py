@@ -1,9 +1,19 @@
 import commune as c
 import pandas as pd
 from typing import *
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 import uvicorn
+import asyncio
+import inspect
+import functools
+import os
+import json
+import hashlib
+import collections
+import socket
+import threading
 
 
 class Server(c.Module):
@@ -16,30 +26,53 @@ class Server(c.Module):
         sse: bool = True,
         chunk_size: int = 1000,
         max_request_staleness: int = 2, 
+        max_replay_addresses: int = 10000, # the addresses tracked for replays before the idle ones are dropped
         key = None,
         verbose: bool = False,
         timeout: int = 256,
         access_module: str = 'server.access',
+        batch_module: str = 'server.batch',
+        info_module: str = 'server.info',
+        dispatch_module: str = 'server.dispatch',
         free: bool = False,
         serializer: str = 'serializer',
         save_history:bool= True,
         history_path:str = None , 
+        history_mode:str = 'jsonl', # jsonl segments or sqlite
         nest_asyncio = True,
         mnemonic = None,
         new_loop = True,
         subnet = None,
+        max_workers: int = None, # the number of threads for blocking functions
+        max_fn_concurrency: int = 32, # the max number of concurrent calls per function
+        fn2concurrency: dict = None, # per function overrides of max_fn_concurrency
+        max_queue_time: float = 1.0, # seconds a request can wait for a slot before a 429
+        max_queue: int = None, # the jobs that can wait for a thread (defaults to 4 per thread)
+        workers: int = 1, # the number of server processes sharing the port (each with its own replay window)
+        worker_id: int = 0, # the id of this worker, only worker 0 registers in the namespace
+        lease_ttl: int = 60, # seconds the namespace entry lives without a heartbeat
+        ready_fn: Callable = None, # called with the stage (bind, register) once the server reaches it
         **kwargs
         ) -> 'Server':
 
         if new_loop:
             c.new_event_loop(nest_asyncio=nest_asyncio)
         self.ip = c.ip()
+        self.workers = workers
+        self.lease_ttl = lease_ttl
+        self.worker_id = worker_id
+        self.ready_fn = ready_fn
         port = port or c.free_port()
-        while c.port_used(port):
+        # the workers share the port, so it is expected to be in use
+        if workers == 1 and c.port_used(port):
+            # free_port only hands out ports that are free and not leased to another server
             port =  c.free_port()
-        self.port = port
+        self.port = int(port)
         self.address = f"http://{self.ip}:{self.port}"
         self.max_request_staleness = max_request_staleness
+        self.address2signatures = {} # address -> signatures seen within the staleness window
+        self.replay_lock = threading.Lock() # the requests are processed on the threads of the executor
+        self.max_replay_addresses = max_replay_addresses
         self.network = network
         self.verbose = verbose
         self.sse = sse
@@ -48,9 +81,20 @@ class Server(c.Module):
         self.timeout = timeout
         self.free = free
         self.serializer = c.module(serializer)()
+        self.set_executor(max_workers=max_workers, 
+                          max_fn_concurrency=max_fn_concurrency, 
+                          fn2concurrency=fn2concurrency, 
+                          max_queue_time=max_queue_time, 
+                          max_queue=max_queue)
         self.set_module(module, key=key)
-        self.access_module = c.module(access_module)(module=self.module)  
-        self.set_history_path(history_path)
+        # the workers share the rate limits through sqlite
+        self.access_module = c.module(access_module)(module=self.module, shared=workers > 1)  
+        self.set_batch_module(batch_module)
+        # the info lists the functions added by the sub modules (batch_stats), 
+        # and is compiled into a route like any other function
+        self.set_info_module(info_module)
+        self.set_dispatch_module(dispatch_module)
+        self.set_history_path(history_path, history_mode=history_mode)
         self.set_api(port=self.port)
 
     def set_module(self, module, key=None):
@@ -80,76 +124,172 @@ class Server(c.Module):
 
         return {'success': True, 'msg': f'Set module {module}', 'key': self.key.ss58_address}
 
-    def forward(self, fn:str, input:dict):
+    def set_executor(self, 
+                     max_workers:int = None, 
+                     max_fn_concurrency:int = 32, 
+                     fn2concurrency:dict = None,
+                     max_queue_time:float = 1.0, 
+                     max_queue:int = None):
         """
-        fn (str): the function to call
-        input (dict): the input to the function
-            data: the data to pass to the function
-                kwargs: the keyword arguments to pass to the function
-                args: the positional arguments to pass to the function
-                timestamp: the timestamp of the request
-                address: the address of the caller
-            hash: the hash of the request (optional)
-            signature: the signature of the request
-   
+        blocking functions run on a bounded thread pool, while coroutine functions 
+        are awaited on the event loop. each function gets its own semaphore so one 
+        slow function cannot starve the others. the jobs of the pool (the functions 
+        and the processing of the requests) are capped at max_workers + max_queue, 
+        so the queue of the pool is bounded
         """
-        user_info = None
-        color = c.random_color()
-
-        try:
-            # you can verify the input with the server key class
-            assert self.key.verify(input), f"Data not signed with correct key"
-
-            input['fn'] = fn
-
-            if 'params' in input:
-                if isinstance(input['params'], dict):
-                    input['kwargs'] = input['params']
-                else:
-                    input['args'] = input['params']
-
-            if 'args' in input and 'kwargs' in input:
-                input['data'] = {'args': input['args'], 
-                                 'kwargs': input['kwargs'], 
-                                 'timestamp': input['timestamp'], 
-                                 'address': input['address']}
-                
-            
-            input['data'] = self.serializer.deserialize(input['data'])
-            # here we want to verify the data is signed with the correct key
-            request_staleness = c.timestamp() - input['data'].get('timestamp', 0)
-            # verifty the request is not too old
-            assert request_staleness < self.max_request_staleness, f"Request is too old, {request_staleness} > MAX_STALENESS ({self.max_request_staleness})  seconds old"
-            
-            # verify the access module
-            user_info = self.access_module.verify(fn=input['fn'], address=input['address'])
-            if not user_info['success']:
-                return user_info
-            assert 'args' in input['data'], f"args not in input data"
-
-            data = input['data']
-            args = data.get('args',[])
-            kwargs = data.get('kwargs', {})
-            
-            fn_obj = getattr(self.module, fn)
-            
-            if callable(fn_obj):
-                result = fn_obj(*args, **kwargs)
-            else:
-                result = fn_obj
+        from concurrent.futures import ThreadPoolExecutor
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='server')
+        self.max_fn_concurrency = max_fn_concurrency
+        self.fn2concurrency = fn2concurrency or {}
+        self.max_queue_time = max_queue_time
+        self.max_queue = max_queue if max_queue != None else self.max_workers * 4
+        self.fn2semaphore = {}
+        self.executor_semaphore = None # created on the loop of the server
+        return {'max_workers': self.max_workers, 
+                'max_queue': self.max_queue, 
+                'max_fn_concurrency': self.max_fn_concurrency, 
+                'max_queue_time': self.max_queue_time}
+
+    def set_batch_module(self, batch_module:str = 'server.batch'):
+        """
+        functions marked with @c.batchable are gathered into batches, 
+        the batch stats are served as batch_stats
+        """
+        self.batch_module = c.module(batch_module)(module=self.module, executor=self.executor)
+        batch_fns = self.batch_module.batch_fns()
+        if len(batch_fns) > 0:
+            self.module.batch_stats = self.batch_module.stats
+            self.whitelist = list(set(self.whitelist + ['batch_stats']))
+            self.module.whitelist = list(set(self.module.whitelist + ['batch_stats']))
+        return {'success': True, 'batch_fns': batch_fns}
+
+    def set_info_module(self, info_module:str = 'server.info'):
+        """
+        the info (schema, code hash, commit hash, signature) is computed once and served from memory
+        """
+        self.info_module = c.module(info_module)(module=self.module, key=self.key)
+        self.module.info = self.info_module.info
+        return {'success': True, 'functions': len(self.info_module.base_info['functions'])}
 
-            if isinstance(result, dict) and 'error' in result:
-                success = False 
-            else:
-                success = True
+    def set_dispatch_module(self, dispatch_module:str = 'server.dispatch'):
+        """
+        compiles the whitelist into routes, so requests are checked against the 
+        signatures before any function runs and are called without a lookup
+        """
+        self.dispatch_module = c.module(dispatch_module)(module=self.module, whitelist=self.whitelist)
+        return {'success': True, 'routes': len(self.dispatch_module.fn2route)}
 
-            # if the result is a future, we need to wait for it to finish
-        except Exception as e:
-            result = c.detailed_error(e)
-            success = False 
+    def get_semaphore(self, fn:str) -> asyncio.Semaphore:
+        if fn not in self.fn2semaphore:
+            limit = self.fn2concurrency.get(fn, self.max_fn_concurrency)
+            self.fn2semaphore[fn] = asyncio.Semaphore(limit)
+        return self.fn2semaphore[fn]
 
+    def get_executor_semaphore(self) -> asyncio.Semaphore:
+        if self.executor_semaphore == None:
+            self.executor_semaphore = asyncio.Semaphore(self.max_workers + self.max_queue)
+        return self.executor_semaphore
 
+    async def acquire(self, semaphores:List[asyncio.Semaphore]) -> bool:
+        """
+        acquires the semaphores in order, each within max_queue_time, releasing the 
+        acquired ones if one of them times out
+        """
+        acquired = []
+        for semaphore in semaphores:
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.max_queue_time)
+            except asyncio.TimeoutError:
+                for s in acquired:
+                    s.release()
+                return False
+            acquired.append(semaphore)
+        return True
+
+    async def run_in_executor(self, fn:Callable, semaphores:List[asyncio.Semaphore] = None, timeout:float = None):
+        """
+        runs fn on the executor. the semaphores (already acquired) are released when 
+        the thread is done, not when the call times out, as the thread keeps running
+        """
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(fn)
+        def release(_):
+            for semaphore in semaphores or []:
+                loop.call_soon_threadsafe(semaphore.release)
+        future.add_done_callback(release)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+
+    def too_many_requests(self, fn:str) -> JSONResponse:
+        return JSONResponse(status_code=429, 
+                            content={'success': False, 
+                                     'error': f'Too many requests for {fn}, try again later',
+                                     'max_queue_time': self.max_queue_time})
+
+    def process_input(self, fn:str, input:dict) -> dict:
+        """
+        verifies the signature, staleness and access of the request, 
+        and resolves the args and kwargs into input['data']
+        """
+        # you can verify the input with the server key class
+        assert self.key.verify(input), f"Data not signed with correct key"
+
+        input['fn'] = fn
+        if 'data' not in input:
+            # the args and kwargs are sent next to the signature (params is a list of args or a dict of kwargs)
+            params = input.get('params')
+            input['data'] = {'args': params if isinstance(params, list) else input.get('args', []),
+                             'kwargs': params if isinstance(params, dict) else input.get('kwargs', {}),
+                             'timestamp': input['timestamp'],
+                             'address': input['address']}
+        input['data'] = self.serializer.deserialize(input['data'])
+        # here we want to verify the data is signed with the correct key
+        request_staleness = c.timestamp() - input['data'].get('timestamp', 0)
+        # verifty the request is not too old (or from the future)
+        assert request_staleness < self.max_request_staleness, f"Request is too old, {request_staleness} > MAX_STALENESS ({self.max_request_staleness})  seconds old"
+        assert request_staleness > -self.max_request_staleness, f"Request is from the future, {-request_staleness} seconds ahead"
+        self.check_replay(address=input['address'], signature=input['signature'], timestamp=input['data']['timestamp'])
+        
+        # verify the access module
+        user_info = self.access_module.verify(fn=input['fn'], address=input['address'])
+        return user_info
 
+    def check_replay(self, address:str, signature:str, timestamp:float, now:float = None):
+        """
+        a signature can only be used once while its request is fresh. 
+        sr25519 signatures are randomized, so two identical calls are signed differently, 
+        while a replayed request carries the same signature.
+        a signature is kept until the timestamp of its request is stale (not for the 
+        staleness window from when it was seen), as a future dated request stays fresh 
+        for up to twice the window.
+        the signatures are kept in the memory of the process, so with workers > 1 
+        (sharing the port with SO_REUSEPORT) each worker has its own window, and a 
+        replay that lands on another worker within the window is not caught
+        """
+        now = c.time() if now == None else now
+        # the staleness is checked on whole seconds (c.timestamp)
+        expiry = timestamp + self.max_request_staleness + 1
+        # the signature is checked and recorded at once, as the requests are processed on threads
+        with self.replay_lock:
+            if address not in self.address2signatures:
+                if len(self.address2signatures) > self.max_replay_addresses:
+                    # forget the addresses that have nothing left in their window
+                    self.address2signatures = {k:v for k,v in self.address2signatures.items() if len(v) > 0 and max(v.values()) > now}
+                self.address2signatures[address] = collections.OrderedDict()
+            signatures = self.address2signatures[address]
+            # the expiries are in the order of the timestamps, which is about the order of arrival
+            while len(signatures) > 0 and signatures[next(iter(signatures))] <= now:
+                signatures.popitem(last=False)
+            assert signature not in signatures, f"Replayed request from {address}"
+            signatures[signature] = expiry
+
+    def process_output(self, fn:str, input:dict, result:Any, success:bool, user_info:dict = None, color=None, content_type:str = 'application/json'):
+        """
+        logs the call, serializes and signs the result, and saves the history
+        """
+        if not isinstance(input.get('data'), dict):
+            # the request failed before the data was deserialized
+            input['data'] = {'args': [], 'kwargs': {}, 'timestamp': c.timestamp()}
 
         print_info = {
             'fn': fn,
@@ -161,10 +301,10 @@ class Server(c.Module):
         if not success:
             print_info['error'] = result
 
-        c.print(print_info, color=color)
+        c.print(print_info, color=color or c.random_color())
         
 
-        result = self.process_result(result)
+        result = self.process_result(result, content_type=content_type)
     
         output = {
         'module': self.name,
@@ -190,6 +330,103 @@ class Server(c.Module):
 
         return result
 
+    def forward(self, fn:str, input:dict, content_type:str = 'application/json'):
+        """
+        fn (str): the function to call
+        input (dict): the input to the function
+            data: the data to pass to the function
+                kwargs: the keyword arguments to pass to the function
+                args: the positional arguments to pass to the function
+                timestamp: the timestamp of the request
+                address: the address of the caller
+            hash: the hash of the request (optional)
+            signature: the signature of the request
+   
+        """
+        user_info = None
+        color = c.random_color()
+
+        try:
+            user_info = self.process_input(fn=fn, input=input)
+            if not user_info['success']:
+                return user_info
+            args = input['data'].get('args', [])
+            kwargs = input['data'].get('kwargs', {})
+            # rejects calls that do not fit the signature before the function runs
+            route = self.dispatch_module.check(fn, args=args, kwargs=kwargs)
+            if route['is_batchable']:
+                result = self.batch_module.forward_one(fn, args=args, kwargs=kwargs)
+            else:
+                result = self.dispatch_module.call(route, args=args, kwargs=kwargs)
+            if c.is_coroutine(result):
+                result = c.gather(result, timeout=self.timeout)
+
+            success = not (isinstance(result, dict) and 'error' in result)
+
+        except Exception as e:
+            result = c.detailed_error(e)
+            success = False 
+
+        return self.process_output(fn=fn, input=input, result=result, success=success, user_info=user_info, color=color, content_type=content_type)
+
+    async def async_forward(self, fn:str, input:dict, content_type:str = 'application/json'):
+        """
+        The async version of forward. Coroutine functions are awaited directly, 
+        blocking functions are sent to the bounded executor. If a function has 
+        no free slot within max_queue_time seconds, the caller gets a 429.
+        The signature check, the deserialization and the signing of the result 
+        run on the executor as well, so a large payload does not stall the loop.
+        """
+        user_info = None
+        color = c.random_color()
+        executor_semaphore = self.get_executor_semaphore()
+
+        try:
+            if not await self.acquire([executor_semaphore]):
+                return self.too_many_requests(fn)
+            user_info = await self.run_in_executor(functools.partial(self.process_input, fn=fn, input=input), 
+                                                   semaphores=[executor_semaphore])
+            if not user_info['success']:
+                return user_info
+            args = input['data'].get('args', [])
+            kwargs = input['data'].get('kwargs', {})
+            # rejects calls that do not fit the signature before the function runs
+            route = self.dispatch_module.check(fn, args=args, kwargs=kwargs)
+
+            if route['callable']:
+                semaphore = self.get_semaphore(fn)
+                if route['is_batchable'] or route['is_coroutine']:
+                    if not await self.acquire([semaphore]):
+                        return self.too_many_requests(fn)
+                    try:
+                        if route['is_batchable']:
+                            future = self.batch_module.forward(fn, args=args, kwargs=kwargs)
+                        else:
+                            future = route['obj'](*args, **kwargs)
+                        # a cancelled coroutine stops, so its slot is free once wait_for returns
+                        result = await asyncio.wait_for(future, timeout=self.timeout)
+                    finally:
+                        semaphore.release()
+                else:
+                    if not await self.acquire([semaphore, executor_semaphore]):
+                        return self.too_many_requests(fn)
+                    # the slots are held until the thread is done, even if the call times out
+                    result = await self.run_in_executor(functools.partial(route['obj'], *args, **kwargs), 
+                                                        semaphores=[semaphore, executor_semaphore], 
+                                                        timeout=self.timeout)
+            else:
+                result = self.dispatch_module.call(route, args=args, kwargs=kwargs)
+
+            success = not (isinstance(result, dict) and 'error' in result)
+
+        except Exception as e:
+            result = c.detailed_error(e)
+            success = False 
+
+        # every admitted request gets one output job, so these are bounded by the admitted requests
+        return await self.run_in_executor(functools.partial(self.process_output, fn=fn, input=input, result=result, success=success, 
+                                                            user_info=user_info, color=color, content_type=content_type))
+
     def set_api(self, port:int = 8888):
         
         self.app = FastAPI()
@@ -202,19 +439,63 @@ class Server(c.Module):
             )
        
         @self.app.post("/{fn}")
-        def forward_api(fn:str, input:dict):
-            return self.forward(fn=fn, input=input)
+        async def forward_api(fn:str, request: Request):
+            input, content_type = await self.process_request(request)
+            return await self.async_forward(fn=fn, input=input, content_type=content_type)
         
+        # only the first worker owns the namespace entry
+        register = self.worker_id == 0
         try:
+            # the socket is bound before the server is registered, so a registered server accepts connections
+            sock = self.get_socket(port=self.port, reuse_port=self.workers > 1)
+            self.ready('bind')
             c.print(f' Served ( {self.name} --> {self.address} ) 🚀\033 ', color='purple')
             c.print(f'🔑 Key: {self.key} 🔑\033', color='yellow')
-            c.register_server(name=self.name, address = self.address, network=self.network)
-            uvicorn.run(self.app, host='0.0.0.0', port=self.port, loop="asyncio")
+            if register:
+                c.register_server(name=self.name, address = self.address, network=self.network, ttl=self.lease_ttl, pid=os.getpid())
+                c.thread(self.heartbeat_loop)
+            self.ready('register')
+            if self.workers > 1:
+                c.print(f'👷 Worker {self.worker_id}/{self.workers} (pid={os.getpid()}) 👷', color='yellow')
+            config = uvicorn.Config(self.app, host='0.0.0.0', port=self.port, loop="asyncio")
+            uvicorn.Server(config).run(sockets=[sock])
         except Exception as e:
             c.print(e, color='red')
-            c.deregister_server(self.name, network=self.network)
         finally:
-            c.deregister_server(self.name, network=self.network)
+            if register:
+                c.deregister_server(self.name, network=self.network)
+
+    def heartbeat_loop(self):
+        # renew the namespace lease while the server is up
+        namespace = c.module('namespace')
+        while True:
+            c.sleep(self.lease_ttl / 3)
+            try:
+                namespace.heartbeat(name=self.name, address=self.address, network=self.network, ttl=self.lease_ttl, pid=os.getpid())
+            except Exception as e:
+                c.print(f'Heartbeat failed {c.detailed_error(e)}', color='red')
+
+    def ready(self, stage:str):
+        if self.ready_fn != None:
+            try:
+                self.ready_fn(stage)
+            except Exception as e:
+                c.print(f'ready_fn failed at {stage} {c.detailed_error(e)}', color='red')
+
+    @staticmethod
+    def get_socket(port:int, host:str = '0.0.0.0', reuse_port:bool = True) -> socket.socket:
+        """
+        a listening socket, with SO_REUSEPORT the kernel spreads the connections 
+        over every worker bound to the port
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
         
     @classmethod
     def history_paths(cls, server=None, history_path='history', n=100, key=None):
@@ -240,46 +521,96 @@ class Server(c.Module):
     
 
 
-    def process_result(self,  result):
-        if c.is_generator(result):
+    async def process_request(self, request: 'Request'):
+        """
+        decodes the request body and negotiates the response content type. 
+        msgpack requests carry raw bytes, json is the fallback.
+        """
+        msgpack_type = self.serializer.content_types['msgpack']
+        if request.headers.get('content-type', '').startswith(msgpack_type):
+            input = self.serializer.msgpack2dict(await request.body())
+        else:
+            input = await request.json()
+        if msgpack_type in request.headers.get('accept', ''):
+            content_type = msgpack_type
+        else:
+            content_type = self.serializer.content_types['json']
+        return input, content_type
+
+    def process_result(self,  result, content_type:str = 'application/json'):
+        if c.is_generator(result) or inspect.isasyncgen(result):
             from sse_starlette.sse import EventSourceResponse
-            # for sse we want to wrap the generator in an eventsource response
-            result = self.generator_wrapper(result)
-            return EventSourceResponse(result)
+            # each item is its own sse event, sent as soon as it is yielded. 
+            # the generator is only advanced when the previous event was sent, 
+            # so a slow reader slows the producer down instead of filling memory
+            if inspect.isasyncgen(result):
+                result = self.async_generator_wrapper(result)
+            else:
+                result = self.generator_wrapper(result)
+            return EventSourceResponse(result, send_timeout=self.timeout)
+        elif content_type == self.serializer.content_types['msgpack']:
+            # sign the msgpack bytes directly, no json or hex step
+            result = self.serializer.serialize(result, mode='msgpack')
+            result = self.key.sign(result, return_json=True)
+            return Response(content=self.serializer.dict2msgpack(result), media_type=content_type)
         else:
             # if we are not using sse, then we can do this with json
             result = self.serializer.serialize(result)
             result = self.key.sign(result, return_json=True)
             return result
-        
-    
-    def generator_wrapper(self, generator):
 
-        for item in generator:
- 
-            # we wrap the item in a json object, just like the serializer does
-            item = self.serializer.serialize({'data': item})
-            item_size = len(str(item))
-            # we need to add a chunk start and end to the item
-            if item_size > self.chunk_size:
-                # if the item is too big, we need to chunk it
-                chunks =[item[i:i+self.chunk_size] for i in range(0, item_size, self.chunk_size)]
-                # we need to yield the chunks in a format that the eventsource response can understand
-                for chunk in chunks:
-                    yield chunk
-            else:
-                yield item
+    def stream_event(self, item, id:int, hasher) -> dict:
+        """
+        frames one item as an sse event {id, data}, where data is the json of {'data': item}.
+        the json has no raw newlines, so every event is a single data line
+        """
+        data = json.dumps(self.serializer.serialize({'data': item}))
+        hasher.update(data.encode('utf-8'))
+        return {'id': str(id), 'event': 'data', 'data': data}
 
+    def stream_end(self, n:int, hasher) -> dict:
+        """
+        the trailing event signs the sha256 of every event's data, 
+        so the stream is signed once instead of once per item
+        """
+        end = self.key.sign(json.dumps({'n': n, 'hash': hasher.hexdigest()}), return_json=True)
+        return {'id': str(n), 'event': 'end', 'data': json.dumps(end)}
 
+    def stream_error(self, e:Exception, n:int) -> dict:
+        return {'id': str(n), 'event': 'error', 'data': json.dumps(c.detailed_error(e), default=str)}
+
+    def generator_wrapper(self, generator):
+        hasher = hashlib.sha256()
+        n = 0
+        try:
+            for item in generator:
+                yield self.stream_event(item, id=n, hasher=hasher)
+                n += 1
+        except Exception as e:
+            yield self.stream_error(e, n=n)
+            return
+        yield self.stream_end(n=n, hasher=hasher)
 
+    async def async_generator_wrapper(self, generator):
+        hasher = hashlib.sha256()
+        n = 0
+        try:
+            async for item in generator:
+                yield self.stream_event(item, id=n, hasher=hasher)
+                n += 1
+        except Exception as e:
+            yield self.stream_error(e, n=n)
+            return
+        yield self.stream_end(n=n, hasher=hasher)
 
     # HISTORY 
     def add_history(self, item:dict):    
-        path = self.history_path + '/' + item['address'] + '/'+  str(item['timestamp']) 
-        self.put(path, item)
+        # buffered in memory, the history module flushes it in the background
+        self.history_module.add(item)
 
-    def set_history_path(self, history_path):
+    def set_history_path(self, history_path, history_mode:str = 'jsonl'):
         self.history_path = self.resolve_path(history_path or f'history/{self.name}')
+        self.history_module = c.module('history').get_sink(self.history_path, mode=history_mode)
         return {'history_path': self.history_path}
 
     @classmethod
@@ -290,15 +621,26 @@ class Server(c.Module):
 
     @classmethod
     def history(cls, 
-                key=None, 
+                server=None,
                 history_path='history',
+                history_mode='jsonl',
                 features=[ 'module', 'fn', 'seconds_ago', 'latency', 'address'], 
                 to_list=False,
                 **kwargs
                 ):
-        key = c.get_key(key)
-        history_path = cls.history_paths(key=key, history_path=history_path)
-        df =  c.df([cls.get(path) for path in history_path])
+        """
+        the history of the server (or every server), kwargs filter by address, fn, start and end
+        """
+        if server == None:
+            paths = [p for p in cls.ls(history_path) if os.path.isdir(p)]
+        else:
+            paths = [cls.resolve_path(f'{history_path}/{server}')]
+        history = []
+        for path in paths:
+            history += c.module('history').get_sink(path, mode=history_mode).query(**kwargs)
+        df =  c.df(history)
+        if len(df) == 0:
+            return history if to_list else df
         now = c.timestamp()
         df['seconds_ago'] = df['timestamp'].apply(lambda x: now - x)
         df = df[features]
@@ -309,7 +651,8 @@ class Server(c.Module):
     
 
     def __del__(self):
-        c.deregister_server(self.name)
+        if getattr(self, 'worker_id', 0) == 0:
+            c.deregister_server(self.name)
 
     @staticmethod
     def resolve_function_access(module):
@@ -1,6 +1,8 @@
 
 
 import commune as c
+from typing import *
+import asyncio
 
 class Test(c.Module):
 
@@ -42,3 +44,139 @@ class Test(c.Module):
         c.kill(module_name)
         return {'success': True, 'msg': 'server test passed'}
 
+
+    @classmethod
+    def test_replay(cls, module_name:str = 'module::replay', ahead:int = 1):
+        """
+        a request dated ahead seconds in the future is replayed once it has been seen
+        for longer than the staleness window (2 seconds), while it is still fresh
+        """
+        c.serve(module_name)
+        c.wait_for_server(module_name)
+        client = c.connect(module_name, virtual=False)
+        data = {'args': [], 'kwargs': {}, 'timestamp': c.timestamp() + ahead}
+        request = client.key.sign(client.serializer.serialize(data, mode='str'), return_json=True)
+        url = f'{client.address}/info/'
+        if not url.startswith('http'):
+            url = 'http://' + url
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        def send():
+            return client.loop.run_until_complete(client.process_request(url, request, headers=headers, timeout=4))
+        first = send()
+        c.sleep(2.5)
+        replay = send()
+        c.kill(module_name)
+        assert isinstance(first, dict) and 'error' not in first, first
+        assert 'Replayed' in str(replay), replay
+        return {'success': True, 'msg': 'replay test passed'}
+
+    @classmethod
+    def test_replay_threads(cls, n:int = 32, rounds:int = 20):
+        """
+        copies of a request checked at once on the threads of the executor, only one passes
+        """
+        import threading
+        from types import SimpleNamespace
+        from concurrent.futures import ThreadPoolExecutor
+        check_replay = c.module('server').check_replay
+        server = SimpleNamespace(address2signatures={}, replay_lock=threading.Lock(),
+                                 max_request_staleness=2, max_replay_addresses=4)
+        def check(address, signature):
+            try:
+                check_replay(server, address, signature, timestamp=c.timestamp())
+                return True
+            except AssertionError:
+                return False
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            for i in range(rounds):
+                # new addresses past max_replay_addresses rebuild the dict while the others insert
+                results = list(executor.map(check, [f'address{j % 8}' for j in range(n)], [f'signature{i}_{j % 8}' for j in range(n)]))
+                assert sum(results) == 8, f'{sum(results)} of {n} copies passed'
+        return {'success': True, 'msg': 'replay threads test passed'}
+
+    @classmethod
+    def benchmark(cls, 
+                  module:str = 'module', 
+                  fn:str = 'info', 
+                  concurrency:List[int] = [1, 8, 32, 128], 
+                  n:int = 256,
+                  timeout:int = 10):
+        """
+        load benchmark for the server, reports the p50/p99 latency and 
+        the calls per second at increasing concurrency
+        """
+        server_name = f'{module}::benchmark'
+        c.serve(module, tag='benchmark')
+        c.wait_for_server(server_name)
+        client = c.connect(server_name, virtual=False)
+        client.save_history = False
+
+        async def call(semaphore):
+            async with semaphore:
+                t1 = c.time()
+                result = await client.async_forward(fn=fn, timeout=timeout, verbose=False)
+                return {'latency': c.time() - t1, 'success': not c.is_error(result)}
+
+        async def run(k):
+            semaphore = asyncio.Semaphore(k)
+            return await asyncio.gather(*[call(semaphore) for _ in range(n)])
+
+        stats = []
+        for k in concurrency:
+            t1 = c.time()
+            results = c.get_event_loop().run_until_complete(run(k))
+            elapsed = c.time() - t1
+            latencies = sorted([r['latency'] for r in results])
+            stats += [{
+                'concurrency': k,
+                'calls': n,
+                'errors': sum([not r['success'] for r in results]),
+                'p50': c.round(latencies[int(0.50 * (len(latencies) - 1))], 4),
+                'p99': c.round(latencies[int(0.99 * (len(latencies) - 1))], 4),
+                'calls_per_second': c.round(n / elapsed, 4),
+            }]
+            c.print(stats[-1])
+        c.kill(server_name)
+        return c.df(stats)
+
+    def cpu(self, n:int = 1000000) -> int:
+        # a cpu bound function for benchmark_workers
+        return sum(i * i for i in range(n))
+
+    @classmethod
+    def benchmark_workers(cls, 
+                          workers:List[int] = [1, 2, 4], 
+                          fn:str = 'cpu',
+                          n:int = 64, 
+                          concurrency:int = 16,
+                          timeout:int = 60):
+        """
+        the calls per second of a cpu bound function as the number of worker processes grows, 
+        which should scale with the cores until they run out
+        """
+        stats = []
+        for w in workers:
+            server_name = f'server.test::workers{w}'
+            c.serve('server.test', tag=f'workers{w}', workers=w)
+            c.wait_for_server(server_name)
+            client = c.connect(server_name, virtual=False)
+            client.save_history = False
+
+            async def run():
+                semaphore = asyncio.Semaphore(concurrency)
+                async def call():
+                    async with semaphore:
+                        return await client.async_forward(fn=fn, timeout=timeout, verbose=False)
+                return await asyncio.gather(*[call() for _ in range(n)])
+
+            t1 = c.time()
+            results = c.get_event_loop().run_until_complete(run())
+            elapsed = c.time() - t1
+            stats += [{'workers': w, 
+                       'calls_per_second': c.round(n / elapsed, 4), 
+                       'errors': sum([c.is_error(r) for r in results])}]
+            c.print(stats[-1])
+            c.kill(server_name)
+        df = c.df(stats)
+        df['speedup'] = df['calls_per_second'] / df['calls_per_second'].iloc[0]
+        return df
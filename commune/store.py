@@ -0,0 +1,276 @@
+import commune as c
+import os
+import json
+import time
+import threading
+import collections
+import contextlib
+import hashlib
+import atexit
+import fcntl
+from typing import *
+
+class Store(c.Module):
+    """
+    The json file store behind c.put and c.get.
+
+    Reads go through an lru cache of the file text, which is checked against the
+    (inode, mtime, size) of the file, so a file is only read again once it changed.
+    Writes go to a temporary file that is renamed over the path, so a reader never
+    sees a partial file. With write_behind, puts are kept in memory and written by a
+    background thread (the last put of a path wins), and the gets of this process see them.
+    lock(path) is an exclusive file lock for read-modify-write across processes.
+    """
+    stores = {} # kwargs -> Store, one store per process
+
+    def __init__(self,
+                 max_cache:int = 10000, # the max number of files in the read cache
+                 max_cache_size:int = 100_000_000, # the max number of cached bytes
+                 flush_interval:float = 0.5, # seconds between write behind flushes
+                 fsync:bool = False, # fsync the file before it is renamed
+                 ):
+        self.max_cache = max_cache
+        self.max_cache_size = max_cache_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.cache = collections.OrderedDict() # path -> [stat_key, text, data]
+        self.cache_size = 0
+        self.pending = {} # path -> text, the write behind puts
+        self.lock_ = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flusher = None
+        self.hits = self.misses = self.writes = self.flushes = 0
+        atexit.register(self.flush)
+
+    @classmethod
+    def get_store(cls, **kwargs) -> 'Store':
+        store_key = json.dumps(kwargs, sort_keys=True)
+        if store_key not in cls.stores:
+            cls.stores[store_key] = cls(**kwargs)
+        return cls.stores[store_key]
+
+    def stat_key(self, path:str) -> tuple:
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get_text(self, path:str) -> str:
+        """
+        the text of the file, from the cache if the file did not change
+        """
+        pending = self.pending.get(path)
+        if pending != None:
+            return pending
+        stat_key = self.stat_key(path)
+        with self.lock_:
+            entry = self.cache.get(path)
+            if entry != None and entry[0] == stat_key:
+                self.cache.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        with open(path, 'r') as f:
+            text = f.read()
+        # the file could have been replaced while it was read, it is cached on the next get then
+        if self.stat_key(path) == stat_key:
+            self.cache_text(path, stat_key, text)
+        return text
+
+    def get(self, path:str, default:Any = None, copy:bool = True) -> Any:
+        """
+        the json of the file, or the default if it does not exist or is not json.
+        with copy=False the cached object is returned, which must not be changed
+        """
+        try:
+            text = self.get_text(path)
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return default
+        if not copy:
+            entry = self.cache.get(path)
+            if entry != None and entry[1] is text:
+                if entry[2] is None:
+                    entry[2] = json.loads(text)
+                return entry[2]
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            c.print(f'{path} is not json {e}', color='red')
+            return default
+
+    def cache_text(self, path:str, stat_key:tuple, text:str):
+        with self.lock_:
+            entry = self.cache.pop(path, None)
+            if entry != None:
+                self.cache_size -= len(entry[1])
+            if len(text) > self.max_cache_size:
+                return
+            self.cache[path] = [stat_key, text, None]
+            self.cache_size += len(text)
+            while len(self.cache) > self.max_cache or self.cache_size > self.max_cache_size:
+                _, entry = self.cache.popitem(last=False)
+                self.cache_size -= len(entry[1])
+
+    def put(self, path:str, data:Any, write_behind:bool = False) -> str:
+        """
+        writes the json of the data (strings are written as they are) to the path
+        """
+        text = data if isinstance(data, str) else json.dumps(data)
+        if write_behind:
+            self.pending[path] = text
+            if self.flusher == None:
+                self.flusher = c.thread(self.run_flusher, daemon=True)
+        else:
+            self.pending.pop(path, None)
+            self.write(path, text)
+        return path
+
+    def write(self, path:str, text:str):
+        dirpath, filename = os.path.split(path)
+        tmp_path = f'{dirpath}/.{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            f = open(tmp_path, 'w')
+        except FileNotFoundError:
+            os.makedirs(dirpath, exist_ok=True)
+            f = open(tmp_path, 'w')
+        with f:
+            f.write(text)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            # the rename keeps the inode and mtime, so this is the stat of our write
+            st = os.fstat(f.fileno())
+        os.replace(tmp_path, path)
+        self.writes += 1
+        self.cache_text(path, (st.st_ino, st.st_mtime_ns, st.st_size), text)
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                c.print(f'Store flush failed {c.detailed_error(e)}', color='red')
+
+    def flush(self) -> dict:
+        """
+        writes the pending puts
+        """
+        with self.flush_lock:
+            paths = list(self.pending.keys())
+            for path in paths:
+                text = self.pending.get(path)
+                if text == None:
+                    continue
+                self.write(path, text)
+                # a newer put of the path stays pending
+                if self.pending.get(path) is text:
+                    self.pending.pop(path, None)
+            self.flushes += 1
+        return {'success': True, 'flushed': len(paths)}
+
+    def exists(self, path:str) -> bool:
+        return path in self.pending or os.path.exists(path)
+
+    def rm(self, path:str) -> bool:
+        self.pending.pop(path, None)
+        with self.lock_:
+            entry = self.cache.pop(path, None)
+            if entry != None:
+                self.cache_size -= len(entry[1])
+        if os.path.isfile(path):
+            os.remove(path)
+            return True
+        return False
+
+    def clear(self):
+        with self.lock_:
+            self.cache = collections.OrderedDict()
+            self.cache_size = 0
+        return {'success': True, 'msg': 'cleared the read cache'}
+
+    def lock_path(self, path:str) -> str:
+        # the lock files are kept apart, so they never show up in the ls of a module
+        return f'{c.cache_path()}/store/locks/{hashlib.sha1(path.encode()).hexdigest()}'
+
+    @contextlib.contextmanager
+    def lock(self, path:str):
+        """
+        an exclusive lock of the path, shared with the other processes
+        """
+        lock_path = self.lock_path(path)
+        try:
+            f = open(lock_path, 'a')
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            f = open(lock_path, 'a')
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def update(self, path:str, fn:Callable, default:Any = None) -> Any:
+        """
+        sets the path to fn(value) under the lock of the path, and returns the new value
+        """
+        with self.lock(path):
+            self.flush()
+            value = fn(self.get(path, default))
+            self.put(path, value)
+        return value
+
+    def stats(self) -> dict:
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'flushes': self.flushes,
+                'pending': len(self.pending),
+                'cached': len(self.cache),
+                'cache_size': self.cache_size}
+
+    @classmethod
+    def test(cls):
+        self = cls()
+        path = cls.resolve_path('test/store.json')
+        self.rm(path)
+        assert self.get(path, 'default') == 'default'
+        self.put(path, {'a': 1})
+        assert self.get(path) == {'a': 1}
+        value = self.get(path)
+        value['a'] = 2
+        assert self.get(path) == {'a': 1}, 'the cached value was changed by a get'
+        # a write from another writer is seen through the stat check
+        with open(path, 'w') as f:
+            f.write(json.dumps({'a': 3, 'b': 4}))
+        assert self.get(path) == {'a': 3, 'b': 4}
+        self.put(path, {'a': 5}, write_behind=True)
+        assert self.get(path) == {'a': 5}
+        self.flush()
+        assert json.loads(open(path).read()) == {'a': 5}
+        self.update(path, lambda x: {**x, 'n': x.get('n', 0) + 1})
+        assert self.get(path) == {'a': 5, 'n': 1}
+        assert [f for f in os.listdir(os.path.dirname(path)) if f.endswith('.tmp')] == []
+        self.rm(path)
+        assert not self.exists(path)
+        return {'success': True, 'msg': 'store test passed', 'stats': self.stats()}
+
+    @classmethod
+    def benchmark(cls, n:int = 2000, num_paths:int = 100, size:int = 100):
+        """
+        the puts and gets per second of c.put and c.get
+        """
+        paths = [f'benchmark/store/{i}' for i in range(num_paths)]
+        value = {'data': list(range(size))}
+        results = {}
+        for write_behind in [False, True]:
+            t = c.time()
+            for i in range(n):
+                c.put(paths[i % num_paths], value, write_behind=write_behind)
+            results[f'put{"_write_behind" if write_behind else ""}'] = int(n / (c.time() - t))
+        c.flush()
+        t = c.time()
+        for i in range(n):
+            c.get(paths[i % num_paths])
+        results['get'] = int(n / (c.time() - t))
+        c.rm('benchmark/store')
+        return results
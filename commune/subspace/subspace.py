@@ -368,6 +368,8 @@ class Subspace(c.Module):
 
 
 
+    @c.cache(backend='disk', key=lambda self, name, params=None, module='SubspaceModule', block=None, netuid=None, network=None, **kwargs: \
+             [name, params, module, block, netuid, network or self.network])
     def query(self, 
               name:str,  
               params = None, 
@@ -382,25 +384,17 @@ class Subspace(c.Module):
             update=False):
         
         """
-        query a subspace storage function with params and block.
+        query a subspace storage function with params and block (cached by the params for max_age seconds,
+        in memory only if not save).
         """
 
         network = self.resolve_network(network)
-        path = f'query/{network}/{module}.{name}'
     
         params = params or []
         if not isinstance(params, list):
             params = [params]
         if netuid != None and netuid != 'all':
             params = [netuid] + params
-            
-        # we want to cache based on the params if there are any
-        if len(params) > 0 :
-            path = path + f'::params::' + '-'.join([str(p) for p in params])
-
-        value = self.get(path, None, max_age=max_age, update=update)
-        if value != None:
-            return value
         
         while trials > 0:
             try:
@@ -418,12 +412,6 @@ class Subspace(c.Module):
                 trials = trials - 1
                 if trials == 0:
                     raise e
-        
-
-
-        # if the value is a tuple then we want to convert it to a list
-        if save:
-            self.put(path, value)
 
         return value
 
@@ -1627,9 +1615,41 @@ class Subspace(c.Module):
                 max_age=1000,
                 subnet = None,
                 vector_features =['dividends', 'incentive', 'trust', 'last_update', 'emission'],
+                update = False,
                 **kwargs
                 ) -> Dict[str, 'ModuleInfo']:
-    
+
+        netuid = self.resolve_netuid(netuid or subnet)
+        network = self.resolve_network(network)
+        modules = self.modules_state(network=network,
+                                     netuid=netuid,
+                                     block=block,
+                                     features=features,
+                                     timeout=timeout,
+                                     vector_features=vector_features,
+                                     max_age=max_age,
+                                     update=update)
+        # formatted copies, so the cached modules stay raw
+        modules = [self.format_module(dict(m), fmt=fmt) for m in modules]
+
+        if search != None:
+            modules = [m for m in modules if search in m['name']]
+
+        return modules
+
+    @c.cache(backend='disk', key=['network', 'netuid', 'block', 'features'])
+    def modules_state(self,
+                      network:str,
+                      netuid:int,
+                      block: Optional[int] = None,
+                      features : List[str] = module_features,
+                      timeout = 100,
+                      vector_features =['dividends', 'incentive', 'trust', 'last_update', 'emission'],
+                      max_age = 1000,
+                      update = False) -> List[dict]:
+        """
+        the unformatted modules of the subnet, cached for max_age seconds
+        """
 
         name2feature = {
             'emission': 'Emission',
@@ -1652,66 +1672,50 @@ class Subspace(c.Module):
 
 
 
-        netuid = self.resolve_netuid(netuid or subnet)
-        network = self.resolve_network(network)
         state = {}
-        path = f'query/{network}/SubspaceModule.Modules:{netuid}'
-        modules = self.get(path, None, max_age=max_age)
-        if modules == None:
+        progress = c.tqdm(total=len(features), desc=f'Querying {features}')
+        future2key = {}
+        def query(name, **kwargs):
+            if name in vector_features:
+                fn = self.query_vector
+            else:
+                fn = self.query_map
+            name = name2feature.get(name, name)
+            return fn(name=name, **kwargs)
+        key2future = {}
+
+        while not all([f in state for f in features ]):
+            c.print(f'Querying {features}')
+            for feature in features:
+                if feature in state or feature in key2future:
+                    continue
+                future = c.submit(query, kwargs=dict(name=feature, netuid=netuid, block=block, max_age=max_age))
+                key2future[feature] = future
+            futures = list(key2future.values())
+            future2key = {v:k for k,v in key2future.items()}
+            for f in c.as_completed(futures, timeout=timeout):
+                feature = future2key[f]
+                key2future.pop(feature)
+                result = f.result()
+                if c.is_error(result):
+                    c.print('Failed: ', feature,  color='red')
+                    continue
+                progress.update(1)
+                state[feature] = f.result()
+                break
 
-            progress = c.tqdm(total=len(features), desc=f'Querying {features}')
-            future2key = {}
-            def query(name, **kwargs):
-                if name in vector_features:
-                    fn = self.query_vector
+        uid2key = state['key']
+        uids = list(uid2key.keys())
+        modules = []
+        for uid in uids:
+            module = {}
+            for feature in features:
+                if uid in state[feature] or isinstance(state[feature], list):
+                    module[feature] = state[feature][uid]
                 else:
-                    fn = self.query_map
-                name = name2feature.get(name, name)
-                return fn(name=name, **kwargs)
-            key2future = {}
-
-            while not all([f in state for f in features ]):
-                c.print(f'Querying {features}')
-                for feature in features:
-                    if feature in state or feature in key2future:
-                        continue
-                    future = c.submit(query, kwargs=dict(name=feature, netuid=netuid, block=block, max_age=max_age))
-                    key2future[feature] = future
-                futures = list(key2future.values())
-                future2key = {v:k for k,v in key2future.items()}
-                for f in c.as_completed(futures, timeout=timeout):
-                    feature = future2key[f]
-                    key2future.pop(feature)
-                    result = f.result()
-                    if c.is_error(result):
-                        c.print('Failed: ', feature,  color='red')
-                        continue
-                    progress.update(1)
-                    state[feature] = f.result()
-                    break
-
-            uid2key = state['key']
-            uids = list(uid2key.keys())
-            modules = []
-            for uid in uids:
-                module = {}
-                for feature in features:
-                    if uid in state[feature] or isinstance(state[feature], list):
-                        module[feature] = state[feature][uid]
-                    else:
-                        uid_key = uid2key[uid]
-                        module[feature] = state[feature].get(uid_key, name2default.get(uid_key, None))
-                modules.append(module)
-            self.put(path, modules)
-
-            
-        if len(modules) > 0:
-            for i in range(len(modules)):
-                modules[i] = self.format_module(modules[i], fmt=fmt)
-
-        if search != None:
-            modules = [m for m in modules if search in m['name']]
-
+                    uid_key = uid2key[uid]
+                    module[feature] = state[feature].get(uid_key, name2default.get(uid_key, None))
+            modules.append(module)
         return modules
 
     
@@ -3189,8 +3193,6 @@ class Subspace(c.Module):
         max_age = 100,
         **kwargs
     ) -> bool:
-        import torch
-
         network = self.resolve_network(network)
         netuid = self.resolve_netuid(netuid)
         key = self.resolve_key(key)
@@ -3205,42 +3207,19 @@ class Subspace(c.Module):
         modules = uids or modules
         if modules == None:
             modules = c.shuffle(self.uids(netuid=netuid, update=update))
-        # checking if the "uids" are passed as names -> strings
-        for i, module in enumerate(modules):
-            if isinstance(module, str):
-                if module in key2name:
-                    modules[i] = key2name[module]
-                elif module in name2uid:
-                    modules[i] = name2uid[module]
-                    
-        uids = modules
-        
-        if weights is None:
-            weights = [1 for _ in uids]
-        max_weight = max(weights)
-        if len(uids) < subnet_params['min_allowed_weights']:
-            n = self.n(netuid=netuid)
-            while len(uids) < subnet_params['min_allowed_weights']:
-                uid = c.choice(list(range(n)))
-                if uid not in uids:
-                    uids.append(uid)
-                    weights.append(min_value)
-
-        uid2weight = dict(sorted(zip(uids, weights), key=lambda item: item[1], reverse=True))
-        uids = list(uid2weight.keys())
-        weights = list(uid2weight.values())
-        assert len(uids) == len(weights), f"Length of uids {len(uids)} must be equal to length of weights {len(weights)}"
-        uids = torch.tensor(uids)[:n]
-        weights = torch.tensor(weights)[:n]
-        weights = weights / weights.sum() # normalize the weights between 0 and 1
-
-        # STEP 2: CLAMP THE WEIGHTS BETWEEN 0 AND 1 WITH MIN AND MAX VALUES
-        assert min_value >= 0 and max_value <= 1, f"min_value and max_value must be between 0 and 1"
-        weights = torch.clamp(weights, min_value, max_value) # min_value and max_value are between 0 and 1
-
-        weights = weights * (2**16 - 1)
-        weights = list(map(lambda x : int(min(x, U16_MAX)), weights.tolist()))
-        uids = list(map(int, uids.tolist()))
+        # the "uids" can be passed as keys or names, they are mapped with the key index
+        key2uid = {}
+        if any(isinstance(module, str) for module in modules):
+            key2uid = {**self.name2uid(netuid=netuid), **self.key2uid(netuid=netuid)}
+        votes = c.module('subspace.votes')(key2uid=key2uid).votes(uids=modules, 
+                                                                  weights=weights, 
+                                                                  n=self.n(netuid=netuid), 
+                                                                  min_weights=subnet_params['min_allowed_weights'], 
+                                                                  max_weights=n, 
+                                                                  min_value=min_value, 
+                                                                  max_value=max_value)
+        uids = votes['uids']
+        weights = votes['weights']
 
         params = {'uids': uids,
                   'weights': weights, 
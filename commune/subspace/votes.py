@@ -0,0 +1,243 @@
+import commune as c
+from typing import *
+import numpy as np
+
+U16_MAX = 2**16 - 1
+
+
+class Votes(c.Module):
+    """
+    Turns scores into the (uids, weights) of a set_weights call, with numpy only.
+    Keys are mapped to uids with a sorted key array (searchsorted), a uid given more
+    than once keeps its last weight (np.unique), the weights are padded to min_allowed_weights with random uids, truncated to the
+    max_allowed_weights largest (argpartition), normalized with every weight kept
+    within [min_value, max_value] (the excess of a capped weight goes to the others),
+    and quantized to u16 with the largest remainder method, so they sum to exactly
+    65535 (unless the cap leaves less to give).
+    """
+
+    def __init__(self, key2uid: Dict[str, int] = None):
+        self.set_index(key2uid or {})
+
+    def set_index(self, key2uid: Dict[str, int]):
+        """
+        the key index: the keys sorted, with their uids in the same order
+        """
+        keys = np.array(list(key2uid.keys()), dtype=str)
+        uids = np.array(list(key2uid.values()), dtype=np.int64)
+        order = np.argsort(keys)
+        self.sorted_keys = keys[order]
+        self.sorted_uids = uids[order]
+        return {'success': True, 'n': len(keys)}
+
+    def lookup(self, keys: Union[List[str], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        the uids of the keys, and a mask of the keys that have a uid
+        """
+        keys = np.asarray(keys, dtype=str)
+        if len(self.sorted_keys) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        idx = np.searchsorted(self.sorted_keys, keys)
+        idx = np.minimum(idx, len(self.sorted_keys) - 1)
+        found = self.sorted_keys[idx] == keys
+        return np.where(found, self.sorted_uids[idx], -1), found
+
+    def resolve_uids(self, uids: Union[list, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        the uids of a list of uids, keys and names (mapped per element), and a mask of
+        the ones that have a uid
+        """
+        if isinstance(uids, np.ndarray) and uids.dtype.kind in 'iu':
+            return uids.astype(np.int64), np.ones(len(uids), dtype=bool)
+        uids = list(uids)
+        is_key = np.array([isinstance(uid, str) for uid in uids], dtype=bool)
+        if is_key.all():
+            return self.lookup(uids)
+        resolved = np.full(len(uids), -1, dtype=np.int64)
+        found = ~is_key
+        if (~is_key).any():
+            resolved[~is_key] = [int(uid) for uid, k in zip(uids, is_key) if not k]
+        if is_key.any():
+            resolved[is_key], found[is_key] = self.lookup([uid for uid, k in zip(uids, is_key) if k])
+        return resolved, found
+
+    @staticmethod
+    def merge(uids: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        the distinct uids (sorted), each with its last weight (as a dict of the uids would)
+        """
+        unique, last = np.unique(uids[::-1], return_index=True)
+        return unique, weights[::-1][last]
+
+    @staticmethod
+    def pad(uids: np.ndarray, weights: np.ndarray, n: int, min_weights: int, value: float = 0,
+            rng: np.random.Generator = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        adds random uids of the n uids (that are not voted for) until there are min_weights
+        """
+        missing = min_weights - len(uids)
+        if missing <= 0:
+            return uids, weights
+        rng = rng or np.random.default_rng()
+        free = np.ones(n, dtype=bool)
+        free[uids[uids < n]] = False
+        candidates = np.flatnonzero(free)
+        extra = rng.choice(candidates, size=min(missing, len(candidates)), replace=False)
+        return np.concatenate([uids, extra]), np.concatenate([weights, np.full(len(extra), value, dtype=np.float64)])
+
+    @staticmethod
+    def truncate(uids: np.ndarray, weights: np.ndarray, max_weights: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        the max_weights largest weights, sorted from the largest
+        """
+        if max_weights < len(weights):
+            top = np.argpartition(-weights, max_weights - 1)[:max_weights]
+            uids, weights = uids[top], weights[top]
+        order = np.argsort(-weights, kind='stable')
+        return uids[order], weights[order]
+
+    @staticmethod
+    def normalize(weights: np.ndarray, min_value: float = 0, max_value: float = 1) -> np.ndarray:
+        """
+        the weights over their sum (equal if they sum to 0), with every weight within
+        [min_value, max_value]: a weight out of bounds is set to the bound and the rest
+        of the sum is shared by the other weights in proportion (water filling). 
+        the weights sum to 1 unless the bounds do not allow it (n * max_value < 1)
+        """
+        assert min_value >= 0 and max_value <= 1, f"min_value and max_value must be between 0 and 1"
+        weights = np.maximum(np.asarray(weights, dtype=np.float64), 0)
+        total = weights.sum()
+        weights = weights / total if total > 0 else np.full(len(weights), 1 / max(len(weights), 1))
+        fixed = np.zeros(len(weights), dtype=bool)
+        # every pass fixes at least one weight to a bound, so there are at most n passes
+        for _ in range(len(weights)):
+            over = ~fixed & (weights > max_value)
+            under = ~fixed & (weights < min_value)
+            if not (over.any() or under.any()):
+                break
+            weights[over] = max_value
+            weights[under] = min_value
+            fixed |= over | under
+            free = ~fixed
+            if not free.any():
+                break
+            rest = max(1 - weights[fixed].sum(), 0)
+            free_sum = weights[free].sum()
+            weights[free] = weights[free] * (rest / free_sum) if free_sum > 0 else rest / free.sum()
+        return np.clip(weights, min_value, max_value)
+
+    @staticmethod
+    def quantize(weights: np.ndarray, total: int = U16_MAX, max_value: float = 1) -> np.ndarray:
+        """
+        integer weights that sum to total times the sum of the weights (the weights are
+        fractions of total, rescaled if they sum to more than 1): the floor of the scaled 
+        weights, plus one for the weights with the largest remainders that stay within 
+        max_value of total
+        """
+        if len(weights) == 0:
+            return np.zeros(0, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        weight_sum = weights.sum()
+        if weight_sum <= 0:
+            weights, weight_sum = np.full(len(weights), 1 / len(weights)), 1
+        elif weight_sum > 1:
+            weights, weight_sum = weights / weight_sum, 1
+        scaled = weights * total
+        quantized = np.floor(scaled).astype(np.int64)
+        remainder = int(round(weight_sum * total)) - int(quantized.sum())
+        candidates = np.flatnonzero(quantized + 1 <= max_value * total)
+        remainder = min(remainder, len(candidates))
+        if remainder > 0:
+            top = candidates[np.argpartition(quantized[candidates] - scaled[candidates], remainder - 1)[:remainder]]
+            quantized[top] += 1
+        return quantized
+
+    def votes(self,
+              uids: Union[List[int], np.ndarray],
+              weights: Union[List[float], np.ndarray] = None,
+              n: int = None, # the number of uids of the subnet (for padding)
+              min_weights: int = 0,
+              max_weights: int = None,
+              min_value: float = 0,
+              max_value: float = 1,
+              rng: np.random.Generator = None) -> Dict[str, List[int]]:
+        """
+        the uids and u16 weights of a vote, keys in uids are mapped to their uid
+        (and dropped if they have none)
+        """
+        weights = np.ones(len(uids)) if weights is None else np.asarray(weights, dtype=np.float64)
+        assert len(uids) == len(weights), f"Length of uids {len(uids)} must be equal to length of weights {len(weights)}"
+        uids, found = self.resolve_uids(uids)
+        uids, weights = self.merge(uids[found], weights[found])
+        if n != None:
+            uids, weights = self.pad(uids, weights, n=n, min_weights=min_weights, value=min_value, rng=rng)
+        if max_weights != None:
+            uids, weights = self.truncate(uids, weights, max_weights=max_weights)
+        weights = self.quantize(self.normalize(weights, min_value=min_value, max_value=max_value), max_value=max_value)
+        return {'uids': uids.tolist(), 'weights': weights.tolist()}
+
+    @classmethod
+    def test(cls):
+        rng = np.random.default_rng(0)
+        # quantized weights sum to 65535, also for weights that do not divide evenly
+        for weights in [np.ones(3), rng.random(10000), np.array([1e-9, 1, 1]), np.zeros(4)]:
+            quantized = cls.quantize(cls.normalize(weights))
+            assert quantized.sum() == U16_MAX, quantized.sum()
+            assert quantized.min() >= 0 and quantized.max() <= U16_MAX
+        assert cls.quantize(np.array([1, 1, 1])).tolist() == [21845, 21845, 21845]
+        # padding adds distinct uids that are not voted for
+        uids, weights = cls.pad(np.array([0, 5]), np.array([1.0, 2.0]), n=10, min_weights=8, rng=rng)
+        assert len(uids) == 8 and len(set(uids.tolist())) == 8 and weights[2:].sum() == 0
+        uids, weights = cls.pad(np.array([0, 1]), np.array([1.0, 1.0]), n=3, min_weights=8, rng=rng)
+        assert sorted(uids.tolist()) == [0, 1, 2], 'padding stops at the subnet size'
+        # truncation keeps the largest weights, sorted
+        uids, weights = cls.truncate(np.arange(6), np.array([3, 1, 5, 0, 4, 2.0]), max_weights=3)
+        assert uids.tolist() == [2, 4, 0] and weights.tolist() == [5, 4, 3]
+        # keys are mapped to uids, unknown keys are dropped
+        self = cls(key2uid={'a': 3, 'b': 1, 'c': 7})
+        uids, found = self.lookup(['c', 'x', 'a'])
+        assert uids.tolist() == [7, -1, 3] and found.tolist() == [True, False, True]
+        votes = self.votes(['c', 'x', 'a'], [2, 5, 1], n=10, min_weights=3, max_weights=3, rng=rng)
+        assert votes['uids'][:2] == [7, 3] and len(votes['uids']) == 3 and sum(votes['weights']) == U16_MAX
+        # uids and keys can be mixed
+        votes = self.votes([2, 'a', 'x'], [1, 1, 1])
+        assert sorted(votes['uids']) == [2, 3], votes
+        # a uid given more than once (also as its key) is voted for once, with its last weight
+        uids, weights = cls.merge(np.array([2, 2, 3, 2]), np.array([1.0, 2.0, 3.0, 4.0]))
+        assert uids.tolist() == [2, 3] and weights.tolist() == [4, 3]
+        votes = self.votes([3, 'a', 1, 'b', 7], [5, 1, 1, 1, 2], n=10, min_weights=4, max_weights=3, rng=rng)
+        assert votes['uids'] == [7, 1, 3] and votes['weights'][1] == votes['weights'][2], votes
+        # max_value caps every weight after the normalization, the excess goes to the others
+        votes = cls().votes([0, 1], [10, 1], max_value=0.5)
+        assert votes['weights'] == [32767, 32767], votes # 65535 / 2 is capped to 32767
+        votes = cls().votes(np.arange(10), np.arange(10) ** 3, max_value=0.2)
+        assert max(votes['weights']) <= 0.2 * U16_MAX and sum(votes['weights']) == U16_MAX, votes
+        votes = cls().votes([0, 1, 2], [5, 1, 1], max_value=0.25)
+        assert max(votes['weights']) <= 0.25 * U16_MAX, 'the cap holds when the weights cannot sum to 1'
+        return {'success': True, 'msg': 'votes test passed'}
+
+    @classmethod
+    def benchmark(cls, n: int = 10000, trials: int = 20):
+        """
+        seconds per vote of n keys, with the key index and numpy, and with the loops of
+        the vote before (dict lookups, a sort of the zipped lists, a list of u16 weights)
+        """
+        rng = np.random.default_rng(0)
+        keys = [f'key{i}' for i in range(n)]
+        key2uid = {k: i for i, k in enumerate(keys)}
+        weights = rng.random(n).tolist()
+        self = cls(key2uid=key2uid)
+        t = c.time()
+        for _ in range(trials):
+            self.votes(keys, weights, n=n, min_weights=n // 2, max_weights=n // 2, rng=rng)
+        results = {'numpy': (c.time() - t) / trials}
+        t = c.time()
+        for _ in range(trials):
+            uids = [key2uid[k] for k in keys if k in key2uid]
+            uid2weight = dict(sorted(zip(uids, weights), key=lambda item: item[1], reverse=True))
+            uids, ws = list(uid2weight.keys())[:n // 2], list(uid2weight.values())[:n // 2]
+            total = sum(ws)
+            ws = [int(min(w / total * U16_MAX, U16_MAX)) for w in ws]
+        results['loops'] = (c.time() - t) / trials
+        results['speedup'] = results['loops'] / results['numpy']
+        return {k: round(v, 6) for k, v in results.items()}
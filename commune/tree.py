@@ -1,6 +1,7 @@
 import commune as c
 from typing import *
 import os
+from glob import glob
 from copy import deepcopy
 
 class Tree(c.Module):
@@ -33,6 +34,9 @@ class Tree(c.Module):
         return path2tree
     
 
+    tree2index = {} # tree -> {path: {mtime, size, simple, is_module, classes}}, kept in memory
+    index_version = 2 # entries of another version are read again
+
     @classmethod
     def tree(cls, tree = None,
                 search=None,
@@ -42,36 +46,117 @@ class Tree(c.Module):
                 ) -> List[str]:
         
         tree = tree or 'commune'
+        index = cls.index(tree=tree, update=update, max_age=max_age)
         module_tree = {}
-        path = cls.resolve_path(f'{tree}/tree')
-        max_age = 0 if update else max_age
-        module_tree =  c.get(path, {}, max_age=max_age)
-
-        if len(module_tree) == 0:
-            tree2path = cls.tree2path()
-            if tree in tree2path:
-                tree_path = tree2path[tree]
-            else:
-                assert tree in tree2path, f'{tree} not in {tree2path}'
-            # get modules from each tree
-            python_paths = c.get_module_python_paths(path=tree_path)
-            # add the modules to the module tree
-            new_tree = {c.path2simple(f, tree=tree): f for f in python_paths}
-            for k,v in new_tree.items():
-                if k not in module_tree:
-                    module_tree[k] = v
-            # to use functions like c. we need to replace it with module lol
-            
-            if cls.root_module_class in module_tree:
-                module_tree[cls.root_module_class] = module_tree.pop(cls.root_module_class)
-            
-            c.put(path, module_tree)
+        for path, entry in index.items():
+            if entry['is_module']:
+                module_tree[entry['simple']] = path
+        # to use functions like c. we need to replace it with module lol
+        if cls.root_module_class in module_tree:
+            module_tree[cls.root_module_class] = module_tree.pop(cls.root_module_class)
 
         # cache the module tree
         if search != None:
             module_tree = {k:v for k,v in module_tree.items() if search in k}
 
         return module_tree
+
+    @classmethod
+    def index(cls, tree:str = None, update:bool = False, max_age:int = 100000) -> dict:
+        """
+        the module index of the tree {path: {mtime, size, simple, is_module, classes}}.
+        it is loaded with one read, and updating it only stats the files, 
+        reading the ones whose mtime or size changed
+        """
+        tree = tree or 'commune'
+        path = cls.resolve_path(f'{tree}/index')
+        if tree not in cls.tree2index:
+            cls.tree2index[tree] = c.get(path, {}, max_age=max_age)
+            update = update or len(cls.tree2index[tree]) == 0
+        if update:
+            tree_path = cls.tree2path()[tree]
+            new_index = cls.update_index(tree_path, index=cls.tree2index[tree], tree=tree)
+            if new_index != cls.tree2index[tree] or not c.exists(path):
+                c.put(path, new_index)
+            cls.tree2index[tree] = new_index
+        return cls.tree2index[tree]
+
+    @classmethod
+    def update_index(cls, tree_path:str, index:dict = None, tree:str = None) -> dict:
+        index = index or {}
+        new_index = {}
+        for f in glob(tree_path + '/**/*.py', recursive=True):
+            if os.path.isdir(f):
+                continue
+            stat = os.stat(f)
+            entry = index.get(f, {})
+            if cls.is_stale(entry, stat):
+                entry = cls.index_file(f, tree=tree, stat=stat)
+            new_index[f] = entry
+        return new_index
+
+    @classmethod
+    def index_file(cls, path:str, tree:str = None, stat = None, end_line:int = 200, class_lines:int = 2000) -> dict:
+        stat = stat or os.stat(path)
+        with open(path, 'r', errors='ignore') as f:
+            lines = [line for _, line in zip(range(class_lines), f)]
+        initial_text = ''.join(lines[:end_line])
+        is_module = 'import commune as c' in initial_text or 'class c:' in initial_text
+        classes = []
+        for line in lines:
+            # only top level classes, nested ones (in tests) are not the module
+            if line.startswith('class ') and '(' in line and '):' in line:
+                classes.append(line.split('class ')[-1].split('(')[0].strip())
+        return {'version': cls.index_version,
+                'mtime': stat.st_mtime, 
+                'size': stat.st_size,
+                'simple': cls.path2simple(path, tree=tree) if is_module else None,
+                'is_module': is_module,
+                'classes': classes}
+
+    @classmethod
+    def is_stale(cls, entry:dict, stat) -> bool:
+        return entry.get('version') != cls.index_version or entry.get('mtime') != stat.st_mtime or entry.get('size') != stat.st_size
+
+    @classmethod
+    def path2classes(cls, path:str, tree:str = None) -> List[str]:
+        """
+        the classes of the file from the index, the file is read again if it changed
+        """
+        tree = tree or 'commune'
+        index = cls.index(tree=tree)
+        stat = os.stat(path)
+        entry = index.get(path, {})
+        if cls.is_stale(entry, stat):
+            entry = index[path] = cls.index_file(path, tree=tree, stat=stat)
+        return entry['classes']
+
+    @classmethod
+    def benchmark(cls, tree:str = None, module:str = 'server.access') -> dict:
+        """
+        building the index from scratch, loading it from disk, updating it (stats only) 
+        and a cold c.module lookup with the index loaded
+        """
+        tree = tree or 'commune'
+        stats = {}
+        cls.tree2index.pop(tree, None)
+        c.rm(cls.resolve_path(f'{tree}/index'))
+        t = c.time()
+        index = cls.index(tree=tree)
+        stats['build_seconds'] = c.time() - t
+        stats['files'] = len(index)
+        stats['modules'] = len(cls.tree(tree=tree))
+        cls.tree2index.pop(tree, None)
+        t = c.time()
+        cls.index(tree=tree)
+        stats['load_seconds'] = c.time() - t
+        t = c.time()
+        cls.index(tree=tree, update=True)
+        stats['update_seconds'] = c.time() - t
+        t = c.time()
+        c.get_module(module, cache=False)
+        stats['get_module_seconds'] = c.time() - t
+        return {k: c.round(v, 4) for k,v in stats.items()}
     
     @classmethod
     def tree_paths(cls, update=False, **kwargs) -> List[str]:
@@ -0,0 +1,311 @@
+import commune as c
+from typing import *
+import heapq
+import random
+import math
+
+
+class Scheduler(c.Module):
+    """
+    Decides which module a validator evaluates next. Every module is due at
+    last_eval + interval, and the due times are kept in a heap. The interval is
+    short when the weight estimate is uncertain (few evals or noisy scores) and
+    long when it is settled, it grows with the recent error rate, and a module
+    that keeps failing backs off exponentially. New modules (or modules whose
+    address changed) are due at once, so a registration does not wait for a full
+    pass over the namespace.
+    """
+
+    def __init__(self,
+                 min_update_interval: float = 4, # the shortest interval between two evals of a module
+                 max_update_interval: float = 60, # the interval of a module with a settled weight
+                 max_backoff: float = 600, # the longest interval of a failing module
+                 error_weight: float = 4, # the interval is multiplied by 1 + error_weight * error_rate
+                 alpha: float = 0.5, # the weight of a new score in the moving averages
+                 prior_var: float = 0.25, # the variance of the weight before any eval
+                 retry_interval: float = 30, # seconds before a module that was popped without a result is due again
+                 ):
+        self.min_update_interval = min_update_interval
+        self.max_update_interval = max_update_interval
+        self.max_backoff = max_backoff
+        self.error_weight = error_weight
+        self.alpha = alpha
+        self.prior_var = prior_var
+        self.retry_interval = retry_interval
+        self.name2state = {}
+        self.heap = [] # (due, version, name)
+        self.version = 0
+
+    def push(self, name:str, due:float):
+        # an entry is only valid while its version is the version of the state
+        self.version += 1
+        state = self.name2state[name]
+        state['due'] = due
+        state['version'] = self.version
+        heapq.heappush(self.heap, (due, self.version, name))
+
+    def sync(self, name2address:Dict[str, str], now:float = None) -> dict:
+        """
+        adds the new modules (due now) and drops the deregistered ones
+        """
+        now = c.time() if now == None else now
+        added = 0
+        for name, address in name2address.items():
+            state = self.name2state.get(name)
+            if state == None or state['address'] != address:
+                self.name2state[name] = {'address': address, 'evals': 0, 'mean': 0.0, 'var': 0.0,
+                                         'error_rate': 0.0, 'failures': 0, 'last_eval': None}
+                # new modules go ahead of the modules that are due (their due time is in the past)
+                self.push(name, due=now - self.max_backoff)
+                added += 1
+        removed = [name for name in self.name2state if name not in name2address]
+        for name in removed:
+            self.name2state.pop(name)
+        if len(self.heap) > 2 * len(self.name2state) + 64:
+            # drop the invalid entries
+            self.heap = [(due, v, n) for due, v, n in self.heap if n in self.name2state and self.name2state[n]['version'] == v]
+            heapq.heapify(self.heap)
+        return {'added': added, 'removed': len(removed), 'n': len(self.name2state)}
+
+    def pop(self, now:float = None, due_only:bool = True, max_scan:int = 64) -> Optional[str]:
+        """
+        the most urgent module that is due, or None. with due_only=False the slots are
+        not left idle: the most urgent module that can be evaluated (min_update_interval
+        since its last eval and not backing off) is returned before it is due.
+        the module is due again after retry_interval, unless update is called first
+        """
+        now = c.time() if now == None else now
+        skipped = []
+        name = None
+        while len(self.heap) > 0 and len(skipped) < max_scan:
+            due, version, candidate = heapq.heappop(self.heap)
+            state = self.name2state.get(candidate)
+            if state == None or state['version'] != version:
+                continue
+            if due <= now or (not due_only and self.ready(state, now=now)):
+                name = candidate
+                break
+            skipped.append((due, version, candidate))
+            if due_only:
+                break
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        if name != None:
+            self.push(name, due=now + self.retry_interval)
+        return name
+
+    def ready(self, state:dict, now:float) -> bool:
+        """
+        whether the module can be evaluated before it is due
+        """
+        if state['last_eval'] == None:
+            return True
+        return state['failures'] == 0 and now - state['last_eval'] >= self.min_update_interval
+
+    def due(self, now:float = None, n:int = None, due_only:bool = True) -> List[str]:
+        """
+        pops every module that is due (at most n), most urgent first
+        """
+        now = c.time() if now == None else now
+        names = []
+        while n == None or len(names) < n:
+            name = self.pop(now=now, due_only=due_only)
+            if name == None:
+                break
+            names.append(name)
+        return names
+
+    def wait_time(self, now:float = None) -> float:
+        """
+        seconds until the next module is due
+        """
+        now = c.time() if now == None else now
+        while len(self.heap) > 0:
+            due, version, name = self.heap[0]
+            state = self.name2state.get(name)
+            if state != None and state['version'] == version:
+                return max(due - now, 0)
+            heapq.heappop(self.heap)
+        return self.max_update_interval
+
+    def uncertainty(self, state:dict) -> float:
+        """
+        the std of the weight estimate: the noise left in the moving average plus
+        what is left of the prior
+        """
+        return math.sqrt(state['var'] * self.alpha / (2 - self.alpha) + self.prior_var / (1 + state['evals']))
+
+    def interval(self, state:dict) -> float:
+        u = min(self.uncertainty(state) / math.sqrt(self.prior_var), 1)
+        interval = self.min_update_interval + (self.max_update_interval - self.min_update_interval) * (1 - u)
+        interval *= 1 + self.error_weight * state['error_rate']
+        if state['failures'] > 0:
+            backoff = min(self.min_update_interval * 2 ** state['failures'], self.max_backoff)
+            interval = max(interval, backoff)
+        return interval
+
+    def update(self, name:str, w:float = 0, error:bool = False, now:float = None) -> dict:
+        """
+        records the result of an eval and schedules the next one
+        """
+        now = c.time() if now == None else now
+        state = self.name2state.get(name)
+        if state == None:
+            return None
+        a = self.alpha
+        state['error_rate'] = (1 - a) * state['error_rate'] + a * float(error)
+        if error:
+            state['failures'] += 1
+        else:
+            state['failures'] = 0
+            if state['evals'] == 0:
+                state['mean'] = w
+            else:
+                diff = w - state['mean']
+                state['mean'] += a * diff
+                state['var'] = (1 - a) * (state['var'] + a * diff ** 2)
+            state['evals'] += 1
+        state['last_eval'] = now
+        self.push(name, due=now + self.interval(state))
+        return state
+
+    def stats(self) -> dict:
+        states = list(self.name2state.values())
+        return {'n': len(states),
+                'failing': sum(s['failures'] > 0 for s in states),
+                'new': sum(s['last_eval'] == None for s in states),
+                'wait_time': c.round(self.wait_time(), 3)}
+
+    @classmethod
+    def simulate(cls,
+                 n:int = 200, # the miners at the start
+                 new:int = 50, # the miners that register during the simulation
+                 dead:float = 0.2, # the fraction of miners that time out
+                 slow:float = 0.2, # the fraction of miners that answer slowly
+                 concurrency:int = 16, # the evals in flight
+                 timeout:float = 3, # the seconds a dead miner takes
+                 duration:float = 600, # seconds of simulated time
+                 tolerance:float = 0.05, # the mean error of an accurate weight table
+                 alpha:float = 0.5,
+                 min_update_interval:float = 4,
+                 seed:int = 0):
+        """
+        runs synthetic miners (with a true weight, noisy scores, some dead or slow, some
+        registering late) through the shuffle of the epoch before the scheduler and through
+        the scheduler, in simulated time. reports the seconds until the mean error of the
+        weights of the live miners is below tolerance, and the seconds until a new miner
+        is first scored
+        """
+        results = {}
+        for policy in ['shuffle', 'priority']:
+            rng = random.Random(seed)
+            miners = {}
+            for i in range(n + new):
+                kind = rng.random()
+                miners[f'miner::{i}'] = {'w': rng.random(),
+                                         'noise': rng.uniform(0.02, 0.2),
+                                         'dead': kind < dead,
+                                         'latency': rng.uniform(0.5, 2.5) if kind < dead + slow else rng.uniform(0.05, 0.3),
+                                         'registered': 0 if i < n else rng.uniform(0, duration / 2)}
+            results[policy] = cls.run_simulation(policy, miners, rng=rng, concurrency=concurrency, timeout=timeout,
+                                                 duration=duration, tolerance=tolerance, alpha=alpha,
+                                                 min_update_interval=min_update_interval)
+        return results
+
+    @classmethod
+    def run_simulation(cls, policy:str, miners:dict, rng, concurrency:int, timeout:float, duration:float,
+                       tolerance:float, alpha:float, min_update_interval:float) -> dict:
+        scheduler = cls(min_update_interval=min_update_interval, alpha=alpha)
+        estimates = {} # name -> the moving average of the validator
+        first_eval = {}
+        last_update = {}
+        queue = [] # the shuffled pass of the epoch
+        busy = [] # (done, name)
+        dead_time = 0
+        total_time = 0
+        evals = 0
+        now = 0
+        time_to_accurate = None
+        error_curve = []
+        next_sample = 0
+
+        def registered(t):
+            return {name: name for name, m in miners.items() if m['registered'] <= t}
+
+        def pick(t):
+            if policy == 'priority':
+                scheduler.sync(registered(t), now=t)
+                return scheduler.pop(now=t, due_only=False)
+            # the epoch before the scheduler: a shuffled pass, skipping the fresh modules
+            for _ in range(2):
+                while len(queue) > 0:
+                    name = queue.pop()
+                    if t - last_update.get(name, -1e9) >= min_update_interval:
+                        last_update[name] = t
+                        return name
+                queue.extend(rng.sample(list(registered(t)), len(registered(t))))
+            return None
+
+        def mean_error(t):
+            live = [name for name, m in miners.items() if m['registered'] <= t and not m['dead']]
+            return sum(abs(estimates.get(name, 0) - miners[name]['w']) for name in live) / max(len(live), 1)
+
+        while now < duration:
+            # fill the free slots
+            while len(busy) < concurrency:
+                name = pick(now)
+                if name == None:
+                    break
+                m = miners[name]
+                cost = timeout if m['dead'] else m['latency']
+                heapq.heappush(busy, (now + cost, name))
+            # advance to the next completion (or wait for the next due module)
+            if len(busy) > 0:
+                done, name = heapq.heappop(busy)
+            else:
+                wait = scheduler.wait_time(now=now) if policy == 'priority' else min_update_interval
+                now += max(wait, 0.01)
+                continue
+            now = done
+            m = miners[name]
+            evals += 1
+            cost = timeout if m['dead'] else m['latency']
+            total_time += cost
+            if m['dead']:
+                dead_time += cost
+                scheduler.update(name, error=True, now=now)
+            else:
+                w = min(max(m['w'] + rng.gauss(0, m['noise']), 0), 1)
+                estimates[name] = w * alpha + estimates.get(name, w) * (1 - alpha)
+                scheduler.update(name, w=w, now=now)
+                first_eval.setdefault(name, now)
+            while next_sample <= now:
+                error = mean_error(next_sample)
+                error_curve.append(error)
+                if time_to_accurate == None and error < tolerance:
+                    time_to_accurate = next_sample
+                next_sample += 1
+        late = [name for name, m in miners.items() if m['registered'] > 0 and not m['dead']]
+        delays = [first_eval[name] - miners[name]['registered'] for name in late if name in first_eval]
+        return {'time_to_accurate': time_to_accurate,
+                'final_error': c.round(mean_error(duration), 4),
+                'mean_error': c.round(sum(error_curve) / max(len(error_curve), 1), 4),
+                'new_miner_delay': c.round(sum(delays) / max(len(delays), 1), 3),
+                'new_miners_unscored': len(late) - len(delays),
+                'dead_time_fraction': c.round(dead_time / max(total_time, 1e-9), 3),
+                'evals': evals}
+
+    @classmethod
+    def test(cls):
+        self = cls(min_update_interval=1, max_update_interval=10)
+        self.sync({'a': 'a:1', 'b': 'b:1'}, now=0)
+        assert set(self.due(now=0)) == {'a', 'b'}
+        self.update('a', w=0.5, now=0)
+        self.update('b', error=True, now=0)
+        self.update('b', error=True, now=0)
+        assert self.name2state['b']['due'] > self.name2state['a']['due'], 'failing modules back off'
+        self.sync({'a': 'a:1', 'b': 'b:1', 'c': 'c:1'}, now=1)
+        assert self.pop(now=1) == 'c', 'new modules go first'
+        self.sync({'a': 'a:1'}, now=1)
+        assert self.due(now=100) == ['a'], 'deregistered modules are dropped'
+        return {'success': True, 'msg': 'scheduler test passed'}
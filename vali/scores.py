@@ -0,0 +1,239 @@
+import commune as c
+from typing import *
+import numpy as np
+import threading
+import os
+
+
+class Scores(c.Module):
+    """
+    The scores of a validator as a columnar table in memory, one row per module.
+    An eval updates its row in O(1) (the weight is a moving average with alpha),
+    the leaderboard is a partial sort of the columns, and the table is saved to
+    a single file every snapshot_interval seconds (written to a temporary file and
+    renamed, so a crash never leaves half a snapshot) and loaded on startup.
+    """
+    str_columns = ['name', 'address', 'ss58_address']
+    float_columns = ['w', 'latency', 'timestamp']
+    int_columns = ['evals', 'errors']
+
+    def __init__(self,
+                 path: str = None, # the path of the snapshot (.npz)
+                 alpha: float = 1.0, # the weight of the new score in the moving average
+                 capacity: int = 1024, # the rows allocated up front (the table doubles when full)
+                 snapshot_interval: float = 60, # seconds between snapshots
+                 ):
+        self.path = path
+        self.alpha = alpha
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.last_snapshot = c.time()
+        self.allocate(capacity)
+        if path != None and os.path.exists(path):
+            self.load(path)
+
+    def allocate(self, capacity:int):
+        self.n = 0
+        self.name2row = {}
+        self.columns = {}
+        for k in self.str_columns:
+            self.columns[k] = np.empty(capacity, dtype=object)
+        for k in self.float_columns:
+            self.columns[k] = np.zeros(capacity, dtype=np.float64)
+        for k in self.int_columns:
+            self.columns[k] = np.zeros(capacity, dtype=np.int64)
+
+    def grow(self):
+        for k, v in self.columns.items():
+            column = np.empty(len(v) * 2, dtype=object) if v.dtype == object else np.zeros(len(v) * 2, dtype=v.dtype)
+            column[:self.n] = v[:self.n]
+            self.columns[k] = column
+
+    def row(self, name:str) -> Optional[dict]:
+        """
+        the row of the module, or None if it was never scored
+        """
+        row = self.name2row.get(name)
+        if row == None:
+            return None
+        return {k: v[row].item() if hasattr(v[row], 'item') else v[row] for k, v in self.columns.items()}
+
+    def update(self,
+               name:str,
+               w:float,
+               latency:float = 0,
+               timestamp:float = None,
+               address:str = None,
+               ss58_address:str = None,
+               error:bool = False) -> float:
+        """
+        adds the score of an eval to the row of the module, returning its moving average
+        """
+        with self.lock:
+            row = self.name2row.get(name)
+            if row == None:
+                if self.n == len(self.columns['w']):
+                    self.grow()
+                row = self.name2row[name] = self.n
+                self.n += 1
+                # the row can hold the values of a removed module
+                for k, v in self.columns.items():
+                    v[row] = None if v.dtype == object else 0
+                self.columns['name'][row] = name
+                self.columns['w'][row] = w
+            columns = self.columns
+            columns['w'][row] = w * self.alpha + columns['w'][row] * (1 - self.alpha)
+            columns['latency'][row] = latency
+            columns['timestamp'][row] = timestamp or c.time()
+            columns['evals'][row] += 1
+            columns['errors'][row] += int(error)
+            if address != None:
+                columns['address'][row] = address
+            if ss58_address != None:
+                columns['ss58_address'][row] = ss58_address
+            return float(columns['w'][row])
+
+    def remove(self, names:List[str]) -> int:
+        """
+        removes the rows of the names, moving the last rows into their place
+        """
+        with self.lock:
+            removed = 0
+            for name in names:
+                row = self.name2row.pop(name, None)
+                if row == None:
+                    continue
+                last = self.n - 1
+                if row != last:
+                    for v in self.columns.values():
+                        v[row] = v[last]
+                    self.name2row[self.columns['name'][row]] = row
+                self.n -= 1
+                removed += 1
+            return removed
+
+    def prune(self, max_age:float) -> int:
+        """
+        removes the modules that were not scored within max_age seconds
+        """
+        stale = c.time() - self.columns['timestamp'][:self.n] > max_age
+        return self.remove(list(self.columns['name'][:self.n][stale]))
+
+    def topk(self,
+             n:int = None,
+             sort_by:str = 'w',
+             ascending:bool = False,
+             min_weight:float = None,
+             max_age:float = None) -> np.ndarray:
+        """
+        the rows of the n best modules, sorted (argpartition, then a sort of the n rows)
+        """
+        with self.lock:
+            values = self.columns[sort_by][:self.n].astype(np.float64)
+            rows = np.arange(self.n)
+            mask = np.ones(self.n, dtype=bool)
+            if min_weight != None:
+                mask &= self.columns['w'][:self.n] > min_weight
+            if max_age != None:
+                mask &= c.time() - self.columns['timestamp'][:self.n] <= max_age
+            rows, values = rows[mask], values[mask]
+        keys = values if ascending else -values
+        if n != None and n < len(rows):
+            top = np.argpartition(keys, n - 1)[:n]
+            rows, keys = rows[top], keys[top]
+        return rows[np.argsort(keys, kind='stable')]
+
+    def records(self, rows:np.ndarray, keys:List[str] = None) -> List[dict]:
+        keys = keys or list(self.columns) + ['staleness']
+        now = c.time()
+        columns = {k: self.columns[k][rows].tolist() for k in keys if k in self.columns}
+        if 'staleness' in keys:
+            columns['staleness'] = (now - self.columns['timestamp'][rows]).tolist()
+        return [{k: columns[k][i] if k in columns else None for k in keys} for i in range(len(rows))]
+
+    def leaderboard(self,
+                    keys:List[str] = None,
+                    n:int = 50,
+                    sort_by:str = 'w',
+                    ascending:bool = False,
+                    min_weight:float = None,
+                    max_age:float = None) -> List[dict]:
+        rows = self.topk(n=n, sort_by=sort_by, ascending=ascending, min_weight=min_weight, max_age=max_age)
+        return self.records(rows, keys=keys)
+
+    def snapshot(self, path:str = None) -> dict:
+        """
+        saves the table to one file, written to a temporary file and renamed into place
+        """
+        path = path or self.path
+        with self.lock:
+            arrays = {k: v[:self.n].copy() for k, v in self.columns.items()}
+        for k in self.str_columns:
+            arrays[k] = np.array(['' if x == None else x for x in arrays[k]], dtype=str)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.last_snapshot = c.time()
+        return {'success': True, 'path': path, 'n': len(arrays['w'])}
+
+    def snapshot_due(self) -> bool:
+        return self.path != None and c.time() - self.last_snapshot > self.snapshot_interval
+
+    def load(self, path:str = None) -> dict:
+        path = path or self.path
+        with np.load(path, allow_pickle=False) as data:
+            n = len(data['w'])
+            with self.lock:
+                self.allocate(max(len(self.columns['w']), n))
+                for k in self.columns:
+                    if k not in data:
+                        continue
+                    column = data[k]
+                    if k in self.str_columns:
+                        column = np.array([None if x == '' else str(x) for x in column], dtype=object)
+                    self.columns[k][:n] = column
+                self.n = n
+                self.name2row = {name: i for i, name in enumerate(self.columns['name'][:n])}
+        return {'success': True, 'path': path, 'n': n}
+
+    def __len__(self):
+        return self.n
+
+    @classmethod
+    def test(cls, n:int = 100):
+        path = cls.resolve_path('test/scores.npz')
+        self = cls(path=path, alpha=0.5, capacity=4)
+        for i in range(n):
+            self.update(f'module::{i}', w=i, latency=0.1, ss58_address=f'key{i}')
+        assert self.update('module::1', w=3) == 2, 'w is the moving average'
+        top = self.leaderboard(keys=['name', 'w'], n=3)
+        assert [r['name'] for r in top] == [f'module::{i}' for i in [n-1, n-2, n-3]], top
+        self.snapshot()
+        restored = cls(path=path)
+        assert len(restored) == n and restored.row('module::1')['w'] == 2
+        assert restored.row('module::1')['ss58_address'] == 'key1'
+        assert self.remove(['module::0']) == 1 and self.row('module::0') == None and len(self) == n - 1
+        assert self.row(f'module::{n-1}')['w'] == n - 1, 'the moved row keeps its values'
+        os.remove(path)
+        return {'success': True, 'msg': 'scores test passed'}
+
+    @classmethod
+    def benchmark(cls, n:int = 10000, evals:int = 100000, k:int = 50):
+        """
+        evals per second and leaderboards per second with n modules
+        """
+        self = cls()
+        names = [f'module::{i}' for i in range(n)]
+        t = c.time()
+        for i in range(evals):
+            self.update(names[i % n], w=np.random.rand())
+        results = {'evals_per_second': int(evals / (c.time() - t))}
+        t = c.time()
+        for i in range(100):
+            self.leaderboard(n=k)
+        results['leaderboards_per_second'] = int(100 / (c.time() - t))
+        return results
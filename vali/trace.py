@@ -0,0 +1,294 @@
+import commune as c
+from typing import *
+import os
+import json
+import gzip
+import threading
+import functools
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Trace(c.Module):
+    """
+    The append only trace of the evals of a validator: one row per eval with the
+    module (name, key, address), the timestamp, latency, score and error, and every
+    call the score function made (fn, args, kwargs, result, latency).
+
+    Rows are buffered in memory and written as segments of segment_rows rows, each a
+    gzipped json of columns named <start_timestamp>_<pid>_<count>.json.gz (written to a
+    temporary file and renamed). rescore runs a new score function over the segments in
+    parallel processes, answering its calls with the recorded results, so a scoring
+    change can be tried on the history without calling the miners again.
+    """
+    columns = ['name', 'key', 'address', 'timestamp', 'latency', 'w', 'error', 'calls']
+
+    def __init__(self,
+                 path: str = 'traces', # the folder of the segments
+                 segment_rows: int = 1000, # the rows of a segment
+                 serializer: str = 'serializer',
+                 ):
+        self.path = self.resolve_path(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.segment_rows = segment_rows
+        self.serializer = c.module(serializer)()
+        self.buffer = []
+        self.segment_count = 0
+        self.lock = threading.Lock()
+
+    def recorder(self, module) -> 'TraceRecorder':
+        """
+        the module for the score function, recording its calls
+        """
+        return TraceRecorder(module)
+
+    def add(self, row:dict):
+        """
+        adds the row of an eval, a segment is written once there are segment_rows rows
+        """
+        row = {k: row.get(k) for k in self.columns}
+        row['calls'] = json.dumps(self.serializer.serialize(row['calls'] or [], mode='dict'), default=str)
+        with self.lock:
+            self.buffer.append(row)
+            if len(self.buffer) < self.segment_rows:
+                return
+            rows, self.buffer = self.buffer, []
+        self.write_segment(rows)
+
+    def flush(self) -> dict:
+        with self.lock:
+            rows, self.buffer = self.buffer, []
+        if len(rows) > 0:
+            self.write_segment(rows)
+        return {'success': True, 'rows': len(rows)}
+
+    def write_segment(self, rows:List[dict]) -> str:
+        self.segment_count += 1
+        filename = f'{int(rows[0]["timestamp"] or c.time())}_{os.getpid()}_{self.segment_count}.json.gz'
+        path = os.path.join(self.path, filename)
+        columns = {k: [row[k] for row in rows] for k in self.columns}
+        tmp_path = f'{self.path}/.{filename}.tmp'
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(columns, f, default=str)
+        os.replace(tmp_path, path)
+        return path
+
+    def segment_paths(self, start:float = None, end:float = None) -> List[str]:
+        """
+        the segments, oldest first (filtered by the timestamp of their first row)
+        """
+        paths = []
+        for filename in os.listdir(self.path):
+            if not filename.endswith('.json.gz'):
+                continue
+            timestamp = int(filename.split('_')[0])
+            if (start == None or timestamp >= start) and (end == None or timestamp <= end):
+                paths.append(os.path.join(self.path, filename))
+        return sorted(paths, key=lambda p: int(os.path.basename(p).split('_')[0]))
+
+    @classmethod
+    def read_segment(cls, path:str) -> Dict[str, list]:
+        with gzip.open(path, 'rt') as f:
+            return json.load(f)
+
+    def rows(self, start:float = None, end:float = None, name:str = None) -> List[dict]:
+        """
+        the rows of the segments, with the calls decoded
+        """
+        rows = []
+        for path in self.segment_paths(start=start, end=end):
+            columns = self.read_segment(path)
+            for i in range(len(columns['name'])):
+                if name != None and columns['name'][i] != name:
+                    continue
+                row = {k: columns[k][i] for k in self.columns}
+                row['calls'] = self.serializer.deserialize(json.loads(row['calls']))
+                rows.append(row)
+        return rows
+
+    # the score function of rescore, set before the workers are forked so it is never pickled
+    rescore_fn = None
+
+    @classmethod
+    def rescore_segment(cls, path:str, serializer:str = 'serializer') -> List[dict]:
+        serializer = c.module(serializer)()
+        columns = cls.read_segment(path)
+        results = []
+        for i in range(len(columns['name'])):
+            calls = serializer.deserialize(json.loads(columns['calls'][i]))
+            result = {'name': columns['name'][i], 'timestamp': columns['timestamp'][i], 'w_old': columns['w'][i]}
+            try:
+                response = cls.rescore_fn(TraceReplay(calls))
+                if isinstance(response, dict):
+                    response = response['w']
+                result['w'] = float(response)
+            except Exception as e:
+                result['w'] = 0
+                result['error'] = str(e)
+            results.append(result)
+        return results
+
+    def rescore(self,
+                score_fn: Callable,
+                processes: int = None, # the number of processes, one segment per task
+                alpha: float = 0.5, # the weight of a new score in the moving average per module
+                start: float = None,
+                end: float = None) -> dict:
+        """
+        runs score_fn over the traced evals, returning the new moving average of every module
+        next to the old one
+        """
+        self.flush()
+        paths = self.segment_paths(start=start, end=end)
+        t = c.time()
+        Trace.rescore_fn = score_fn
+        processes = processes or os.cpu_count()
+        results = []
+        if processes <= 1 or len(paths) <= 1:
+            for path in paths:
+                results += self.rescore_segment(path)
+        else:
+            with ProcessPoolExecutor(max_workers=min(processes, len(paths)),
+                                     mp_context=multiprocessing.get_context('fork')) as executor:
+                for segment_results in executor.map(self.rescore_segment, paths):
+                    results += segment_results
+        name2stats = collections.defaultdict(lambda: {'w_old': None, 'w': None, 'evals': 0, 'errors': 0})
+        for result in sorted(results, key=lambda r: r['timestamp'] or 0):
+            stats = name2stats[result['name']]
+            for k in ['w_old', 'w']:
+                if result[k] == None:
+                    continue
+                stats[k] = result[k] if stats[k] == None else result[k] * alpha + stats[k] * (1 - alpha)
+            stats['evals'] += 1
+            stats['errors'] += int('error' in result)
+        seconds = c.time() - t
+        return {'n': len(results),
+                'segments': len(paths),
+                'seconds': c.round(seconds, 3),
+                'evals_per_second': c.round(len(results) / seconds, 3) if seconds > 0 else 0,
+                'modules': dict(name2stats)}
+
+    @classmethod
+    def test(cls, n:int = 100):
+        class Miner:
+            def forward(self, a, b):
+                return a + b
+        self = cls(path='test/traces', segment_rows=10)
+        for path in self.segment_paths():
+            os.remove(path)
+        def score(module):
+            a, b = 1, 2
+            return {'w': float(module.forward(a, b) == 3)}
+        for i in range(n):
+            module = self.recorder(Miner())
+            w = score(module)['w']
+            self.add({'name': f'miner::{i % 5}', 'key': f'key{i % 5}', 'timestamp': c.time(), 'w': w, 'calls': module.calls})
+        self.flush()
+        rows = self.rows()
+        assert len(rows) == n and rows[0]['calls'][0]['fn'] == 'forward', rows[0]
+        # a stricter score function, scored on the trace
+        def strict_score(module):
+            return {'w': float(module.forward(1, 2) == 4)}
+        result = self.rescore(strict_score, processes=2)
+        assert result['n'] == n and len(result['modules']) == 5
+        assert all(m['w_old'] == 1 and m['w'] == 0 for m in result['modules'].values()), result['modules']
+        for path in self.segment_paths():
+            os.remove(path)
+        return {'success': True, 'msg': 'trace test passed'}
+
+    @classmethod
+    def benchmark(cls, n:int = 2000, processes:int = None, work:int = 20000):
+        """
+        evals per second of rescore in one process and in processes, with a score function
+        that does work steps of python per eval
+        """
+        self = cls(path='test/traces', segment_rows=100)
+        for path in self.segment_paths():
+            os.remove(path)
+        for i in range(n):
+            self.add({'name': f'miner::{i % 50}', 'timestamp': c.time(), 'w': 1,
+                      'calls': [{'fn': 'forward', 'args': [i], 'kwargs': {}, 'result': i, 'latency': 0}]})
+        def score(module):
+            x = module.forward(0)
+            for i in range(work):
+                x = (x * 31 + i) % 1000003
+            return x / 1000003
+        results = {}
+        for p in [1, processes or os.cpu_count()]:
+            results[f'processes_{p}'] = self.rescore(score, processes=p)['evals_per_second']
+        for path in self.segment_paths():
+            os.remove(path)
+        return results
+
+
+class TraceRecorder:
+    """
+    passes the calls of a score function to the module and records them
+    """
+    ignore_kwargs = ['timeout', 'return_future']
+
+    def __init__(self, module):
+        self.module = module
+        self.calls = []
+
+    def __getattr__(self, fn:str):
+        if fn.startswith('__'):
+            raise AttributeError(fn)
+        return functools.partial(self.record, fn)
+
+    def record(self, fn:str, *args, **kwargs):
+        start = c.time()
+        call = {'fn': fn, 'args': list(args), 'kwargs': {k: v for k, v in kwargs.items() if k not in self.ignore_kwargs}}
+        result = getattr(self.module, fn)(*args, **kwargs)
+        if kwargs.get('return_future', False):
+            async def record_future():
+                call['result'] = await result
+                call['latency'] = c.time() - start
+                self.calls.append(call)
+                return call['result']
+            return record_future()
+        call['result'] = result
+        call['latency'] = c.time() - start
+        self.calls.append(call)
+        return result
+
+
+class TraceReplay:
+    """
+    answers the calls of a score function with the results of a trace: a call with the
+    same fn, args and kwargs as a recorded one gets its result, any other call of fn
+    gets the next recorded result of fn
+    """
+
+    def __init__(self, calls:List[dict]):
+        self.calls = calls
+        self.call2result = {}
+        self.fn2results = collections.defaultdict(collections.deque)
+        for call in calls:
+            self.call2result[self.call_key(call['fn'], call['args'], call['kwargs'])] = call['result']
+            self.fn2results[call['fn']].append(call['result'])
+
+    @staticmethod
+    def call_key(fn:str, args:list, kwargs:dict) -> str:
+        return json.dumps([fn, list(args), kwargs], sort_keys=True, default=str)
+
+    def __getattr__(self, fn:str):
+        if fn.startswith('__'):
+            raise AttributeError(fn)
+        return functools.partial(self.replay, fn)
+
+    def replay(self, fn:str, *args, **kwargs):
+        return_future = kwargs.pop('return_future', False)
+        kwargs = {k: v for k, v in kwargs.items() if k not in TraceRecorder.ignore_kwargs}
+        key = self.call_key(fn, args, kwargs)
+        if key in self.call2result:
+            result = self.call2result[key]
+        else:
+            assert len(self.fn2results[fn]) > 0, f'{fn} has no recorded result left in the trace'
+            result = self.fn2results[fn].popleft()
+        if return_future:
+            async def future():
+                return result
+            return future()
+        return result
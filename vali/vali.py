@@ -1,6 +1,8 @@
 
 import commune as c
 from typing import *
+import asyncio
+import inspect
 
 class Vali(c.Module):
 
@@ -12,7 +14,9 @@ class Vali(c.Module):
     successes = 0  
     score_fns = ['score_module', 'score']
     whitelist = ['eval_module', 'score_module', 'eval', 'leaderboard']
-    address2last_update = {}
+    in_flight = 0
+    epochs = 0
+    epoch_stats = {}
 
 
 
@@ -60,6 +64,11 @@ class Vali(c.Module):
             c.sleep(self.config.sleep_interval)
             try:
                 self.sync()
+                if self.scores.snapshot_due():
+                    self.scores.prune(max_age=self.config.max_leaderboard_age)
+                    self.scores.snapshot()
+                    if self.trace != None:
+                        self.trace.flush()
                 run_info = self.run_info()
                 c.print(run_info)
 
@@ -98,6 +107,10 @@ class Vali(c.Module):
             'last_sent': c.round(c.time() - self.last_sent, 3),
             'last_success': c.round(c.time() - self.last_success, 3),
             'batch_size': self.config.batch_size,
+            'in_flight': self.in_flight,
+            'scheduler': self.scheduler.stats(),
+            'epochs': self.epochs,
+            **self.epoch_stats,
         }
 
     def run_info(self):
@@ -160,54 +173,94 @@ class Vali(c.Module):
     
 
     def epoch(self, batch_size = None, network=None, **kwargs):
+        """
+        evaluates every module of the namespace once, with batch_size evaluations in flight
+        """
+        loop = self.get_eval_loop()
+        return loop.run_until_complete(self.async_epoch(batch_size=batch_size, network=network))
+
+    def get_eval_loop(self) -> 'asyncio.AbstractEventLoop':
+        """
+        the loop of the evaluations, kept between epochs so the clients keep their pooled sessions
+        """
+        if getattr(self, 'eval_loop', None) == None or self.eval_loop.is_closed():
+            self.eval_loop = asyncio.new_event_loop()
+        return self.eval_loop
+
+    def get_score_executor(self):
+        """
+        the threads of the blocking score functions, created once for every epoch
+        """
+        if getattr(self, 'score_executor', None) == None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.score_executor = ThreadPoolExecutor(max_workers=self.config.threads_per_worker, thread_name_prefix='score')
+        return self.score_executor
+
+    def get_client(self, address:str) -> 'Client':
+        """
+        the client of the address, on the eval loop
+        """
+        if not hasattr(self, 'address2client'):
+            self.address2client = {}
+        if address not in self.address2client:
+            self.address2client[address] = c.connect(address, 
+                                                     key=self.key, 
+                                                     network=self.config.network, 
+                                                     virtual=False, 
+                                                     loop=self.get_eval_loop())
+        return self.address2client[address]
+
+    async def async_epoch(self, batch_size = None, network=None):
+        """
+        as many evaluations as there are modules, picked by the scheduler (the most
+        urgent first, so a module can be evaluated twice and a failing one not at all)
+        """
         self.sync(network=network)
-        futures = []
+        batch_size = batch_size or self.config.batch_size
+        n = len(self.namespace)
         results = []
-        module_addresses = c.shuffle(list(self.namespace.values()))
-        batch_size = min(self.config.batch_size, len(module_addresses))
-        self.executor = c.module('executor.thread')(max_workers=batch_size)
-        batch_size = self.config.batch_size
-    
-        for module_address in module_addresses:
-            c.sleep(self.config.sample_sleep_interval)
-            is_address = c.is_address(module_address)
-            if not is_address:
-                c.print(f'{module_address} is not a valid address', verbose=self.config.verbose)
-                continue
-
-            # if the futures are less than the batch, we can submit a new future
-            lag = c.time() - self.address2last_update.get(module_address, 0)
-            if lag < self.config.min_update_interval:
-                # c.print(f'Module {module_address} is too fresh, skipping', verbose=self.config.debug)
-                continue
-            futures.append(self.executor.submit(self.eval, args=[module_address],timeout=self.config.timeout))
-            self.address2last_update[module_address] = c.time()
-            if len(futures) >= batch_size:
-                try:
-                    for future in c.as_completed(futures,
-                                                 timeout=self.config.timeout):
-                        result = future.result()
-                        c.print(result, verbose=self.config.debug or self.config.verbose)
-                        futures.remove(future)
-                        if c.is_error(result):
-                            c.print('ERROR', result, verbose=self.config.verbose)
-                            self.errors += 1
-                        results += [result]  
-                        break
-                except Exception as e:
-                    c.print(c.detailed_error(e))
-
-        if len(futures) >= 0:
-            try:
-                for future in c.as_completed(futures, timeout=self.config.timeout):
-                    futures.remove(future) # remove the future
-                    result = future.result() # result 
-                    results += [result]  
-                    c.print(result, verbose=self.config.debug)
-            except Exception as e:
-                c.print('ERROR',c.detailed_error(e))
+        start_time = c.time()
+        started = 0
+
+        async def run_worker():
+            nonlocal started
+            while started < n:
+                name = self.scheduler.pop(due_only=False)
+                if name == None:
+                    break
+                started += 1
+                results.append(await self.eval_one(name))
+
+        await asyncio.gather(*[run_worker() for _ in range(min(batch_size, n))])
+        if started == 0:
+            # nothing can be evaluated yet, wait for the next module instead of spinning
+            await asyncio.sleep(min(self.scheduler.wait_time(), self.config.min_update_interval))
+
+        seconds = c.time() - start_time
+        self.epochs += 1
+        self.epoch_stats = {'epoch_modules': started, 
+                            'epoch_seconds': c.round(seconds, 3), 
+                            'modules_per_second': c.round(started / seconds, 3) if seconds > 0 else 0}
         return results
-        
+
+    async def eval_one(self, name:str) -> dict:
+        self.in_flight += 1
+        try:
+            # the evaluation is cancelled when it runs out of time
+            result = await asyncio.wait_for(self.async_eval(name), timeout=self.config.timeout)
+        except Exception as e:
+            # the failed scores are counted by save_score, these failed before it
+            if isinstance(e, asyncio.TimeoutError):
+                result = {'success': False, 'error': f'{name} timed out after {self.config.timeout}s', 'name': name}
+            else:
+                result = c.detailed_error(e)
+            self.errors += 1
+            self.scheduler.update(name, error=True)
+        finally:
+            self.in_flight -= 1
+        c.print(result, verbose=self.config.debug or self.config.verbose)
+        return result
+
     def network_staleness(self):
         # return the time since the last sync with the network
         return c.time() - self.last_sync_time
@@ -286,13 +339,77 @@ class Vali(c.Module):
         self.fn = fn
         self.search = search
         self.subnet = subnet
+        self.set_scores()
+        self.set_trace()
+        self.set_scheduler()
 
         return self.network_info()
     
 
     sync = set_network
 
-    
+    def set_scheduler(self):
+        """
+        the scheduler of the evals, synced with the namespace
+        """
+        if getattr(self, 'scheduler', None) == None:
+            self.scheduler = c.module('vali.scheduler')(min_update_interval=self.config.min_update_interval, 
+                                                        max_update_interval=self.config.max_update_interval, 
+                                                        max_backoff=self.config.max_backoff, 
+                                                        alpha=self.config.alpha, 
+                                                        retry_interval=self.config.timeout * 2)
+        self.scheduler.sync({k: v for k, v in self.namespace.items() if c.is_address(v)})
+        return self.scheduler
+
+    def set_scores(self):
+        """
+        the score table of the network, restored from its snapshot
+        """
+        path = self.storage_path() + '/scores.npz'
+        if getattr(self, 'scores', None) != None:
+            if self.scores.path == path:
+                return self.scores
+            self.scores.snapshot()
+        self.scores = c.module('vali.scores')(path=path, 
+                                              alpha=self.config.alpha, 
+                                              snapshot_interval=self.config.snapshot_interval)
+        return self.scores
+
+
+    def set_trace(self):
+        """
+        the trace of the evals of the network (None if config.trace is off), see rescore
+        """
+        if not self.config.get('trace', False):
+            self.trace = None
+            return self.trace
+        path = self.storage_path() + '/traces'
+        if getattr(self, 'trace', None) != None:
+            if self.trace.path == path:
+                return self.trace
+            self.trace.flush()
+        self.trace = c.module('vali.trace')(path=path, segment_rows=self.config.trace_segment_rows)
+        return self.trace
+
+    def recorder(self, module):
+        """
+        the module the score function gets, recording its calls if the evals are traced
+        """
+        if self.trace == None:
+            return module
+        return self.trace.recorder(module)
+
+    def rescore(self, score_fn:Callable = None, processes:int = None, start:float = None, end:float = None) -> dict:
+        """
+        runs score_fn (the score function of the vali by default) over the traced evals,
+        answering its calls with the recorded results instead of calling the modules
+        """
+        assert self.trace != None, 'the evals are not traced (config.trace)'
+        return self.trace.rescore(score_fn or self.score_module, 
+                                  processes=processes, 
+                                  alpha=self.config.alpha, 
+                                  start=start, 
+                                  end=end)
 
     @property
     def verbose(self):
@@ -327,7 +444,7 @@ class Vali(c.Module):
 
     
     def next_module(self):
-        return c.choice(list(self.namespace.keys()))
+        return self.scheduler.pop(due_only=False) or c.choice(list(self.namespace.keys()))
     
 
     def eval(self, module:str = None, 
@@ -342,7 +459,7 @@ class Vali(c.Module):
         """
         The following evaluates a module sver
         """
-        verbose_keys = verbose_keys or ['w', 'latency', 'name', 'address', 'ss58_address', 'path',  'staleness']
+        verbose_keys = verbose_keys or ['w', 'latency', 'name', 'address', 'ss58_address', 'staleness']
 
         verbose = verbose or self.verbose
         # load the module stats (if it exists)
@@ -356,24 +473,12 @@ class Vali(c.Module):
         self.requests += 1
         self.last_sent = c.time()
 
-        info = {}
-
-        # RESOLVE THE NAME OF THE ADDRESS IF IT IS NOT A NAME
-        if module in self.name2address:
-            info['name'] = module
-            info['address'] = self.name2address[module]
-        else:
-            assert module in self.address2name, f"{module} is not found in {self.network}"
-            info['name'] = self.address2name[module]
-            info['address'] = module
-            
+        info = self.resolve_module(module)
         # CONNECT TO THE MODULE
         module = c.connect(info['address'], key=self.key)
-        path = self.resolve_path(self.storage_path() + f"/{info['name']}")
-        cached_info = self.get(path, {})
-
-        if len(cached_info) > 0 :
-            info = cached_info
+        cached_info = self.scores.row(info['name'])
+        if cached_info != None and cached_info['ss58_address'] != None:
+            info = {**cached_info, **info}
         else:
             info = module.info(timeout=self.config.timeout)
 
@@ -381,26 +486,105 @@ class Vali(c.Module):
 
         assert 'address' in info and 'name' in info, f'Info must have a address key, got {info}'
         info['staleness'] = c.time() - info.get('timestamp', 0)
-        info['path'] = path
 
         start_time = c.time()
+        module = self.recorder(module)
         try:
             response = self.score_module(module)
             response = self.process_response(response)
         except Exception as e:
             error = c.detailed_error(e)
-            self.errors += 1
             response = {'w': 0, 'error': error}
-            verbose_keys += ['error']
 
+        return self.save_score(info, response=response, start_time=start_time, verbose=verbose, verbose_keys=verbose_keys, calls=getattr(module, 'calls', None))
+
+    async def async_eval(self, 
+                         module:str, 
+                         verbose = None, 
+                         verbose_keys = None):
+        """
+        eval on the eval loop. the calls of the module go through a pooled client, 
+        a coroutine score function is awaited and a blocking one runs on the score threads
+        """
+        verbose_keys = verbose_keys or ['w', 'latency', 'name', 'address', 'ss58_address', 'staleness']
+        verbose = verbose or self.verbose
+        self.requests += 1
+        self.last_sent = c.time()
+
+        info = self.resolve_module(module)
+        client = self.get_client(info['address'])
+        cached_info = self.scores.row(info['name'])
+        if cached_info != None and cached_info['ss58_address'] != None:
+            info = {**cached_info, **info}
+        else:
+            info = await client.async_forward(fn='info', timeout=self.config.timeout, verbose=False)
+
+        c.print(f'🚀 :: Eval Module {info["name"]} :: 🚀',  color='yellow', verbose=verbose)
+
+        assert 'address' in info and 'name' in info, f'Info must have a address key, got {info}'
+        info['staleness'] = c.time() - info.get('timestamp', 0)
+
+        start_time = c.time()
+        module = self.recorder(client.virtual())
+        try:
+            if inspect.iscoroutinefunction(self.score_module):
+                response = await self.score_module(module)
+            else:
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(self.get_score_executor(), self.score_module, module)
+            response = self.process_response(response)
+        except Exception as e:
+            error = c.detailed_error(e)
+            response = {'w': 0, 'error': error}
+
+        return self.save_score(info, response=response, start_time=start_time, verbose=verbose, verbose_keys=verbose_keys, calls=getattr(module, 'calls', None))
+
+    def resolve_module(self, module:str) -> dict:
+        """
+        the name and address of the module (given by name or address)
+        """
+        info = {}
+        if module in self.name2address:
+            info['name'] = module
+            info['address'] = self.name2address[module]
+        else:
+            assert module in self.address2name, f"{module} is not found in {self.network}"
+            info['name'] = self.address2name[module]
+            info['address'] = module
+        return info
+
+    def save_score(self, info:dict, response:dict, start_time:float, verbose=None, verbose_keys=None, calls:List[dict] = None) -> dict:
+        """
+        merges the response into the info of the module and adds it to the score table
+        (a moving average of w), and to the trace with the calls of the score function
+        """
+        verbose_keys = list(verbose_keys or ['w', 'latency', 'name', 'address', 'ss58_address', 'staleness'])
+        if 'error' in response:
+            self.errors += 1
+            verbose_keys += ['error']
         c.print(response, color='red', verbose=verbose)
+        self.scheduler.update(info['name'], w=response['w'], error='error' in response)
         response['timestamp'] = start_time
         response['latency'] = c.time() - response.get('timestamp', 0)
-        response['w'] = response['w']  * self.config.alpha + info.get('w', response['w']) * (1 - self.config.alpha)
+        if self.trace != None:
+            self.trace.add({'name': info['name'], 
+                            'key': info.get('ss58_address'), 
+                            'address': info['address'], 
+                            'timestamp': start_time, 
+                            'latency': response['latency'], 
+                            'w': response['w'], 
+                            'error': response.get('error'), 
+                            'calls': calls})
+        response['w'] = self.scores.update(info['name'], 
+                                           w=response['w'], 
+                                           latency=response['latency'], 
+                                           timestamp=start_time, 
+                                           address=info['address'], 
+                                           ss58_address=info.get('ss58_address'), 
+                                           error='error' in response)
         response['w'] = c.round(response['w'], 3)
         # merge the info with the response
         info.update(response)
-        self.put(path, info)
         response =  {k:info[k] for k in verbose_keys}
 
         # record the success statistics
@@ -452,27 +636,31 @@ class Vali(c.Module):
         return info
     
     
-    def votes(self, 
-                  
-            ):
-        network = self.config.network
-        keys = ['name', 'w', 'staleness','latency', 'ss58_address']
-        leaderboard = self.leaderboard(network=network, 
-                                       keys=keys, 
-                                       to_dict=True, 
-                                       n=self.config.max_votes)
-        votes = {'keys' : [],'weights' : [],'uids': [], 'timestamp' : c.time()  }
-        key2uid = self.subspace.key2uid() if hasattr(self, 'subspace') else {}
-        for info in leaderboard:
-            ## valid modules have a weight greater than 0 and a valid ss58_address
-            if 'ss58_address' in info and info['w'] >= 0:
-                if info['ss58_address'] in key2uid:
-                    votes['keys'] += [info['ss58_address']]
-                    votes['weights'] += [info['w']]
-                    votes['uids'] += [key2uid.get(info['ss58_address'], -1)]
-        assert len(votes['uids']) == len(votes['weights']), f'Length of uids and weights must be the same, got {len(votes["uids"])} uids and {len(votes["weights"])} weights'
-
-        return votes
+    def votes(self):
+        """
+        the keys, uids and weights of the best max_votes modules of the score table 
+        (the keys are mapped to uids with the key index of the subnet)
+        """
+        rows = self.scores.topk(n=self.config.max_votes, max_age=self.config.max_leaderboard_age)
+        keys = self.scores.columns['ss58_address'][rows]
+        weights = self.scores.columns['w'][rows]
+        uids, found = self.key_index().lookup(keys)
+        ## valid modules have a weight greater than 0 and a valid ss58_address
+        valid = found & (weights >= 0)
+        return {'keys': keys[valid].tolist(), 
+                'weights': weights[valid].tolist(), 
+                'uids': uids[valid].tolist(), 
+                'timestamp': c.time()}
+
+    def key_index(self):
+        """
+        the key -> uid index of the subnet, rebuilt after every sync
+        """
+        if getattr(self, 'key_index_time', -1) < self.last_sync_time:
+            key2uid = self.subspace.key2uid() if hasattr(self, 'subspace') else {}
+            self.key_index_module = c.module('subspace.votes')(key2uid=key2uid)
+            self.key_index_time = self.last_sync_time
+        return self.key_index_module
     
     @property
     def votes_path(self):
@@ -512,7 +700,6 @@ class Vali(c.Module):
                     keys = ['name', 'w', 
                             'staleness',
                             'latency'],
-                    path = 'cache/module_infos',
                     max_age = 3600,
                     min_weight = 0,
                     network = None,
@@ -523,52 +710,33 @@ class Vali(c.Module):
                     page = None,
                     **kwargs
                     ):
+        """
+        the best n modules of the score table (a partial sort, nothing is read from disk)
+        """
         if hasattr(self.config, 'max_leaderboard_age'):
             max_age = self.config.max_leaderboard_age
-        paths = self.module_paths(network=network)
-        df = []
-        # chunk the jobs into batches
-        for path in paths:
-            r = self.get(path, max_age=max_age)
-            if isinstance(r, dict) and 'ss58_address' in r:
-                r['staleness'] = c.time() - r.get('timestamp', 0)
-                df += [{k: r.get(k, None) for k in keys}]
-            else :
-                # removing the path as it is not a valid module and is too old
-                self.rm(path)
-        self.put(path, df) 
-        df = c.df(df) 
-        assert len(df) > 0
-        # sort_by = [s for s in sort_by if s in df.columns]
-        df = df.sort_values(by=sort_by, ascending=ascending)
-        if min_weight > 0:
-            df = df[df['w'] > min_weight]
+        sort_by = sort_by[0] if isinstance(sort_by, list) else sort_by
+        page = page or 0
+        rows = self.scores.leaderboard(keys=keys, 
+                                       n=None if n == None else n * (page + 1), 
+                                       sort_by=sort_by, 
+                                       ascending=ascending, 
+                                       min_weight=min_weight if min_weight > 0 else None, 
+                                       max_age=max_age)
         if n != None:
-            if page != None:
-                df = df[page*n:(page+1)*n]
-            else:
-                df = df[:n]
-
-        
+            rows = rows[page*n:(page+1)*n]
+        assert len(rows) > 0
         if to_dict:
-            return df.to_dict(orient='records')
+            return rows
+        return c.df(rows)
 
-        return df
-
-
-    
     l = leaderboard
     
-    def module_paths(self, network=None):
-        paths = self.ls(self.storage_path(network=network))
-        return paths
-    
-    def save_module_info(self, k:str, v:dict,):
-        path = self.storage_path() + f'/{k}'
-        self.put(path, v)
-    
-
     def __del__(self):
+        if getattr(self, 'scores', None) != None and self.scores.path != None:
+            self.scores.snapshot()
+        if getattr(self, 'trace', None) != None:
+            self.trace.flush()
         workers = self.workers()
         futures = []
         for w in workers: